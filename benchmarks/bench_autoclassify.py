@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measure auto pre-classification speed and agreement with manual labels.
+
+Usage:
+    python benchmarks/bench_autoclassify.py video_sorted --sample 500 --workers 4
+
+The sorted folder is the one the sorter writes ({name}_sorted with
+Background/ and Human/ inside). Images in Human count as human (including
+"both"), images only in Background count as background.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main_app import detect_humans, human_detection_available, init_detection_worker
+
+
+def manual_labels(sorted_folder):
+    """filename -> (path, 'human' | 'background') from a sorted folder"""
+    labels = {}
+    for label, sub in (('background', 'Background'), ('human', 'Human')):
+        folder = os.path.join(sorted_folder, sub)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                labels[name] = (os.path.join(folder, name), label)
+    return labels
+
+
+def predicted_label(score, human_threshold, background_threshold):
+    if score is None:
+        return None
+    if score >= human_threshold:
+        return 'human'
+    if score < background_threshold:
+        return 'background'
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HOG/Haar pre-classification")
+    parser.add_argument('sorted_folder', help="folder containing Background/ and Human/")
+    parser.add_argument('--sample', type=int, default=300, help="number of labelled images to score")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument('--max-side', type=int, default=512)
+    parser.add_argument('--human-threshold', type=float, default=0.5)
+    parser.add_argument('--background-threshold', type=float, default=0.15)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if not human_detection_available():
+        sys.exit("This OpenCV build has no HOG/Haar detectors")
+
+    labels = manual_labels(args.sorted_folder)
+    if not labels:
+        sys.exit("No labelled images found")
+    names = sorted(labels)
+    random.Random(args.seed).shuffle(names)
+    names = names[:args.sample]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_detection_worker) as pool:
+        results = list(pool.map(detect_humans, [labels[n][0] for n in names],
+                                [args.max_side] * len(names), chunksize=4))
+    elapsed = time.perf_counter() - start
+
+    confusion = {}
+    errors = 0
+    for name, result in zip(names, results):
+        if result.get('error'):
+            errors += 1
+        predicted = predicted_label(result['score'], args.human_threshold, args.background_threshold)
+        key = (labels[name][1], predicted)
+        confusion[key] = confusion.get(key, 0) + 1
+
+    confident = sum(v for (truth, pred), v in confusion.items() if pred is not None)
+    agreeing = sum(v for (truth, pred), v in confusion.items() if pred == truth)
+
+    print(f"Images: {len(names)}  workers: {args.workers}  max side: {args.max_side}px")
+    print(f"Throughput: {len(names) / elapsed:.1f} images/s ({elapsed:.1f} s)")
+    print(f"Coverage (confident pre-labels): {confident / len(names):.1%}")
+    if confident:
+        print(f"Agreement on confident pre-labels: {agreeing / confident:.1%}")
+    print(f"Decode/detect errors: {errors}\n")
+    print(f"{'manual':<12} {'-> human':>10} {'-> background':>14} {'-> unsure':>10}")
+    for truth in ('human', 'background'):
+        row = [confusion.get((truth, pred), 0) for pred in ('human', 'background', None)]
+        print(f"{truth:<12} {row[0]:>10} {row[1]:>14} {row[2]:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Check batched frame signatures against frame_difference, speed and agreement.
+
+Usage:
+    python benchmarks/bench_frame_signatures.py --video reel_03.mp4 --frames 2000
+    python benchmarks/bench_frame_signatures.py --size 720x576 --tolerance 1e-6
+
+Scores every consecutive pair of the first --frames frames both ways: one
+frame_difference call per pair, and FrameSignatures blocks of
+SIGNATURE_BLOCK_SIZE frames (pairs across a block boundary are scored on
+demand, as the extractor does). Without --video a grainy synthetic clip is
+written first; grain spreads the histograms, which is where reduced
+resolutions and lossy shortcuts drift. Exits with status 1 if any score
+differs by more than the tolerance.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from main_app import DEFAULT_EXTRACTION_SETTINGS, SIGNATURE_BLOCK_SIZE, FrameSignatures, frame_difference
+
+
+def make_video(path, frames, size, fps=25, scene_frames=50):
+    """Synthetic clip: blurred noise scenes panning slowly, with fresh film grain on every frame"""
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    rng = np.random.default_rng(0)
+    for i in range(frames):
+        if i % scene_frames == 0:
+            scene = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0),
+                                     rng.uniform(0.8, 6))
+            scene = cv2.normalize(scene, None, 0, 255, cv2.NORM_MINMAX)
+            grain = rng.uniform(3, 12)
+        frame = np.roll(scene, (i % scene_frames) * 4, axis=1).astype(np.int16)
+        frame += rng.normal(0, grain, (height, width, 1)).astype(np.int16)
+        writer.write(np.clip(frame, 0, 255).astype(np.uint8))
+    writer.release()
+
+
+def read_frames(path, limit):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched frame signatures against frame_difference")
+    parser.add_argument('--video', help="video to read (default: a synthetic clip)")
+    parser.add_argument('--frames', type=int, default=400, help="frames to score, all held in memory")
+    parser.add_argument('--size', default='1280x720', help="frame size of the synthetic clip")
+    parser.add_argument('--tolerance', type=float, default=1e-6, help="largest allowed score difference")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='signature_bench_')
+    try:
+        path = args.video
+        if not path:
+            path = os.path.join(work, 'synthetic.avi')
+            make_video(path, args.frames, tuple(int(v) for v in args.size.split('x')))
+        frames = read_frames(path, args.frames)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    if len(frames) < 2:
+        sys.exit("Need at least two frames")
+
+    start = time.perf_counter()
+    reference = np.array([frame_difference(frames[i], frames[i + 1]) for i in range(len(frames) - 1)])
+    pair_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = []
+    previous = None
+    for first in range(0, len(frames), SIGNATURE_BLOCK_SIZE):
+        signatures = FrameSignatures(frames[first:first + SIGNATURE_BLOCK_SIZE])
+        if previous is not None:
+            scores.append(previous.difference(len(previous.counts) - 1, signatures, 0))
+        scores.extend(signatures.consecutive_differences())
+        previous = signatures
+    block_seconds = time.perf_counter() - start
+
+    errors = np.abs(np.array(scores) - reference)
+    threshold = DEFAULT_EXTRACTION_SETTINGS['scene_threshold']
+    flips = int(np.sum((np.array(scores) >= threshold) != (reference >= threshold)))
+    height, width = frames[0].shape[:2]
+
+    print(f"Frames: {len(frames)} at {width}x{height}, block {SIGNATURE_BLOCK_SIZE}\n")
+    print(f"{'method':<20} {'ms/frame':>9} {'frames/s':>9}")
+    for method, seconds in (('frame_difference', pair_seconds), ('FrameSignatures', block_seconds)):
+        print(f"{method:<20} {seconds / len(frames) * 1000:>9.2f} {len(frames) / seconds:>9.0f}")
+    print(f"\nSpeed-up: {pair_seconds / block_seconds:.2f}x")
+    print(f"Score difference: max {errors.max():.1e}, mean {errors.mean():.1e}")
+    print(f"Decisions changed at threshold {threshold}: {flips}")
+
+    if errors.max() > args.tolerance:
+        print(f"\nScores differ by more than {args.tolerance}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
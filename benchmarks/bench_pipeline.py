@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compare the streaming pipeline with the multi-pass flow, video to sorted keyframes and crops.
+
+Usage:
+    python benchmarks/bench_pipeline.py --video reel_03.mp4 --workers 4
+    python benchmarks/bench_pipeline.py --seconds 120 --size 1920x1080
+
+The multi-pass flow is what the GUI does: extract keyframes to JPEG files,
+re-read each one for display, re-read it for pre-classification, copy it
+into Background/ or Human/, and re-open the human ones to crop proposals.
+The pipeline does the same in one pass with frames kept in memory. Without
+--video a synthetic clip is written first; it has no people in it, so use
+real footage to include the crop stage in the numbers.
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from main_app import (DEFAULT_PIPELINE_SETTINGS, CropRecipeStore, content_hash, detect_humans,
+                      extract_video_keyframes, human_detection_available, init_detection_worker,
+                      materialise_file, open_keyframe_image, person_region_proposals, read_keyframe_bytes,
+                      run_streaming_pipeline, save_image_atomic)
+
+
+def make_video(path, seconds, size, fps=25, scene_seconds=1.5):
+    """Synthetic clip: a new random scene every scene_seconds with a little motion inside each"""
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    rng = np.random.default_rng(0)
+    frames_per_scene = int(scene_seconds * fps)
+    for i in range(int(seconds * fps)):
+        if i % frames_per_scene == 0:
+            background = rng.integers(0, 256, 3).tolist()
+            shapes = [(rng.integers(0, width), rng.integers(0, height), rng.integers(20, height // 3),
+                       rng.integers(0, 256, 3).tolist()) for _ in range(12)]
+        frame = np.full((height, width, 3), background, np.uint8)
+        shift = (i % frames_per_scene) * 2
+        for x, y, radius, colour in shapes:
+            cv2.circle(frame, (int(x) + shift, int(y)), int(radius), colour, -1)
+        writer.write(frame)
+    writer.release()
+
+
+def folder_usage(folder):
+    """(files, bytes) below a folder"""
+    files = size = 0
+    for dirpath, _, filenames in os.walk(folder):
+        for name in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(dirpath, name))
+    return files, size
+
+
+def predicted_label(score, settings):
+    if score is None:
+        return None
+    if score >= settings['autoclass_human_threshold']:
+        return 'human'
+    if score < settings['autoclass_background_threshold']:
+        return 'background'
+    return None
+
+
+def run_multi_pass(video_path, settings, workers):
+    """The GUI's data path, returns ({filename: label}, crop count)"""
+    marker = extract_video_keyframes(video_path, dict(settings, keyframe_storage='files'))
+    keyframes_folder = marker['output_folder']
+    paths = [os.path.join(keyframes_folder, kf['file']) for kf in marker['keyframes']]
+
+    # Sorter display: every keyframe is decoded again at view size
+    for path in paths:
+        with open_keyframe_image(path) as img:
+            img.draft('RGB', (700, 450))
+            img.convert('RGB').thumbnail((700, 450))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_detection_worker) as pool:
+        results = list(pool.map(detect_humans, paths, [settings['autoclass_max_side']] * len(paths),
+                                chunksize=4))
+
+    sorted_folder = os.path.join(os.path.dirname(keyframes_folder), f"{Path(video_path).stem}_sorted")
+    folders = {'background': os.path.join(sorted_folder, 'Background'),
+               'human': os.path.join(sorted_folder, 'Human'),
+               'crop': os.path.join(sorted_folder, 'Cropped_Figures')}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+
+    labels = {}
+    crops = 0
+    recipes = CropRecipeStore(folders['crop'])
+    for path, result in zip(paths, results):
+        name = os.path.basename(path)
+        labels[name] = predicted_label(result['score'], settings)
+        if labels[name] is None:
+            continue
+        dst = os.path.join(folders[labels[name]], name)
+        materialise_file(path, dst, 'copy')
+        if labels[name] != 'human' or not settings['crop_people']:
+            continue
+
+        # Cropper: the image is opened for the canvas, then once more per saved crop
+        with open_keyframe_image(dst) as img:
+            img.load()
+        for n, box in enumerate(person_region_proposals(result)):
+            if box[4] < settings['crop_min_score']:
+                continue
+            data = read_keyframe_bytes(dst)
+            output = os.path.join(folders['crop'], f"{Path(name).stem}_person_{n:02d}.jpg")
+            with Image.open(io.BytesIO(data)) as img:
+                save_image_atomic(img.crop(tuple(box[:4])), output, quality=settings['jpeg_quality'])
+            recipes.add(output, dst, content_hash(data), box[:4])
+            crops += 1
+    return labels, crops
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming pipeline against the multi-pass flow")
+    parser.add_argument('--video', help="video to process (default: a synthetic clip)")
+    parser.add_argument('--seconds', type=float, default=60, help="length of the synthetic clip")
+    parser.add_argument('--size', default='1280x720', help="frame size of the synthetic clip")
+    parser.add_argument('--workers', type=int, default=max(1, min(4, (os.cpu_count() or 2) - 1)))
+    parser.add_argument('--threshold', type=float, default=DEFAULT_PIPELINE_SETTINGS['scene_threshold'])
+    parser.add_argument('--dir', default=None, help="where the outputs go (default: temp dir)")
+    args = parser.parse_args()
+
+    if not human_detection_available():
+        sys.exit("This OpenCV build has no HOG/Haar detectors")
+
+    work = tempfile.mkdtemp(prefix='pipeline_bench_', dir=args.dir)
+    os.environ['HISTORICAL_SCENE_CATALOG'] = os.path.join(work, 'catalog.sqlite3')
+    try:
+        if args.video:
+            source = os.path.abspath(args.video)
+        else:
+            source = os.path.join(work, 'synthetic.avi')
+            make_video(source, args.seconds, tuple(int(v) for v in args.size.split('x')))
+        settings = dict(DEFAULT_PIPELINE_SETTINGS, scene_threshold=args.threshold)
+
+        # Each flow gets its own folder next to its own link of the video, the video is read once to warm the cache
+        videos = {}
+        for flow in ('multi-pass', 'pipeline'):
+            os.makedirs(os.path.join(work, flow))
+            videos[flow] = os.path.join(work, flow, os.path.basename(source))
+            try:
+                os.link(source, videos[flow])
+            except OSError:
+                os.symlink(source, videos[flow])
+        with open(source, 'rb') as f:
+            while f.read(1 << 24):
+                pass
+
+        start = time.perf_counter()
+        multi_labels, multi_crops = run_multi_pass(videos['multi-pass'], settings, args.workers)
+        multi_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        report = run_streaming_pipeline(videos['pipeline'], settings, workers=args.workers)
+        pipeline_seconds = time.perf_counter() - start
+        pipeline_labels = {kf['file']: kf['predicted'] for kf in report['keyframes']}
+
+        print(f"Video: {source}  ({report['total_frames']} frames, {report['fps']:.1f} fps)")
+        print(f"Keyframes: {report['keyframes_detected']}  workers: {args.workers}\n")
+        print(f"{'flow':<12} {'seconds':>8} {'keyframes/s':>12} {'files':>7} {'MB written':>11} {'crops':>6}")
+        for flow, seconds, crops in (('multi-pass', multi_seconds, multi_crops),
+                                     ('pipeline', pipeline_seconds, report['crops'])):
+            files, size = folder_usage(os.path.join(work, flow))
+            files -= 1  # The video link
+            size -= os.path.getsize(source)
+            print(f"{flow:<12} {seconds:>8.2f} {report['keyframes_detected'] / seconds:>12.1f} {files:>7} "
+                  f"{size / 1024 / 1024:>11.1f} {crops:>6}")
+        print(f"\nSpeed-up: {multi_seconds / pipeline_seconds:.2f}x")
+
+        same_names = set(multi_labels) == set(pipeline_labels)
+        agreeing = sum(1 for name, label in pipeline_labels.items() if multi_labels.get(name) == label)
+        print(f"Same keyframes: {'yes' if same_names else 'no'}, labels agree on {agreeing}/{len(pipeline_labels)} "
+              f"(the pipeline detects on the decoded frame, the multi-pass flow on the JPEG)")
+        if not report['labels']['human']:
+            print("No keyframe was labelled human, the crop stage did not run")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compare sort materialisation strategies on a synthetic keyframe set.
+
+Usage:
+    python benchmarks/bench_sort_strategies.py --count 2000 --size-kb 800 --dir /mnt/share/bench
+
+Run it with --dir on the volume you want to measure: link and reflink
+support, and therefore the numbers, depend on the filesystem.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main_app import SORT_STRATEGY_LABELS, detect_volume_strategy, materialise_file
+
+
+def allocated_bytes(folder):
+    """Bytes newly allocated by a folder, hardlinks and symlinks count as zero"""
+    total = 0
+    for entry in os.scandir(folder):
+        st = entry.stat(follow_symlinks=False)
+        if entry.is_symlink() or st.st_nlink > 1:
+            continue
+        total += getattr(st, 'st_blocks', 0) * 512 or st.st_size
+    return total
+
+
+def make_source_set(folder, count, size_kb):
+    """Write count random keyframe-sized files"""
+    os.makedirs(folder, exist_ok=True)
+    payload = os.urandom(size_kb * 1024)
+    for i in range(count):
+        with open(os.path.join(folder, f"bench_keyframe_{i:05d}.jpg"), 'wb') as f:
+            f.write(payload[i % 97:] + payload[:i % 97])
+
+
+def run_strategy(strategy, source, dest, save_type):
+    """Sort every file once, returns (seconds, strategy used, bytes allocated)"""
+    background = os.path.join(dest, 'Background')
+    human = os.path.join(dest, 'Human')
+    os.makedirs(background)
+    os.makedirs(human)
+
+    used = None
+    start = time.perf_counter()
+    for filename in sorted(os.listdir(source)):
+        src = os.path.join(source, filename)
+        if save_type in ('background', 'both'):
+            used = materialise_file(src, os.path.join(background, filename), strategy)
+            if used == 'move':
+                src = os.path.join(background, filename)
+        if save_type in ('human', 'both'):
+            used_human = materialise_file(src, os.path.join(human, filename),
+                                          'auto' if used == 'move' else strategy)
+            used = used or used_human
+    elapsed = time.perf_counter() - start
+
+    return elapsed, used, allocated_bytes(background) + allocated_bytes(human)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sort materialisation strategies")
+    parser.add_argument('--count', type=int, default=1000, help="number of keyframes")
+    parser.add_argument('--size-kb', type=int, default=500, help="size of each keyframe")
+    parser.add_argument('--save-type', default='both', choices=('background', 'human', 'both'))
+    parser.add_argument('--dir', default=None, help="volume to benchmark on (default: temp dir)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='sort_bench_', dir=args.dir)
+    try:
+        probe_source = os.path.join(work, 'probe')
+        make_source_set(probe_source, 1, 1)
+        probe_file = os.path.join(probe_source, os.listdir(probe_source)[0])
+        print(f"Volume: {work}")
+        print(f"Detected strategy: {detect_volume_strategy(probe_file, work)}")
+        print(f"Set: {args.count} x {args.size_kb} KB, save type '{args.save_type}'\n")
+        print(f"{'strategy':<10} {'used':<10} {'files/s':>10} {'MB/s':>10} {'allocated MB':>14}")
+
+        total_mb = args.count * args.size_kb / 1024
+        for strategy in SORT_STRATEGY_LABELS:
+            source = os.path.join(work, f"src_{strategy}")
+            dest = os.path.join(work, f"dst_{strategy}")
+            make_source_set(source, args.count, args.size_kb)
+
+            elapsed, used, allocated = run_strategy(strategy, source, dest, args.save_type)
+            print(f"{strategy:<10} {used:<10} {args.count / elapsed:>10.0f} "
+                  f"{total_mb / elapsed:>10.1f} {allocated / 1024 / 1024:>14.1f}")
+
+            shutil.rmtree(source)
+            shutil.rmtree(dest)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measure sorter and cropper UI latency and peak memory on synthetic keyframe folders.
+
+Usage:
+    python benchmarks/bench_ui_latency.py --sizes 1000,10000,50000 --json results.json
+    python benchmarks/bench_ui_latency.py --sizes 10000 --thresholds thresholds.json
+
+Every size runs in its own process, so peak RSS is per size. Without a
+DISPLAY an Xvfb server is started (xvfb package). Keys are sent through
+Tk's event queue and each latency includes the redraw the key causes.
+Exits with status 1 if any metric is over its threshold.
+
+Thresholds file: {"default": {metric: limit}, "50000": {metric: limit}}, where
+size sections override the defaults for that folder size.
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_THRESHOLDS = {
+    'open_first_image_ms': 500,
+    'open_listed_ms': 5000,
+    'action_p95_ms': 50,
+    'action_max_ms': 250,
+    'crop_first_image_ms': 500,
+    'crop_next_p95_ms': 120,
+    'peak_rss_mb': 1500,
+}
+
+# Sorter keys in the order they are replayed, Right moves without sorting
+SORT_SCRIPT = ('Right', 'b', 'h', 't', 'u', 's')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def latency_summary(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {'count': len(ms), 'p50': percentile(ms, 0.5), 'p95': percentile(ms, 0.95), 'max': max(ms)}
+
+
+def make_keyframe_folder(work, count, distinct=32):
+    """count keyframe-named JPEGs, hardlinked to a few distinct 640x360 images"""
+    from PIL import Image, ImageDraw
+
+    sources = os.path.join(work, 'sources')
+    folder = os.path.join(work, 'bench_keyframes')
+    os.makedirs(sources)
+    os.makedirs(folder)
+    source_paths = []
+    for i in range(distinct):
+        img = Image.effect_noise((640, 360), 40 + i).convert('RGB')
+        draw = ImageDraw.Draw(img)
+        draw.rectangle((40 + i * 15, 60, 200 + i * 10, 300), fill=(i * 8, 120, 255 - i * 8))
+        path = os.path.join(sources, f"source_{i:02d}.jpg")
+        img.save(path, quality=90)
+        source_paths.append(path)
+
+    for i in range(count):
+        name = f"bench_keyframe_{i:05d}_{i // 60:02d}m{i % 60:02d}s.jpg"
+        try:
+            os.link(source_paths[i % distinct], os.path.join(folder, name))
+        except OSError:
+            shutil.copyfile(source_paths[i % distinct], os.path.join(folder, name))
+    return folder
+
+
+def pump_until(root, condition, timeout):
+    """Run the Tk event loop until condition() holds, returns seconds waited or None on timeout"""
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            return None
+        root.update()
+        time.sleep(0.001)
+    return time.perf_counter() - start
+
+
+def send_key(root, keysym):
+    """Seconds from key event to the end of the redraw it causes"""
+    start = time.perf_counter()
+    root.event_generate('<KeyPress>', keysym=keysym)
+    root.update()
+    return time.perf_counter() - start
+
+
+def run_single(count, actions, work, thumbnail_timeout):
+    """One folder size in this process, returns the metrics dict"""
+    import tkinter as tk
+    from main_app import HistoricalSceneApp
+
+    folder = make_keyframe_folder(work, count)
+    metrics = {'images': count}
+
+    root = tk.Tk()
+    app = HistoricalSceneApp(root)
+    root.update()
+    app.notebook.select(1)
+    root.update()
+
+    start = time.perf_counter()
+    app.load_sorting_folder(folder)
+    pump_until(root, lambda: app.sort_first_shown is not None, 60)
+    metrics['open_first_image_ms'] = (time.perf_counter() - start) * 1000
+    pump_until(root, lambda: app.sort_indexer is None, 600)
+    metrics['open_listed_ms'] = (time.perf_counter() - start) * 1000
+    waited = pump_until(root, lambda: len(app.sort_thumbnail_tiles) >= count, thumbnail_timeout)
+    metrics['thumbnails_ms'] = (time.perf_counter() - start) * 1000 if waited is not None else None
+
+    by_key = {key: [] for key in SORT_SCRIPT}
+    for i in range(actions):
+        key = SORT_SCRIPT[i % len(SORT_SCRIPT)]
+        by_key[key].append(send_key(root, key))
+    pump_until(root, lambda: app.sort_file_queue.depth() == 0, 120)
+    every = [s for seconds in by_key.values() for s in seconds]
+    metrics['actions'] = {key: latency_summary(seconds) for key, seconds in by_key.items()}
+    metrics['action_p50_ms'] = percentile([s * 1000 for s in every], 0.5)
+    metrics['action_p95_ms'] = percentile([s * 1000 for s in every], 0.95)
+    metrics['action_max_ms'] = max(every) * 1000
+
+    # The cropper opens the same folder, so its size matches the sorter's
+    app.notebook.select(2)
+    root.update()
+    start = time.perf_counter()
+    app.load_cropping_folder(folder)
+    pump_until(root, lambda: bool(app.crop_images), 60)
+    metrics['crop_first_image_ms'] = (time.perf_counter() - start) * 1000
+    pump_until(root, lambda: app.crop_indexer is None, 600)
+    crop_next = [send_key(root, 'Right') for _ in range(min(actions, count - 1))]
+    metrics['crop_next_p50_ms'] = percentile([s * 1000 for s in crop_next], 0.5)
+    metrics['crop_next_p95_ms'] = percentile([s * 1000 for s in crop_next], 0.95)
+
+    app.on_close()
+    # ru_maxrss is KB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    metrics['peak_rss_mb'] = rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return metrics
+
+
+def start_xvfb():
+    """Start Xvfb on a free display, returns (process, display)"""
+    if not shutil.which('Xvfb'):
+        sys.exit("No DISPLAY and no Xvfb, install xvfb or run inside an X session")
+    for number in range(99, 200):
+        if not os.path.exists(f"/tmp/.X{number}-lock"):
+            break
+    process = subprocess.Popen(['Xvfb', f':{number}', '-screen', '0', '1400x1000x24', '-nolisten', 'tcp'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while not os.path.exists(f"/tmp/.X11-unix/X{number}"):
+        if process.poll() is not None or time.time() > deadline:
+            process.kill()
+            sys.exit("Xvfb did not start")
+        time.sleep(0.05)
+    return process, f":{number}"
+
+
+def load_thresholds(path):
+    """size -> thresholds, from DEFAULT_THRESHOLDS and an optional file"""
+    sections = {}
+    if path:
+        with open(path, encoding='utf-8') as f:
+            sections = json.load(f)
+    defaults = dict(DEFAULT_THRESHOLDS, **sections.get('default', {}))
+    return lambda size: dict(defaults, **sections.get(str(size), {}))
+
+
+def check_thresholds(metrics, thresholds):
+    """[(metric, value, limit)] for every metric over its limit"""
+    return [(name, metrics[name], limit) for name, limit in thresholds.items()
+            if metrics.get(name) is not None and metrics[name] > limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sorter and cropper UI latency under Xvfb")
+    parser.add_argument('--sizes', default='1000,10000,50000', help="comma-separated folder sizes")
+    parser.add_argument('--actions', type=int, default=300, help="scripted key presses per size")
+    parser.add_argument('--thumbnail-timeout', type=float, default=600,
+                        help="seconds to wait for the full gallery")
+    parser.add_argument('--thresholds', help="JSON file overriding the default limits")
+    parser.add_argument('--json', help="write all results to this file")
+    parser.add_argument('--dir', default=None, help="where the synthetic folders go (default: temp dir)")
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        work = tempfile.mkdtemp(prefix='ui_bench_', dir=args.dir)
+        # Neither the user's catalog nor their extraction queue takes part in the measurement
+        os.environ['HISTORICAL_SCENE_CATALOG'] = os.path.join(work, 'catalog.sqlite3')
+        os.environ['HISTORICAL_SCENE_QUEUE'] = os.path.join(work, 'queue')
+        try:
+            metrics = run_single(args.single, args.actions, work, args.thumbnail_timeout)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        print(json.dumps(metrics))
+        return
+
+    xvfb = None
+    env = dict(os.environ)
+    if not env.get('DISPLAY'):
+        xvfb, env['DISPLAY'] = start_xvfb()
+
+    thresholds_for = load_thresholds(args.thresholds)
+    results, failures = [], []
+    try:
+        for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+            command = [sys.executable, os.path.abspath(__file__), '--single', str(size),
+                       '--actions', str(args.actions), '--thumbnail-timeout', str(args.thumbnail_timeout)]
+            if args.dir:
+                command += ['--dir', args.dir]
+            output = subprocess.run(command, env=env, capture_output=True, text=True)
+            if output.returncode != 0:
+                sys.exit(f"Run with {size} images failed:\n{output.stderr}")
+            metrics = json.loads(output.stdout.strip().splitlines()[-1])
+            results.append(metrics)
+            failures += [(size,) + failure for failure in check_thresholds(metrics, thresholds_for(size))]
+    finally:
+        if xvfb:
+            xvfb.terminate()
+
+    print(f"{'images':>7} {'first img':>10} {'listed':>9} {'thumbs':>9} {'key p50':>8} {'key p95':>8} "
+          f"{'key max':>8} {'crop p95':>9} {'RSS MB':>8}")
+    for m in results:
+        thumbs = f"{m['thumbnails_ms'] / 1000:>8.1f}s" if m['thumbnails_ms'] is not None else f"{'timeout':>9}"
+        print(f"{m['images']:>7} {m['open_first_image_ms']:>8.0f}ms {m['open_listed_ms']:>7.0f}ms {thumbs} "
+              f"{m['action_p50_ms']:>6.1f}ms {m['action_p95_ms']:>6.1f}ms {m['action_max_ms']:>6.0f}ms "
+              f"{m['crop_next_p95_ms']:>7.1f}ms {m['peak_rss_mb']:>8.0f}")
+    print("\nPer key p95 (ms): " + ", ".join(
+        f"{m['images']}: " + " ".join(f"{key}={s['p95']:.1f}" for key, s in m['actions'].items() if s['count'])
+        for m in results))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'results': results, 'failures': failures}, f, indent=2)
+
+    if failures:
+        print("\nThreshold regressions:")
+        for size, name, value, limit in failures:
+            print(f"  {size} images: {name} = {value:.1f} > {limit}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
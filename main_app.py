@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import time
+STARTUP_MARKS = [('start', time.perf_counter())]  # Startup timeline, see profile-startup
 if sys.platform == 'win32':
     import locale
     if sys.stdout and sys.stdout.encoding != 'utf-8':
@@ -12,15 +14,4059 @@ if sys.platform == 'win32':
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import cv2
+STARTUP_MARKS.append(('import tkinter', time.perf_counter()))
 import os
 import sys
-import numpy as np
 from pathlib import Path
-from PIL import Image, ImageTk
 import shutil
 import json
 import threading
+import errno
+import queue
+import math
+import multiprocessing
+import argparse
+import bisect
+import hashlib
+import io
+import itertools
+import re
+import tarfile
+import base64
+import mmap
+import sqlite3
+import select
+import signal
+import struct
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+STARTUP_MARKS.append(('import standard library', time.perf_counter()))
+
+
+def import_heavy_module(name):
+    """Plain import statements, so PyInstaller still bundles the lazy modules"""
+    if name == 'cv2':
+        import cv2 as module
+    elif name == 'numpy':
+        import numpy as module
+    elif name == 'PIL.Image':
+        from PIL import Image as module
+    elif name == 'PIL.ImageTk':
+        from PIL import ImageTk as module
+    else:
+        raise ImportError(f"no lazy import for {name}")
+    return module
+
+
+class LazyModule:
+    """Module stand-in that imports the real module on first attribute access"""
+    
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+    
+    # Underscored: a public name here would hide the module's own, e.g. numpy.load
+    def _import(self):
+        """Import the module now, returns (module, seconds spent importing)"""
+        module = self.__dict__['_module']
+        if module is not None:
+            return module, 0.0
+        start = time.perf_counter()
+        module = import_heavy_module(self.__dict__['_name'])
+        self.__dict__['_module'] = module
+        return module, time.perf_counter() - start
+    
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = self._import()[0]
+        return getattr(module, attr)
+    
+    def __setattr__(self, attr, value):
+        setattr(self._import()[0], attr, value)
+
+
+# OpenCV, NumPy and PIL take most of the import time, nothing touches them
+# until the first video, image or thumbnail is opened
+cv2 = LazyModule('cv2')
+np = LazyModule('numpy')
+Image = LazyModule('PIL.Image')
+ImageTk = LazyModule('PIL.ImageTk')
+HEAVY_MODULES = (cv2, np, Image, ImageTk)
+
+
+def preload_heavy_modules():
+    """Import the lazy modules, returns [(name, seconds)] for the ones imported here"""
+    timings = []
+    for module in HEAVY_MODULES:
+        seconds = module._import()[1]
+        if seconds:
+            timings.append((module.__dict__['_name'], seconds))
+    return timings
+
+
+def mark_startup(label):
+    """Add a point to the startup timeline"""
+    STARTUP_MARKS.append((label, time.perf_counter()))
+
+
+# How sorted keyframes are materialised in the Background/Human folders
+SORT_STRATEGY_LABELS = {
+    'auto': '自动',
+    'reflink': '写时复制',
+    'hardlink': '硬链接',
+    'symlink': '符号链接',
+    'move': '移动',
+    'copy': '复制'
+}
+
+# Per-volume capability cache: (source device, destination device) -> strategy
+_volume_strategy_cache = {}
+
+
+def reflink_file(src, dst):
+    """Clone src to dst sharing data blocks (Btrfs/XFS/APFS), raise OSError if unsupported"""
+    if sys.platform.startswith('linux'):
+        import fcntl
+        FICLONE = 0x40049409
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except OSError:
+                fdst.close()
+                os.remove(dst)
+                raise
+        shutil.copystat(src, dst)
+    elif sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), dst)
+    else:
+        raise OSError(errno.EOPNOTSUPP, "reflink not supported on this platform", dst)
+
+
+def detect_volume_strategy(src, dest_folder):
+    """Find the cheapest zero-copy strategy between src's volume and dest_folder's volume"""
+    try:
+        key = (os.stat(src).st_dev, os.stat(dest_folder).st_dev)
+    except OSError:
+        return 'copy'
+    if key in _volume_strategy_cache:
+        return _volume_strategy_cache[key]
+    
+    # Probe with the real source file, the probe is removed right away
+    probe = os.path.join(dest_folder, f".strategy_probe_{os.getpid()}")
+    strategy = 'copy'
+    for candidate, func in (('reflink', reflink_file), ('hardlink', os.link)):
+        try:
+            func(src, probe)
+            strategy = candidate
+            break
+        except OSError:
+            continue
+        finally:
+            if os.path.lexists(probe):
+                os.remove(probe)
+    
+    _volume_strategy_cache[key] = strategy
+    return strategy
+
+
+KEYFRAME_STORAGE_LABELS = {'files': '图像文件', 'pack': '打包文件', 'reference': '引用模式'}
+KEYFRAME_REFS_FILENAME = '.keyframe_refs.jsonl'
+_keyframe_refs_cache = {}  # folder -> (manifest mtime, refs)
+_frame_decoder_pool = None
+
+
+class KeyframeRefWriter:
+    """Reference-mode extraction output: frame index and timestamp instead of a JPEG.
+    
+    The manifest is a JSONL file in the keyframes folder, a header line with
+    the source video followed by one line per keyframe. Each line carries a
+    small JPEG thumbnail so the sorter gallery needs no video decoding.
+    """
+    
+    def __init__(self, folder, video_path, fps, jpeg_quality, thumbnail_size=(100, 80)):
+        self.thumbnail_size = thumbnail_size
+        self.file = open(os.path.join(folder, KEYFRAME_REFS_FILENAME), 'w', encoding='utf-8')
+        try:
+            video = os.path.relpath(video_path, folder)
+        except ValueError:
+            video = os.path.abspath(video_path)
+        self.write({'video': video, 'video_abs': os.path.abspath(video_path),
+                    'fps': fps, 'jpeg_quality': jpeg_quality})
+    
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+    
+    def add(self, filename, frame_index, timestamp, frame):
+        """Record one keyframe, frame is the decoded BGR frame"""
+        height, width = frame.shape[:2]
+        ok, encoded = cv2.imencode('.jpg', frame_thumbnail(frame, self.thumbnail_size),
+                                   [cv2.IMWRITE_JPEG_QUALITY, 80])
+        self.write({'file': filename, 'frame': frame_index, 'timestamp': timestamp,
+                    'size': [width, height],
+                    'thumb': base64.b64encode(encoded.tobytes()).decode('ascii') if ok else None})
+    
+    def close(self):
+        self.file.close()
+
+
+def load_keyframe_refs(folder):
+    """Reference manifest of a keyframes folder: {'video', 'jpeg_quality', 'frames': {name: entry}} or None"""
+    path = os.path.join(folder, KEYFRAME_REFS_FILENAME)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    mtime = (st.st_mtime_ns, st.st_size)
+    cached = _keyframe_refs_cache.get(folder)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    
+    refs = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Torn last line while extraction is still running
+            if refs is None:
+                # Prefer the path relative to the folder, so a moved project keeps working
+                video = os.path.normpath(os.path.join(folder, record['video']))
+                if not os.path.exists(video):
+                    video = record.get('video_abs', video)
+                refs = {'video': video, 'jpeg_quality': record.get('jpeg_quality', 95), 'frames': {}}
+            else:
+                refs['frames'][record['file']] = record
+    _keyframe_refs_cache[folder] = (mtime, refs)
+    return refs
+
+
+def keyframe_reference(path):
+    """(refs, entry) if path names a reference-mode keyframe, else None"""
+    refs = load_keyframe_refs(os.path.dirname(path))
+    if refs:
+        entry = refs['frames'].get(os.path.basename(path))
+        if entry:
+            return refs, entry
+    return None
+
+
+class FrameDecoderPool:
+    """Random access to video frames for reference-mode keyframes.
+    
+    A few decoders are kept open per video, each remembering where it is: a
+    request shortly ahead of a decoder is reached by grabbing forward (no
+    seek), anything else seeks the least recently used idle decoder.
+    Decoded frames are kept in an LRU bounded by memory.
+    """
+    
+    def __init__(self, decoders_per_video=2, forward_limit=90, cache_bytes=256 * 1024 * 1024):
+        self.decoders_per_video = decoders_per_video
+        self.forward_limit = forward_limit
+        self.cache_bytes = cache_bytes
+        self.condition = threading.Condition()
+        self.decoders = {}  # video -> [{'cap', 'next', 'busy', 'used'}]
+        self.frames = OrderedDict()  # (video, frame) -> RGB image
+        self.frame_bytes = 0
+    
+    def acquire(self, video, index):
+        with self.condition:
+            while True:
+                decoders = self.decoders.setdefault(video, [])
+                idle = [d for d in decoders if not d['busy']]
+                ahead = [d for d in idle if 0 <= index - d['next'] <= self.forward_limit]
+                if ahead:
+                    decoder = min(ahead, key=lambda d: index - d['next'])
+                elif len(decoders) < self.decoders_per_video:
+                    cap = cv2.VideoCapture(video)
+                    if not cap.isOpened():
+                        raise IOError(f"cannot open video: {video}")
+                    decoder = {'cap': cap, 'next': 0}
+                    decoders.append(decoder)
+                elif idle:
+                    decoder = min(idle, key=lambda d: d['used'])
+                else:
+                    self.condition.wait()
+                    continue
+                decoder['busy'] = True
+                decoder['used'] = time.monotonic()
+                return decoder
+    
+    def release(self, decoder):
+        with self.condition:
+            decoder['busy'] = False
+            self.condition.notify()
+    
+    def read_forward(self, cap, decoder, video, index):
+        """Grab forward from the decoder's position to frame index and decode it"""
+        while decoder['next'] < index:
+            if not cap.grab():
+                break
+            decoder['next'] += 1
+        ret, frame = cap.read()
+        if not ret:
+            decoder['next'] = -self.forward_limit - 1  # Position unknown, seek next time
+            raise IOError(f"cannot decode frame {index} of {video}")
+        decoder['next'] = index + 1
+        return frame
+    
+    def landed_on(self, cap, timestamp):
+        """Whether the frame just decoded after a seek is the one at timestamp (seconds)"""
+        # CAP_PROP_POS_FRAMES only echoes the seek target on FFmpeg; POS_MSEC comes
+        # from the decoded frame itself (0 when the stream has no timestamps)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        tolerance = 500 / fps if fps > 0 else 20  # Half a frame, in ms
+        return abs(cap.get(cv2.CAP_PROP_POS_MSEC) - timestamp * 1000) < tolerance
+    
+    def get_frame(self, video, index, timestamp=None):
+        """Frame index of video as an RGB image (a copy the caller may modify).
+        
+        timestamp, the frame's time in seconds from the manifest, verifies
+        where a seek landed; without it the seek is trusted.
+        """
+        key = (video, index)
+        with self.condition:
+            image = self.frames.get(key)
+            if image is not None:
+                self.frames.move_to_end(key)
+                return image.copy()
+        
+        decoder = self.acquire(video, index)
+        try:
+            cap = decoder['cap']
+            seeked = not 0 <= index - decoder['next'] <= self.forward_limit
+            if seeked:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+                decoder['next'] = index
+            frame = self.read_forward(cap, decoder, video, index)
+            if seeked and timestamp is not None and not self.landed_on(cap, timestamp):
+                # Frame seeks are not exact for every codec and container: reopen and
+                # grab forward from the first frame, slow but exact
+                if not cap.open(video):
+                    decoder['next'] = -self.forward_limit - 1
+                    raise IOError(f"cannot open video: {video}")
+                decoder['next'] = 0
+                frame = self.read_forward(cap, decoder, video, index)
+        finally:
+            self.release(decoder)
+        
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        with self.condition:
+            self.frames[key] = image
+            self.frame_bytes += image.width * image.height * 3
+            while self.frame_bytes > self.cache_bytes and len(self.frames) > 1:
+                _, dropped = self.frames.popitem(last=False)
+                self.frame_bytes -= dropped.width * dropped.height * 3
+        return image.copy()
+
+
+def get_frame_decoder_pool():
+    global _frame_decoder_pool
+    if _frame_decoder_pool is None:
+        _frame_decoder_pool = FrameDecoderPool()
+    return _frame_decoder_pool
+
+
+KEYFRAME_PACK_FILENAME = 'keyframes.pack'  # Data file of packs written before the index named it
+KEYFRAME_PACK_INDEX_FILENAME = 'keyframes.pack.json'
+KEYFRAME_PACK_DATA_PATTERN = re.compile(r'^keyframes(\.\d+)?\.pack$')
+_keyframe_pack_cache = {}  # folder -> (index mtime, pack)
+
+
+class KeyframePack:
+    """Read side of a packed keyframe folder: concatenated encoded images plus an offset index.
+    
+    The data file is memory-mapped once, so reading an image is a slice of
+    the map instead of an open() per file; lookups by index or name are O(1).
+    """
+    
+    def __init__(self, folder):
+        with open(os.path.join(folder, KEYFRAME_PACK_INDEX_FILENAME), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.names = index['names']
+        self.offsets = index['offsets']
+        self.lengths = index['lengths']
+        self.index_of = {name: i for i, name in enumerate(self.names)}
+        self.generation = index.get('generation', 0)
+        self.data_path = os.path.join(folder, index.get('data', KEYFRAME_PACK_FILENAME))
+        self.file = open(self.data_path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def read(self, i):
+        """Encoded bytes of the i-th image"""
+        offset = self.offsets[i]
+        return self.map[offset:offset + self.lengths[i]]
+    
+    def read_name(self, name):
+        return self.read(self.index_of[name])
+    
+    def close(self):
+        if self.map:
+            self.map.close()
+        self.file.close()
+
+
+class KeyframePackWriter:
+    """Write side of a keyframe pack, replacing any pack in the folder on close.
+    
+    Every pack writes a new data file named by its generation, and the index
+    naming it is switched in last, so a crash leaves the old pack intact and
+    readers holding a map of the old data keep a consistent view.
+    """
+    
+    def __init__(self, folder):
+        self.folder = folder
+        try:
+            with open(os.path.join(folder, KEYFRAME_PACK_INDEX_FILENAME), 'r', encoding='utf-8') as f:
+                self.generation = json.load(f).get('generation', 0) + 1
+        except (OSError, ValueError):
+            self.generation = 1
+        self.data_path = os.path.join(folder, f"keyframes.{self.generation}.pack")
+        self.file = open(self.data_path + '.part', 'wb')
+        self.names, self.offsets, self.lengths = [], [], []
+    
+    def add(self, name, data):
+        self.names.append(name)
+        self.offsets.append(self.file.tell())
+        self.lengths.append(len(data))
+        self.file.write(data)
+    
+    def add_frame(self, name, frame, jpeg_quality):
+        """Encode a BGR frame as JPEG and add it"""
+        ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+        if not ok:
+            raise IOError(f"cannot encode {name}")
+        self.add(name, encoded.tobytes())
+    
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.data_path + '.part', self.data_path)
+        index_path = os.path.join(self.folder, KEYFRAME_PACK_INDEX_FILENAME)
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': 2, 'generation': self.generation, 'data': os.path.basename(self.data_path),
+                       'names': self.names, 'offsets': self.offsets, 'lengths': self.lengths},
+                      f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_path + '.tmp', index_path)
+        
+        # Older data files are unreferenced now; one still mapped on Windows goes next time
+        with os.scandir(self.folder) as entries:
+            stale = [entry.path for entry in entries
+                     if KEYFRAME_PACK_DATA_PATTERN.match(entry.name) and entry.path != self.data_path]
+        for path in stale:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def abort(self):
+        """Drop the unfinished pack, any existing pack stays in place"""
+        self.file.close()
+        os.remove(self.data_path + '.part')
+
+
+def load_keyframe_pack(folder):
+    """The folder's keyframe pack, or None if it has none"""
+    try:
+        st = os.stat(os.path.join(folder, KEYFRAME_PACK_INDEX_FILENAME))
+    except OSError:
+        return None
+    mtime = (st.st_mtime_ns, st.st_size)
+    cached = _keyframe_pack_cache.get(folder)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    pack = KeyframePack(folder)
+    _keyframe_pack_cache[folder] = (mtime, pack)
+    return pack
+
+
+def list_keyframe_names(folder, extensions, include_references=True):
+    """Image names of a folder: loose files, packed images and (optionally) video references"""
+    names = {f for f in os.listdir(folder) if f.lower().endswith(extensions)}
+    pack = load_keyframe_pack(folder)
+    if pack:
+        names.update(pack.names)
+    refs = load_keyframe_refs(folder) if include_references else None
+    if refs:
+        names.update(refs['frames'])
+    return sorted(names)
+
+
+def natural_sort_key(name):
+    """Sort key ordering embedded numbers by value, so frame_2 comes before frame_10"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+class FolderIndexer:
+    """List a folder's images on a background thread, delivered in batches.
+    
+    The first batch goes out as soon as one image is found, later ones every
+    batch_size names or interval seconds, so a large folder (or one on a slow
+    share) can be shown before it is fully listed. Packed and reference-mode
+    keyframes come first. on_batch(names) and on_done(error) are called from
+    the worker thread; names are unsorted and may repeat across sources.
+    """
+    
+    def __init__(self, folder, extensions, on_batch, on_done, include_references=True,
+                 batch_size=1000, interval=0.25):
+        self.folder = folder
+        self.extensions = extensions
+        self.on_batch = on_batch
+        self.on_done = on_done
+        self.include_references = include_references
+        self.batch_size = batch_size
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def run(self):
+        error = None
+        try:
+            names = []
+            pack = load_keyframe_pack(self.folder)
+            if pack:
+                names.extend(pack.names)
+            refs = load_keyframe_refs(self.folder) if self.include_references else None
+            if refs:
+                names.extend(refs['frames'])
+            if names:
+                self.on_batch(names)
+            
+            batch = []
+            first = not names
+            last_flush = time.monotonic()
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if self.stop_event.is_set():
+                        return
+                    if not entry.name.lower().endswith(self.extensions) or not entry.is_file():
+                        continue
+                    batch.append(entry.name)
+                    if first or len(batch) >= self.batch_size or time.monotonic() - last_flush > self.interval:
+                        self.on_batch(batch)
+                        batch = []
+                        first = False
+                        last_flush = time.monotonic()
+            if batch:
+                self.on_batch(batch)
+        except OSError as e:
+            error = e
+        if not self.stop_event.is_set():
+            self.on_done(error)
+
+
+def read_keyframe_bytes(path):
+    """Encoded bytes of a loose or packed keyframe"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pack = load_keyframe_pack(os.path.dirname(path))
+        name = os.path.basename(path)
+        if pack is None or name not in pack.index_of:
+            raise
+        return pack.read_name(name)
+
+
+def open_keyframe_image(path):
+    """Open a keyframe from disk, its folder's pack, or by decoding the source video"""
+    try:
+        return Image.open(path)
+    except FileNotFoundError:
+        pack = load_keyframe_pack(os.path.dirname(path))
+        if pack and os.path.basename(path) in pack.index_of:
+            return Image.open(io.BytesIO(pack.read_name(os.path.basename(path))))
+        reference = keyframe_reference(path)
+        if reference is None:
+            raise
+        refs, entry = reference
+        return get_frame_decoder_pool().get_frame(refs['video'], entry['frame'], entry.get('timestamp'))
+
+
+def pack_keyframe_folder(folder, remove_files=False):
+    """Pack a folder's loose images (merged with any existing pack), returns the image count"""
+    names = list_keyframe_names(folder, ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp'),
+                                include_references=False)
+    writer = KeyframePackWriter(folder)
+    loose = []
+    try:
+        for name in names:
+            path = os.path.join(folder, name)
+            if os.path.isfile(path):
+                loose.append(path)
+            writer.add(name, read_keyframe_bytes(path))
+    except BaseException:
+        writer.abort()
+        raise
+    
+    # The cached map of the old pack would keep its data file open, which blocks removing it on Windows
+    cached = _keyframe_pack_cache.pop(folder, None)
+    if cached:
+        cached[1].close()
+    writer.close()
+    
+    if remove_files:
+        # Only delete what the new pack demonstrably holds
+        pack = load_keyframe_pack(folder)
+        for path in loose:
+            if pack.lengths[pack.index_of[os.path.basename(path)]] == os.path.getsize(path):
+                os.remove(path)
+    return len(names)
+
+
+def unpack_keyframe_folder(folder, remove_pack=False):
+    """Write a folder's packed images back as files, returns the number written"""
+    pack = load_keyframe_pack(folder)
+    if pack is None:
+        return 0
+    written = 0
+    for i, name in enumerate(pack.names):
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            with open(path + '.part', 'wb') as f:
+                f.write(pack.read(i))
+            os.replace(path + '.part', path)
+            written += 1
+    if remove_pack:
+        _keyframe_pack_cache.pop(folder, None)
+        pack.close()
+        os.remove(os.path.join(folder, KEYFRAME_PACK_INDEX_FILENAME))
+        os.remove(pack.data_path)
+    return written
+
+
+def open_keyframe_thumbnail(path, size):
+    """Thumbnail of a keyframe, from the reference manifest when there is one"""
+    if not os.path.exists(path):
+        reference = keyframe_reference(path)
+        if reference and reference[1].get('thumb'):
+            img = Image.open(io.BytesIO(base64.b64decode(reference[1]['thumb'])))
+            img.thumbnail(size, Image.Resampling.LANCZOS)
+            return img
+    img = open_keyframe_image(path)
+    img.thumbnail(size, Image.Resampling.LANCZOS)
+    return img
+
+
+def keyframe_stat(path):
+    """os.stat of a keyframe; packed and reference keyframes report the pack or the source video"""
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        folder = os.path.dirname(path)
+        pack = load_keyframe_pack(folder)
+        if pack and os.path.basename(path) in pack.index_of:
+            return os.stat(pack.data_path)
+        reference = keyframe_reference(path)
+        if reference is None:
+            raise
+        return os.stat(reference[0]['video'])
+
+
+THUMBNAIL_SIZE = (100, 80)
+THUMBNAIL_ATLAS_DIRNAME = '.thumbnail_atlas'
+THUMBNAIL_ATLAS_CELL = (112, 80)   # Multiples of 16, so JPEG blocks never straddle two tiles
+THUMBNAIL_ATLAS_GRID = (16, 32)    # Columns, rows: 512 thumbnails per sheet
+GALLERY_CELL = (106, 92)   # Sort gallery cell, a thumbnail plus its coloured border
+GALLERY_SHEET_CACHE = 4    # Decoded sheets kept as Tk images, about 18 MB each
+GALLERY_TILE_CACHE = 600   # Thumbnails kept after being cut from their sheet
+
+
+def frame_thumbnail(frame, size=THUMBNAIL_SIZE):
+    """A BGR frame scaled down to fit size"""
+    height, width = frame.shape[:2]
+    scale = min(size[0] / width, size[1] / height)
+    return cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def load_atlas_sheet(path):
+    """Decode an atlas sheet fully, so the Tk side only copies pixels"""
+    img = Image.open(path)
+    img.load()
+    return img
+
+
+def thumbnail_atlas_cache_folder(folder):
+    """Per-user atlas location for keyframe folders that are not writable"""
+    digest = hashlib.sha1(os.path.abspath(folder).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser('~'), '.historical_scene_thumbnails', digest)
+
+
+class ThumbnailAtlas:
+    """Contact sheets of a keyframe folder's gallery thumbnails plus a coordinate index.
+    
+    Sheets are JPEG grids of THUMBNAIL_ATLAS_CELL cells in .thumbnail_atlas
+    inside the keyframes folder (or a per-user cache when that folder is
+    read-only). index.json maps each keyframe name to [sheet, x, y, w, h,
+    size, mtime_ns]; size and mtime_ns are None for packed and reference
+    keyframes. A 10k gallery is the index plus about 20 sheet reads.
+    """
+    
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, THUMBNAIL_ATLAS_DIRNAME)
+        self.sheets = []  # {'file', 'used'}
+        self.tiles = {}
+        for path in (self.path, thumbnail_atlas_cache_folder(folder)):
+            try:
+                with open(os.path.join(path, 'index.json'), 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if index.get('cell') == list(THUMBNAIL_ATLAS_CELL) and index.get('grid') == list(THUMBNAIL_ATLAS_GRID):
+                self.path, self.sheets, self.tiles = path, index['sheets'], index['tiles']
+            break
+    
+    def sheet_path(self, sheet):
+        return os.path.join(self.path, self.sheets[sheet]['file'])
+    
+    def is_stale(self, name):
+        """True if a loose keyframe changed since its tile was made"""
+        tile = self.tiles.get(name)
+        if tile is None:
+            return True
+        if tile[5] is None:
+            return False
+        try:
+            st = os.stat(os.path.join(self.folder, name))
+        except OSError:
+            return False  # Moved away by the sorter, the tile still shows it
+        return (st.st_size, st.st_mtime_ns) != (tile[5], tile[6])
+
+
+class ThumbnailAtlasWriter:
+    """Add thumbnails to an atlas, filling its last sheet before starting a new one.
+    
+    Sheets already on disk are never rewritten except the partial last one,
+    so tiles a reader has cut from them stay valid. flush() writes the open
+    sheet and the index atomically and returns what changed since the last
+    flush. With fresh=True the atlas is started over.
+    """
+    
+    def __init__(self, atlas, fresh=False):
+        self.atlas = atlas
+        if not fresh:
+            try:
+                os.makedirs(atlas.path, exist_ok=True)
+                writable = os.access(atlas.path, os.W_OK)
+            except OSError:
+                writable = False
+            if not writable:
+                atlas.path = thumbnail_atlas_cache_folder(atlas.folder)
+                fresh = True
+        os.makedirs(atlas.path, exist_ok=True)
+        if fresh:
+            atlas.sheets, atlas.tiles = [], {}
+            # An old index must not describe the new sheets if this run never flushes
+            if os.path.exists(os.path.join(atlas.path, 'index.json')):
+                os.remove(os.path.join(atlas.path, 'index.json'))
+        self.per_sheet = THUMBNAIL_ATLAS_GRID[0] * THUMBNAIL_ATLAS_GRID[1]
+        self.sheet = None
+        self.added = {}
+        self.written = set()
+        self.dirty = False
+        
+        if atlas.sheets and atlas.sheets[-1]['used'] < self.per_sheet:
+            sheet = cv2.imread(atlas.sheet_path(len(atlas.sheets) - 1))
+            if sheet is not None and sheet.shape[:2] == self.sheet_shape()[:2]:
+                self.sheet = sheet
+            else:
+                atlas.sheets[-1]['used'] = self.per_sheet  # Unreadable, leave it be
+    
+    def sheet_shape(self):
+        return (THUMBNAIL_ATLAS_GRID[1] * THUMBNAIL_ATLAS_CELL[1],
+                THUMBNAIL_ATLAS_GRID[0] * THUMBNAIL_ATLAS_CELL[0], 3)
+    
+    def add(self, name, thumb, stat=None):
+        """thumb is a BGR array at most THUMBNAIL_SIZE, stat the loose file's os.stat or None"""
+        sheets = self.atlas.sheets
+        if self.sheet is None or sheets[-1]['used'] >= self.per_sheet:
+            if self.dirty:
+                self.write_sheet()
+            self.sheet = np.full(self.sheet_shape(), 45, dtype=np.uint8)  # Gallery background
+            sheets.append({'file': f"sheet_{len(sheets):03d}.jpg", 'used': 0})
+        
+        sheet = len(sheets) - 1
+        row, column = divmod(sheets[-1]['used'], THUMBNAIL_ATLAS_GRID[0])
+        x, y = column * THUMBNAIL_ATLAS_CELL[0], row * THUMBNAIL_ATLAS_CELL[1]
+        h, w = thumb.shape[:2]
+        self.sheet[y:y + h, x:x + w] = thumb
+        tile = [sheet, x, y, w, h, stat.st_size if stat else None, stat.st_mtime_ns if stat else None]
+        self.atlas.tiles[name] = self.added[name] = tile
+        sheets[-1]['used'] += 1
+        self.dirty = True
+    
+    def write_sheet(self):
+        sheet = len(self.atlas.sheets) - 1
+        path = self.atlas.sheet_path(sheet)
+        tmp = path[:-4] + '.tmp.jpg'  # imwrite picks the format from the extension
+        if not cv2.imwrite(tmp, self.sheet, [cv2.IMWRITE_JPEG_QUALITY, 90]):
+            raise IOError(f"cannot write {tmp}")
+        os.replace(tmp, path)
+        self.written.add(sheet)
+        self.dirty = False
+    
+    def flush(self):
+        """Write pending tiles, returns ({name: tile} added, sheets rewritten) since the last flush"""
+        if self.dirty:
+            self.write_sheet()
+        index_path = os.path.join(self.atlas.path, 'index.json')
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'cell': list(THUMBNAIL_ATLAS_CELL), 'grid': list(THUMBNAIL_ATLAS_GRID),
+                       'sheets': self.atlas.sheets, 'tiles': self.atlas.tiles}, f, ensure_ascii=False)
+        os.replace(index_path + '.tmp', index_path)
+        added, written = self.added, self.written
+        self.added, self.written = {}, set()
+        return added, written
+
+
+class ThumbnailAtlasBuilder:
+    """Bring a folder's thumbnail atlas up to date on a background thread.
+    
+    The tiles the atlas already has are delivered first, then thumbnails of
+    new or changed keyframes are rendered and flushed in batches.
+    on_update(tiles, sheets) gets the new {name: tile} entries and the sheet
+    numbers rewritten on disk (None for the first delivery); on_update and
+    on_done() run on the builder thread. paths maps names to readable paths.
+    """
+    
+    def __init__(self, folder, paths, on_update, on_done, batch_size=64, interval=0.5):
+        self.folder = folder
+        self.paths = paths
+        self.on_update = on_update
+        self.on_done = on_done
+        self.batch_size = batch_size
+        self.interval = interval
+        self.atlas = None
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def run(self):
+        try:
+            self.atlas = atlas = ThumbnailAtlas(self.folder)
+            todo = [name for name in self.paths if atlas.is_stale(name)]
+            writer = None
+            if todo:
+                writer = ThumbnailAtlasWriter(atlas)
+                todo = [name for name in self.paths if atlas.is_stale(name)]
+            self.on_update({name: atlas.tiles[name] for name in self.paths if name in atlas.tiles}, None)
+            
+            last_flush = time.monotonic()
+            for name in todo:
+                if self.stop_event.is_set():
+                    break
+                path = self.paths[name]
+                try:
+                    img = open_keyframe_thumbnail(path, THUMBNAIL_SIZE)
+                    thumb = np.asarray(img.convert('RGB'))[:, :, ::-1]
+                    stat = os.stat(path) if os.path.dirname(path) == self.folder and os.path.isfile(path) else None
+                except Exception as e:
+                    print(f"Error loading thumbnail: {e}")
+                    continue
+                writer.add(name, thumb, stat)
+                if len(writer.added) >= self.batch_size or time.monotonic() - last_flush > self.interval:
+                    self.on_update(*writer.flush())
+                    last_flush = time.monotonic()
+            if writer and (writer.added or writer.dirty):
+                self.on_update(*writer.flush())
+        except Exception as e:
+            print(f"Error building thumbnail atlas: {e}")
+        finally:
+            self.on_done()
+
+
+def same_directory_entry(src, dst):
+    """Whether src and dst name one file entry, e.g. the same path or a case-insensitive alias of it"""
+    if os.path.realpath(src) == os.path.realpath(dst):
+        return os.path.lexists(src)
+    try:
+        if os.path.islink(src) or os.path.islink(dst) or not os.path.samefile(src, dst):
+            return False
+        # Hard links are separate entries, dst can be replaced without losing src
+        return os.stat(src).st_nlink == 1
+    except OSError:
+        return False
+
+
+def materialise_file(src, dst, strategy):
+    """Place src at dst using the given strategy, returns the strategy actually used"""
+    if same_directory_entry(src, dst):
+        # Already in place, removing dst first would delete the only copy
+        return 'none'
+    if os.path.lexists(dst):
+        os.remove(dst)
+    
+    # Packed and reference-mode keyframes are written for the first time here, whatever the strategy
+    if not os.path.lexists(src):
+        pack = load_keyframe_pack(os.path.dirname(src))
+        if pack and os.path.basename(src) in pack.index_of:
+            tmp = dst + '.part'
+            with open(tmp, 'wb') as f:
+                f.write(pack.read_name(os.path.basename(src)))
+            os.replace(tmp, dst)
+            return 'unpack'
+        reference = keyframe_reference(src)
+        if reference:
+            refs, entry = reference
+            save_image_atomic(get_frame_decoder_pool().get_frame(refs['video'], entry['frame'],
+                                                                 entry.get('timestamp')),
+                              dst, quality=refs['jpeg_quality'])
+            return 'decode'
+    
+    if strategy == 'auto':
+        strategy = detect_volume_strategy(src, os.path.dirname(dst))
+    
+    try:
+        if strategy == 'reflink':
+            reflink_file(src, dst)
+        elif strategy == 'hardlink':
+            os.link(src, dst)
+        elif strategy == 'symlink':
+            os.symlink(os.path.abspath(src), dst)
+        elif strategy == 'move':
+            shutil.move(src, dst)
+        else:
+            copy_file_atomic(src, dst)
+            strategy = 'copy'
+    except OSError:
+        if strategy in ('copy', 'move'):
+            raise
+        # Link creation refused (permissions, cross-device): fall back to a copy
+        if os.path.lexists(dst):
+            os.remove(dst)
+        copy_file_atomic(src, dst)
+        strategy = 'copy'
+    
+    return strategy
+
+
+def copy_file_atomic(src, dst):
+    """Copy through a temporary name so an interrupted copy never leaves a partial dst"""
+    tmp = dst + '.part'
+    try:
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+
+
+def write_bytes_atomic(path, data):
+    """Write through a temporary name so an interrupted write never leaves a partial file"""
+    tmp = path + '.part'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    finally:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+
+
+def unmaterialise_file(dst, strategy, original_path):
+    """Revert materialise_file: moves go back to original_path, everything else is removed"""
+    if strategy == 'none':
+        return  # Nothing was placed
+    if strategy == 'move':
+        if os.path.lexists(dst) and not os.path.lexists(original_path):
+            shutil.move(dst, original_path)
+    elif os.path.lexists(dst):
+        os.remove(dst)
+
+
+class SortFileQueue:
+    """Ordered background worker for sort file operations with an append-only journal.
+    
+    Every operation is written to the journal (and fsynced) before it is queued,
+    and marked done once applied. Operations left unfinished by a crash are
+    replayed, in order, when the queue is opened on the same folder again.
+    """
+    
+    def __init__(self, journal_path, on_change=None):
+        self.journal_path = journal_path
+        self.on_change = on_change  # Called from the worker thread with (op, error)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.tasks = queue.Queue()
+        self.pending = {}    # op id -> op, queued or running
+        self.cancelled = set()
+        self.results = {}    # op id -> strategy actually used
+        self.next_id = 1
+        self.deferred = None  # Ops held back until a batch's journal sync
+        
+        recovered = self.read_journal()
+        self.journal = open(journal_path, 'a', encoding='utf-8')
+        for op in recovered:
+            self.pending[op['id']] = op
+            self.tasks.put(op)
+        
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def read_journal(self):
+        """Return the operations whose intent was journaled but never completed"""
+        intents = {}
+        if not os.path.exists(self.journal_path):
+            return []
+        
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # Torn last line from a crash mid-write
+                op_id = record['id']
+                self.next_id = max(self.next_id, op_id + 1)
+                if record['event'] == 'intent':
+                    intents[op_id] = record['op']
+                elif record['event'] in ('done', 'cancel', 'failed'):
+                    intents.pop(op_id, None)
+                    if record['event'] == 'done':
+                        self.results[op_id] = record.get('used')
+        
+        return [intents[op_id] for op_id in sorted(intents)]
+    
+    def write_record(self, record, sync=False):
+        """Append one journal record, caller holds the lock"""
+        self.journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.journal.flush()
+        if sync:
+            os.fsync(self.journal.fileno())
+    
+    def submit(self, op):
+        """Journal and queue an operation, returns its id"""
+        with self.lock:
+            op = dict(op, id=self.next_id)
+            self.next_id += 1
+            self.write_record({'event': 'intent', 'id': op['id'], 'op': op},
+                              sync=self.deferred is None)
+            self.pending[op['id']] = op
+            if self.deferred is not None:
+                self.deferred.append(op)
+                return op['id']
+        self.tasks.put(op)
+        return op['id']
+    
+    def begin_batch(self):
+        """Hold submitted ops so a bulk action costs one journal sync instead of one per file"""
+        with self.lock:
+            self.deferred = []
+    
+    def end_batch(self):
+        """Sync the journal once, then release the held ops to the worker"""
+        with self.lock:
+            ops, self.deferred = self.deferred or [], None
+            os.fsync(self.journal.fileno())
+        for op in ops:
+            self.tasks.put(op)
+    
+    def apply(self, folder, src, dst, strategy):
+        """Queue materialising src at dst"""
+        return self.submit({'kind': 'apply', 'folder': folder, 'src': src,
+                            'dst': dst, 'strategy': strategy})
+    
+    def revert(self, target_id, dst, strategy, original_path):
+        """Cancel a still-queued apply, or queue reverting one that already ran"""
+        with self.lock:
+            target = self.pending.get(target_id)
+            if target is not None and not target.get('started'):
+                self.cancelled.add(target_id)
+                self.write_record({'event': 'cancel', 'id': target_id}, sync=True)
+                return None
+            # Record the strategy in the op itself so a replay does not depend on older records
+            strategy = self.results.get(target_id, strategy)
+        
+        return self.submit({'kind': 'revert', 'target': target_id, 'dst': dst,
+                            'strategy': strategy, 'original': original_path})
+    
+    def depth(self):
+        """Number of operations queued or running"""
+        with self.lock:
+            return len(self.pending)
+    
+    def wait_idle(self, timeout=None):
+        """Block until all queued operations are applied, returns False on timeout"""
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.pending, timeout)
+    
+    def close(self, timeout=None):
+        """Finish queued work and stop the worker"""
+        self.tasks.put(None)
+        self.thread.join(timeout)
+    
+    def run(self):
+        """Worker loop, operations run strictly in submission order"""
+        while True:
+            op = self.tasks.get()
+            if op is None:
+                break
+            
+            with self.lock:
+                if op['id'] in self.cancelled:
+                    self.cancelled.discard(op['id'])
+                    self.finish(op['id'])
+                    continue
+                op['started'] = True
+            
+            error = None
+            record = {'event': 'done', 'id': op['id']}
+            try:
+                if op['kind'] == 'apply':
+                    if not os.path.lexists(op['src']) and os.path.lexists(op['dst']):
+                        used = 'move'  # Replayed move that completed before a crash
+                    else:
+                        used = materialise_file(op['src'], op['dst'], op['strategy'])
+                    record['used'] = used
+                    with self.lock:
+                        self.results[op['id']] = used
+                else:
+                    used = self.results.get(op['target'], op['strategy'])
+                    unmaterialise_file(op['dst'], used, op['original'])
+            except Exception as e:
+                error = e
+                record = {'event': 'failed', 'id': op['id'], 'error': str(e)}
+            
+            with self.lock:
+                self.write_record(record)
+                self.finish(op['id'])
+            
+            if self.on_change:
+                self.on_change(op, error)
+        
+        with self.lock:
+            self.journal.close()
+    
+    def finish(self, op_id):
+        """Drop a finished operation, compacting the journal once nothing is pending"""
+        self.pending.pop(op_id, None)
+        if not self.pending:
+            self.journal.close()
+            self.journal = open(self.journal_path, 'w', encoding='utf-8')
+            self.idle.notify_all()
+
+
+# Loaded lazily once per process by get_human_detectors
+_human_detectors = None
+
+
+def build_human_detectors():
+    """New (HOG people detector, [(kind, Haar cascade)]) bundled with OpenCV, one set per thread"""
+    if not hasattr(cv2, 'HOGDescriptor') or not hasattr(cv2, 'data'):
+        raise RuntimeError("当前 OpenCV 版本不包含 HOG/Haar 检测器")
+    
+    hog = cv2.HOGDescriptor()
+    hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+    
+    cascades = []
+    for kind, filename in (('face', 'haarcascade_frontalface_default.xml'),
+                           ('upperbody', 'haarcascade_upperbody.xml')):
+        cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, filename))
+        if not cascade.empty():
+            cascades.append((kind, cascade))
+    
+    return hog, cascades
+
+
+def get_human_detectors():
+    """Return (HOG people detector, [(kind, Haar cascade)]) bundled with OpenCV"""
+    global _human_detectors
+    if _human_detectors is None:
+        _human_detectors = build_human_detectors()
+    return _human_detectors
+
+
+def human_detection_available():
+    """Check whether this OpenCV build ships the HOG/Haar detectors"""
+    try:
+        get_human_detectors()
+        return True
+    except (RuntimeError, cv2.error):
+        return False
+
+
+def load_detection_image(image_path, max_side):
+    """Decode at reduced resolution (JPEG draft mode), returns (BGR frame, original / decoded scale)"""
+    img = open_keyframe_image(image_path)
+    original_width = img.width
+    img.draft('RGB', (max_side, max_side))
+    img = img.convert('RGB')
+    img.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+    frame = cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+    return frame, original_width / img.width
+
+
+def detect_humans_in_frame(frame, scale=1.0, detectors=None):
+    """Find people in a BGR frame, returns (score, boxes) with boxes as [x, y, w, h, weight, kind]"""
+    hog, cascades = detectors or get_human_detectors()
+    boxes = []
+    
+    rects, weights = hog.detectMultiScale(frame, winStride=(8, 8), padding=(8, 8), scale=1.08)
+    for (x, y, w, h), weight in zip(rects, np.ravel(weights)):
+        boxes.append([x, y, w, h, float(weight), 'person'])
+    
+    gray = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    for kind, cascade in cascades:
+        for (x, y, w, h) in cascade.detectMultiScale(gray, scaleFactor=1.15, minNeighbors=5,
+                                                     minSize=(32, 32)):
+            boxes.append([x, y, w, h, 1.0, kind])
+    
+    # Map back to original pixels
+    boxes = [[int(round(x * scale)), int(round(y * scale)), int(round(w * scale)),
+              int(round(h * scale)), weight, kind] for x, y, w, h, weight, kind in boxes]
+    return human_presence_score(boxes), boxes
+
+
+def human_presence_score(boxes):
+    """Combine detections into a 0-1 human presence score"""
+    score = 0.0
+    for box in boxes:
+        weight, kind = box[4], box[5]
+        if kind == 'person':
+            score = max(score, 1.0 - float(np.exp(-weight)))
+        elif kind == 'face':
+            score = max(score, 0.9)
+        else:
+            score = max(score, 0.7)
+    return score
+
+
+def detect_humans(image_path, max_side=512):
+    """Score one image for human presence, runs in detection worker processes"""
+    try:
+        frame, scale = load_detection_image(image_path, max_side)
+        score, boxes = detect_humans_in_frame(frame, scale)
+        return {'score': score, 'boxes': boxes,
+                'image_size': [int(round(frame.shape[1] * scale)), int(round(frame.shape[0] * scale))]}
+    except Exception as e:
+        return {'score': None, 'boxes': [], 'error': str(e)}
+
+
+def person_region_proposals(result, min_weight=0.3, overlap=0.4):
+    """Turn detector boxes into figure crop proposals [x1, y1, x2, y2, score] in original pixels"""
+    width, height = result.get('image_size') or (None, None)
+    candidates = []
+    for x, y, w, h, weight, kind in result.get('boxes', []):
+        if kind == 'person':
+            if weight < min_weight:
+                continue
+            # HOG windows carry a margin around the figure
+            box = (x + 0.1 * w, y + 0.05 * h, x + 0.9 * w, y + 0.95 * h)
+            score = 1.0 - float(np.exp(-weight))
+        elif kind == 'upperbody':
+            box = (x - 0.1 * w, y, x + 1.1 * w, y + 2.5 * h)
+            score = 0.6
+        else:
+            # Grow a face into a head-to-knee figure box
+            box = (x - 1.0 * w, y - 0.5 * h, x + 2.0 * w, y + 6.0 * h)
+            score = 0.7
+        
+        x1, y1, x2, y2 = box
+        if width and height:
+            x1, y1, x2, y2 = max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+        if x2 - x1 >= 8 and y2 - y1 >= 8:
+            candidates.append([int(x1), int(y1), int(x2), int(y2), score])
+    
+    # Non-maximum suppression, best score first
+    proposals = []
+    for box in sorted(candidates, key=lambda b: -b[4]):
+        if all(box_iou(box, kept) < overlap for kept in proposals):
+            proposals.append(box)
+    return proposals
+
+
+def box_iou(a, b):
+    """Intersection over union of two [x1, y1, x2, y2, ...] boxes"""
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / float((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+
+def init_detection_worker():
+    """Keep detection workers from competing with the UI process"""
+    cv2.setNumThreads(1)
+    if hasattr(os, 'nice'):
+        try:
+            os.nice(10)
+        except OSError:
+            pass
+
+
+def load_detection_cache(cache_path):
+    """Read a detection cache, filename -> result with the file's size and mtime"""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_detection_cache(cache_path, entries):
+    """Merge entries into the cache file, written atomically"""
+    cache = load_detection_cache(cache_path)
+    cache.update(entries)
+    tmp = cache_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp, cache_path)
+
+
+class HumanDetectionPass:
+    """Score a list of images for human presence in a process pool.
+    
+    Results are cached per folder keyed by filename, size and mtime, and
+    delivered in batches through on_results(results, done, total) from the
+    driver thread. Images are processed in the order given. If a worker
+    crashes the pass still finishes, the images left without a result are
+    not cached and get detected on the next run.
+    """
+    
+    def __init__(self, image_paths, cache_path, on_results, max_side=512, workers=None):
+        self.image_paths = list(image_paths)
+        self.cache_path = cache_path
+        self.on_results = on_results
+        self.max_side = max_side
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def run(self):
+        cache = load_detection_cache(self.cache_path)
+        
+        # Serve fresh cache entries right away, detect the rest
+        cached, todo = {}, []
+        for path in self.image_paths:
+            name = os.path.basename(path)
+            try:
+                st = keyframe_stat(path)
+            except OSError:
+                continue
+            entry = cache.get(name)
+            if (entry and entry.get('size') == st.st_size and entry.get('mtime') == st.st_mtime
+                    and entry.get('max_side') == self.max_side):
+                cached[name] = entry
+            else:
+                todo.append((path, st))
+        
+        done = len(cached)
+        total = len(cached) + len(todo)
+        self.on_results(cached, done, total)
+        
+        fresh, batch = {}, {}
+        last_flush = time.monotonic()
+        crashed = False
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=init_detection_worker) as pool:
+                in_flight = {}
+                todo.reverse()
+                while (todo or in_flight) and not self.stop_event.is_set():
+                    # A small window keeps stop() responsive and memory flat
+                    while todo and len(in_flight) < self.workers * 4:
+                        path, st = todo.pop()
+                        in_flight[pool.submit(detect_humans, path, self.max_side)] = (path, st)
+                    
+                    finished, _ = wait(list(in_flight), timeout=0.5, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        path, st = in_flight.pop(future)
+                        result = future.result()
+                        result.update(size=st.st_size, mtime=st.st_mtime, max_side=self.max_side)
+                        name = os.path.basename(path)
+                        batch[name] = fresh[name] = result
+                        done += 1
+                    
+                    if batch and (time.monotonic() - last_flush > 0.5 or not in_flight):
+                        self.on_results(batch, done, total)
+                        batch = {}
+                        last_flush = time.monotonic()
+                    if len(fresh) >= 200:
+                        save_detection_cache(self.cache_path, fresh)
+                        fresh = {}
+                
+                for future in in_flight:
+                    future.cancel()
+        except BrokenProcessPool as e:
+            # A worker died in native decode code; the images it left are not
+            # cached and get detected next run, the pass still finishes
+            print(f"Detection workers crashed: {e}")
+            crashed = True
+            done = total
+        finally:
+            if fresh:
+                save_detection_cache(self.cache_path, fresh)
+        
+        if batch or crashed:
+            self.on_results(batch, done, total)
+
+
+def compute_image_signature(image_path):
+    """Compact visual signature: 4x4x4 RGB histogram (64 floats) and a 64-bit difference hash, None if unreadable"""
+    try:
+        img = open_keyframe_image(image_path)
+        img.draft('RGB', (64, 64))
+        img = img.convert('RGB').resize((32, 32), Image.Resampling.BILINEAR)
+    except Exception as e:
+        print(f"Error computing signature: {e}")
+        return None
+    
+    rgb = np.asarray(img) >> 6
+    bins = (rgb[..., 0].astype(np.int32) * 16 + rgb[..., 1] * 4 + rgb[..., 2]).ravel()
+    hist = np.bincount(bins, minlength=64).astype(np.float32) / bins.size
+    
+    gray = np.asarray(img.convert('L').resize((9, 8), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = np.packbits((gray[:, 1:] > gray[:, :-1]).ravel())
+    return hist, int.from_bytes(bits.tobytes(), 'big')
+
+
+def cluster_signatures(hists, hashes, hist_threshold=0.25, hash_threshold=14, recent=16):
+    """Greedy single-pass clustering of image signatures, returns a cluster id per image.
+    
+    Each image is compared only with the last few clusters (consecutive
+    keyframes of one scene) and with clusters whose leader hash shares a
+    16-bit band with it (the same scene coming back later), so the cost stays
+    O(N) with a small constant. An image joins the closest candidate whose
+    mean histogram is within hist_threshold (total variation distance) and
+    whose leader hash is within hash_threshold bits.
+    """
+    n = len(hists)
+    labels = np.empty(n, dtype=np.int64)
+    sums = np.zeros((max(n, 1), hists.shape[1] if n else 64), dtype=np.float64)
+    counts = np.zeros(max(n, 1), dtype=np.int64)
+    leaders = []
+    bands = [{} for _ in range(4)]
+    
+    for i in range(n):
+        h = int(hashes[i])
+        band_keys = [(h >> (16 * b)) & 0xFFFF for b in range(4)]
+        candidates = set(range(max(0, len(leaders) - recent), len(leaders)))
+        for b, key in enumerate(band_keys):
+            candidates.update(bands[b].get(key, ()))
+        
+        best = -1
+        if candidates:
+            ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            distances = 0.5 * np.abs(sums[ids] / counts[ids, None] - hists[i]).sum(axis=1)
+            for j in np.argsort(distances):
+                if distances[j] >= hist_threshold:
+                    break
+                if bin(leaders[ids[j]] ^ h).count('1') <= hash_threshold:
+                    best = int(ids[j])
+                    break
+        
+        if best < 0:
+            best = len(leaders)
+            leaders.append(h)
+            for b, key in enumerate(band_keys):
+                bands[b].setdefault(key, []).append(best)
+        
+        labels[i] = best
+        sums[best] += hists[i]
+        counts[best] += 1
+    
+    return labels
+
+
+class SignaturePass:
+    """Compute (cached) signatures for a list of images in a process pool, then cluster them.
+    
+    on_progress(done, total) and on_done(labels) are called from the driver
+    thread; labels has one cluster id per input path. Images without a
+    signature (unreadable, or left over by a crashed worker) are not cached
+    and each get a cluster of their own.
+    """
+    
+    def __init__(self, image_paths, cache_path, on_progress, on_done,
+                 hist_threshold=0.25, hash_threshold=14, workers=None):
+        self.image_paths = list(image_paths)
+        self.cache_path = cache_path
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.hist_threshold = hist_threshold
+        self.hash_threshold = hash_threshold
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def load_cache(self):
+        """filename -> (size, mtime, hist, hash) from the npz cache"""
+        try:
+            with np.load(self.cache_path) as data:
+                return {str(name): (int(size), float(mtime), hist, int(h))
+                        for name, size, mtime, hist, h in zip(data['names'], data['sizes'], data['mtimes'],
+                                                              data['hists'], data['hashes'])}
+        except (OSError, ValueError, KeyError):
+            return {}
+    
+    def save_cache(self, cache):
+        names = sorted(cache)
+        tmp = self.cache_path + '.tmp.npz'
+        np.savez(tmp,
+                 names=np.array(names),
+                 sizes=np.array([cache[n][0] for n in names], dtype=np.int64),
+                 mtimes=np.array([cache[n][1] for n in names], dtype=np.float64),
+                 hists=np.array([cache[n][2] for n in names], dtype=np.float32).reshape(len(names), 64),
+                 hashes=np.array([cache[n][3] for n in names], dtype=np.uint64))
+        os.replace(tmp, self.cache_path)
+    
+    def run(self):
+        cache = self.load_cache()
+        total = len(self.image_paths)
+        hists = np.zeros((total, 64), dtype=np.float32)
+        hashes = np.zeros(total, dtype=np.uint64)
+        valid = np.zeros(total, dtype=bool)
+        
+        todo = []
+        for i, path in enumerate(self.image_paths):
+            name = os.path.basename(path)
+            try:
+                st = keyframe_stat(path)
+            except OSError:
+                continue
+            entry = cache.get(name)
+            if entry and entry[0] == st.st_size and entry[1] == st.st_mtime:
+                hists[i], hashes[i] = entry[2], entry[3]
+                valid[i] = True
+            else:
+                todo.append((i, path, st))
+        
+        done = total - len(todo)
+        self.on_progress(done, total)
+        
+        computed = 0
+        try:
+            if todo:
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=init_detection_worker) as pool:
+                    for start in range(0, len(todo), 512):
+                        if self.stop_event.is_set():
+                            break
+                        chunk = todo[start:start + 512]
+                        for (i, path, st), signature in zip(chunk, pool.map(
+                                compute_image_signature, [c[1] for c in chunk], chunksize=32)):
+                            if signature is None:
+                                continue  # Not cached, tried again next time
+                            hists[i], hashes[i] = signature
+                            valid[i] = True
+                            cache[os.path.basename(path)] = (st.st_size, st.st_mtime, *signature)
+                            computed += 1
+                        done += len(chunk)
+                        self.on_progress(done, total)
+        except BrokenProcessPool as e:
+            # A worker died in native decode code, cluster what was computed
+            print(f"Signature workers crashed: {e}")
+        finally:
+            if computed:
+                self.save_cache(cache)
+        
+        if self.stop_event.is_set():
+            return
+        labels = np.empty(total, dtype=np.int64)
+        readable = np.flatnonzero(valid)
+        labels[readable] = cluster_signatures(hists[readable], hashes[readable],
+                                              self.hist_threshold, self.hash_threshold)
+        first_single = int(labels[readable].max()) + 1 if len(readable) else 0
+        labels[~valid] = np.arange(first_single, first_single + total - len(readable))
+        self.on_done(labels)
+
+
+class SortSession:
+    """Append-only per-folder log of sort actions, undo, redo and cursor moves.
+    
+    Replaying the log rebuilds the undo/redo history in O(actions), so a
+    half-sorted folder resumes exactly where it was left.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.record_count = 0
+        self.file = None
+    
+    def load(self):
+        """Replay the log, returns (undo stack, redo stack, cursor filename)"""
+        undo_stack, redo_stack, cursor = [], [], None
+        self.record_count = 0
+        
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # Torn last line from a crash mid-write
+                    self.record_count += 1
+                    op = record['op']
+                    if op == 'action':
+                        undo_stack.append(record['items'])
+                        redo_stack = []
+                    elif op == 'undo' and undo_stack:
+                        redo_stack.append(undo_stack.pop())
+                    elif op == 'redo' and redo_stack:
+                        undo_stack.append(redo_stack.pop())
+                    elif op == 'cursor':
+                        cursor = record['file']
+        
+        self.file = open(self.path, 'a', encoding='utf-8')
+        return undo_stack, redo_stack, cursor
+    
+    def append(self, record):
+        """Append one record, flushed to the OS so an application crash loses nothing"""
+        if self.file is None:
+            return
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+        self.record_count += 1
+    
+    def compact_if_needed(self, undo_stack, redo_stack, cursor):
+        """Rewrite the log as the minimal record sequence once it is mostly dead weight"""
+        live = len(undo_stack) + 2 * len(redo_stack) + 1
+        if self.record_count <= 2 * live + 100:
+            return
+        
+        records = [{'op': 'action', 'items': items} for items in undo_stack]
+        # Undone actions are replayed top-first so the redo order comes out unchanged
+        records += [{'op': 'action', 'items': items} for items in reversed(redo_stack)]
+        records += [{'op': 'undo'}] * len(redo_stack)
+        if cursor:
+            records.append({'op': 'cursor', 'file': cursor})
+        
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        
+        self.file.close()
+        os.replace(tmp, self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.record_count = len(records)
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def save_image_atomic(img, output_path, **params):
+    """Save through a temporary name so readers never see a half-written image"""
+    image_format = Image.registered_extensions().get(os.path.splitext(output_path)[1].lower(), 'JPEG')
+    if image_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    tmp = output_path + '.part'
+    try:
+        img.save(tmp, format=image_format, **params)
+        os.replace(tmp, output_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def content_hash(data):
+    """Short content hash identifying a source image"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_content_hash(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CropRecipeStore:
+    """Crops as data: source, source content hash and rectangle in original pixels.
+    
+    Records are appended to .crop_recipes.jsonl in the crop folder, keyed by
+    output filename (a later record for the same output replaces the earlier
+    one). Source paths are stored relative to the crop folder so a project
+    can be moved as a whole.
+    """
+    
+    FILENAME = '.crop_recipes.jsonl'
+    
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, self.FILENAME)
+    
+    def add(self, output_path, source_path, source_hash, box):
+        try:
+            source = os.path.relpath(source_path, self.folder)
+        except ValueError:
+            source = os.path.abspath(source_path)  # Other drive on Windows
+        record = {'output': os.path.basename(output_path), 'source': source,
+                  'source_hash': source_hash, 'box': [int(v) for v in box], 'created': time.time()}
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return record
+    
+    def load(self):
+        """output filename -> record, with 'source' resolved to a path"""
+        recipes = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line
+                    record['source'] = os.path.normpath(os.path.join(self.folder, record['source']))
+                    recipes[record['output']] = record
+        except FileNotFoundError:
+            pass
+        return recipes
+
+
+CROP_EXPORT_FORMATS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp'}
+
+
+def expand_crop_box(box, image_size, padding=0.0, aspect=None):
+    """Pad box by a fraction of its size and widen or heighten it to aspect (width / height).
+    
+    The result is kept inside the image: it is shifted back in where possible
+    and shrunk (around its centre, keeping the aspect) only when the image is
+    too small.
+    """
+    x1, y1, x2, y2 = box
+    width, height = x2 - x1, y2 - y1
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    width *= 1 + 2 * padding
+    height *= 1 + 2 * padding
+    
+    if aspect:
+        if width / height < aspect:
+            width = height * aspect
+        else:
+            height = width / aspect
+        shrink = min(1.0, image_size[0] / width, image_size[1] / height)
+        width *= shrink
+        height *= shrink
+    else:
+        width = min(width, image_size[0])
+        height = min(height, image_size[1])
+    
+    x1 = min(max(0.0, cx - width / 2), image_size[0] - width)
+    y1 = min(max(0.0, cy - height / 2), image_size[1] - height)
+    return (int(round(x1)), int(round(y1)), int(round(x1 + width)), int(round(y1 + height)))
+
+
+def render_crop_recipe(job):
+    """Process pool worker: re-render one recipe, returns (output, error)"""
+    try:
+        with open_keyframe_image(job['source']) as img:
+            box = expand_crop_box(job['box'], img.size, job['padding'], job['aspect'])
+            crop = img.crop(box)
+            if job['size'] and max(crop.size) > job['size']:
+                crop.thumbnail((job['size'], job['size']), Image.Resampling.LANCZOS)
+            if job['format'] == 'png':
+                params = {'compress_level': 6}
+            else:
+                params = {'quality': job['quality']}
+            save_image_atomic(crop, job['output'], **params)
+        return job['output'], None
+    except Exception as e:
+        return job['output'], str(e)
+
+
+def export_crop_recipes(crop_folder, output_folder=None, image_format='jpeg', size=None, quality=95,
+                        padding=0.0, aspect=None, workers=None, force=False, on_progress=None):
+    """Re-render every recipe of crop_folder with new output settings.
+    
+    Outputs whose recipe, source content and settings match the export
+    manifest are skipped. Recipes whose source no longer hashes to the
+    recorded value are reported as stale rather than exported, since the
+    rectangle may no longer fit. Returns a summary dict.
+    """
+    output_folder = output_folder or os.path.join(crop_folder, 'Export')
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, '.export_manifest.json')
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    outputs = manifest.setdefault('outputs', {})
+    source_hashes = manifest.setdefault('sources', {})  # path -> [size, mtime, hash]
+    
+    settings = {'format': image_format, 'size': size, 'quality': quality,
+                'padding': padding, 'aspect': aspect}
+    summary = {'exported': 0, 'skipped': 0, 'stale': [], 'missing': [], 'failed': []}
+    jobs = []
+    for name, recipe in sorted(CropRecipeStore(crop_folder).load().items()):
+        source = recipe['source']
+        try:
+            st = keyframe_stat(source)
+        except OSError:
+            summary['missing'].append(name)
+            continue
+        cached = source_hashes.get(source)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime:
+            current_hash = cached[2]
+        else:
+            current_hash = (file_content_hash(source) if os.path.exists(source)
+                            else content_hash(read_keyframe_bytes(source)))
+            source_hashes[source] = [st.st_size, st.st_mtime, current_hash]
+        if current_hash != recipe['source_hash']:
+            summary['stale'].append(name)
+            continue
+        
+        output = os.path.join(output_folder, Path(name).stem + CROP_EXPORT_FORMATS[image_format])
+        signature = json.dumps([recipe['source_hash'], recipe['box'], settings], sort_keys=True)
+        if not force and outputs.get(os.path.basename(output)) == signature and os.path.exists(output):
+            summary['skipped'] += 1
+            continue
+        jobs.append(dict(settings, source=source, box=recipe['box'], output=output, signature=signature))
+    
+    signatures = {job['output']: job['signature'] for job in jobs}
+    done = 0
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers or max(1, (os.cpu_count() or 2) - 1)) as pool:
+            for output, error in pool.map(render_crop_recipe, jobs, chunksize=8):
+                done += 1
+                if error:
+                    summary['failed'].append(f"{os.path.basename(output)}: {error}")
+                else:
+                    summary['exported'] += 1
+                    outputs[os.path.basename(output)] = signatures[output]
+                if on_progress:
+                    on_progress(done, len(jobs))
+    
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return summary
+
+
+KEYFRAME_NAME_PATTERN = re.compile(r'^(?P<video>.+)_keyframe_(?P<index>\d+)(?:_(?P<minutes>\d+)m(?P<seconds>\d+)s)?$')
+CROP_NAME_PATTERN = re.compile(r'^(?P<source>.+)_(?:crop|person)_\d+$')
+DATASET_CLASSES = {'background': 'Background', 'human': 'Human', 'crop': 'Cropped_Figures'}
+
+
+def keyframe_metadata(stem):
+    """Source video, keyframe index and timestamp (seconds) encoded in a keyframe filename"""
+    match = KEYFRAME_NAME_PATTERN.match(stem)
+    if not match:
+        return {'source_video': None, 'keyframe_index': None, 'timestamp': None}
+    timestamp = 0  # The first keyframe is saved without a timestamp
+    if match.group('minutes'):
+        timestamp = int(match.group('minutes')) * 60 + int(match.group('seconds'))
+    return {'source_video': match.group('video'), 'keyframe_index': int(match.group('index')),
+            'timestamp': timestamp}
+
+
+def collect_dataset_samples(sorted_folder, classes=tuple(DATASET_CLASSES)):
+    """Every sample of a sorted folder as (key, path, metadata), in a stable order"""
+    samples = []
+    for cls in classes:
+        folder = os.path.join(sorted_folder, DATASET_CLASSES[cls])
+        if not os.path.isdir(folder):
+            continue
+        recipes = CropRecipeStore(folder).load() if cls == 'crop' else {}
+        for name in sorted(os.listdir(folder)):
+            if not name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+                continue
+            stem = Path(name).stem
+            recipe = recipes.get(name)
+            if cls == 'crop':
+                if recipe:
+                    source_stem = Path(recipe['source']).stem
+                else:
+                    match = CROP_NAME_PATTERN.match(stem)
+                    source_stem = match.group('source') if match else stem
+            else:
+                source_stem = stem
+            
+            metadata = {'class': cls, 'file': name, 'source_file': source_stem}
+            metadata.update(keyframe_metadata(source_stem))
+            metadata['crop_box'] = recipe['box'] if recipe else None
+            # WebDataset splits keys at the first dot
+            samples.append((f"{cls}_{stem}".replace('.', '_'), os.path.join(folder, name), metadata))
+    return samples
+
+
+def plan_shards(samples, max_count=1000, max_bytes=None):
+    """Split samples, in order, into shards of at most max_count samples and max_bytes payload"""
+    shards = [[]]
+    size = 0
+    for sample in samples:
+        sample_bytes = os.path.getsize(sample[1])
+        if shards[-1] and (len(shards[-1]) >= max_count or (max_bytes and size + sample_bytes > max_bytes)):
+            shards.append([])
+            size = 0
+        shards[-1].append(sample)
+        size += sample_bytes
+    return [shard for shard in shards if shard]
+
+
+def add_tar_member(tar, name, data):
+    """Member with fixed ownership and time, so identical input gives identical shards"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 0
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_dataset_shard(job):
+    """Process pool worker: write one shard, returns (path, samples, bytes, [(file, error)] skipped)"""
+    tmp = job['path'] + '.part'
+    count, skipped = 0, []
+    try:
+        with tarfile.open(tmp, 'w', format=tarfile.PAX_FORMAT) as tar:
+            for key, path, metadata in job['samples']:
+                # An unreadable image is left out and reported, the rest of the export goes on
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    with Image.open(io.BytesIO(data)) as img:
+                        width, height = img.size
+                        extension = (img.format or 'jpeg').lower().replace('jpeg', 'jpg')
+                except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+                    skipped.append((path, str(e)))
+                    continue
+                metadata = dict(metadata, key=key, width=width, height=height)
+                add_tar_member(tar, f"{key}.{extension}", data)
+                add_tar_member(tar, f"{key}.json",
+                               json.dumps(metadata, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+                count += 1
+        os.replace(tmp, job['path'])
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return job['path'], count, os.path.getsize(job['path']), skipped
+
+
+def export_dataset_shards(sorted_folder, output_folder, max_count=1000, max_bytes=None,
+                          classes=tuple(DATASET_CLASSES), prefix='shard', workers=None, on_progress=None):
+    """Pack a sorted folder into WebDataset tar shards with a JSON sidecar per sample.
+    
+    Samples are ordered by class then filename and split in that order, so the
+    same input always yields the same shards; shards are written in parallel
+    and an index of shards and sample counts is saved next to them. Shards of
+    an earlier, larger export with the same prefix are removed, and
+    unreadable images are listed in the index under 'skipped'.
+    """
+    samples = collect_dataset_samples(sorted_folder, classes)
+    shards = plan_shards(samples, max_count, max_bytes)
+    os.makedirs(output_folder, exist_ok=True)
+    digits = max(6, len(str(len(shards))))
+    jobs = [{'path': os.path.join(output_folder, f"{prefix}-{i:0{digits}d}.tar"), 'samples': shard}
+            for i, shard in enumerate(shards)]
+    
+    written, skipped = {}, []
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers or max(1, (os.cpu_count() or 2) - 1)) as pool:
+            futures = [pool.submit(write_dataset_shard, job) for job in jobs]
+            for future in futures:
+                path, count, size, bad = future.result()
+                written[path] = {'name': os.path.basename(path), 'samples': count, 'bytes': size}
+                skipped += [{'file': file, 'error': error} for file, error in bad]
+                if on_progress:
+                    on_progress(len(written), len(jobs))
+    
+    current = {os.path.basename(job['path']) for job in jobs}
+    shard_name = re.compile(rf"^{re.escape(prefix)}-\d+\.tar$")
+    for name in os.listdir(output_folder):
+        if shard_name.match(name) and name not in current:
+            os.remove(os.path.join(output_folder, name))
+    
+    index = {'source': os.path.abspath(sorted_folder), 'classes': list(classes),
+             'samples': sum(shard['samples'] for shard in written.values()),
+             'shards': [written[job['path']] for job in jobs], 'skipped': skipped}
+    index_path = os.path.join(output_folder, f"{prefix}-index.json")
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    os.replace(index_path + '.tmp', index_path)
+    return index
+
+
+class CropWriterPool:
+    """Crop and encode on worker threads so saving never blocks the UI.
+    
+    Every job opens its own handle to the source image (the canvas image is
+    never shared across threads); PIL releases the GIL while decoding and
+    encoding, so several crops encode in parallel. on_done(job, error) is
+    called from the worker thread.
+    """
+    
+    def __init__(self, on_done, workers=None):
+        self.on_done = on_done
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 2),
+                                           thread_name_prefix='crop-writer')
+        self.lock = threading.Lock()
+        self.pending = 0
+    
+    def submit(self, source_path, box, output_path, quality=95, tag=None):
+        """Queue one crop, box in original pixel coordinates"""
+        job = {'source': source_path, 'box': tuple(box), 'output': output_path,
+               'quality': quality, 'tag': tag}
+        with self.lock:
+            self.pending += 1
+        self.executor.submit(self.write, job)
+        return job
+    
+    def write(self, job):
+        error = None
+        try:
+            # One read serves both the recipe hash and the decode
+            data = read_keyframe_bytes(job['source'])
+            job['source_hash'] = content_hash(data)
+            with Image.open(io.BytesIO(data)) as img:
+                save_image_atomic(img.crop(job['box']), job['output'], quality=job['quality'])
+        except Exception as e:
+            error = e
+        with self.lock:
+            self.pending -= 1
+        self.on_done(job, error)
+    
+    def depth(self):
+        """Crops queued or encoding"""
+        with self.lock:
+            return self.pending
+    
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+def fit_scale(image_size, box_size, max_scale=1.0):
+    """Scale that fits image_size into box_size, and the resulting display size"""
+    scale = min(box_size[0] / image_size[0], box_size[1] / image_size[1], max_scale)
+    return scale, (max(1, int(round(image_size[0] * scale))), max(1, int(round(image_size[1] * scale))))
+
+
+class CropImageCache:
+    """Decoded sources and display-scaled renders for the crop canvas.
+    
+    Sources are decoded once, in JPEG draft mode at the smallest scale that
+    still covers the display size, and re-decoded larger only when the canvas
+    grows past it. Renders are kept in an LRU keyed by display size and
+    quality; neighbours are prefetched on a background thread.
+    """
+    
+    def __init__(self, max_decoded=3, max_renders=12):
+        self.max_decoded = max_decoded
+        self.max_renders = max_renders
+        self.lock = threading.Lock()
+        self.decoded = OrderedDict()  # path -> (image, original size)
+        self.renders = OrderedDict()  # (path, width, height, high quality) -> image
+        self.sizes = {}  # path -> original size
+        self.prefetch_queue = queue.Queue()
+        
+        thread = threading.Thread(target=self.prefetch_worker)
+        thread.daemon = True
+        thread.start()
+    
+    def original_size(self, path):
+        """Full-resolution size, read from the header only"""
+        with self.lock:
+            size = self.sizes.get(path)
+        if size is None:
+            with open_keyframe_image(path) as img:
+                size = img.size
+            with self.lock:
+                self.sizes[path] = size
+        return size
+    
+    def get_decoded(self, path, min_size):
+        """Decoded source covering at least min_size (or full resolution)"""
+        with self.lock:
+            entry = self.decoded.get(path)
+            if entry is not None:
+                image, original = entry
+                if image.size == original or (image.width >= min_size[0] and image.height >= min_size[1]):
+                    self.decoded.move_to_end(path)
+                    return image
+        
+        image = open_keyframe_image(path)
+        original = image.size
+        image.draft('RGB', min_size)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.load()
+        
+        with self.lock:
+            self.decoded[path] = (image, original)
+            self.sizes[path] = original
+            while len(self.decoded) > self.max_decoded:
+                self.decoded.popitem(last=False)
+        return image
+    
+    def render(self, path, size, high_quality=True):
+        """Display-scaled image, LANCZOS when high_quality else a fast bilinear pass"""
+        key = (path, size[0], size[1], high_quality)
+        with self.lock:
+            image = self.renders.get(key)
+            if image is not None:
+                self.renders.move_to_end(key)
+                return image
+        
+        decoded = self.get_decoded(path, size)
+        if high_quality:
+            image = decoded.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        else:
+            image = decoded.resize(size, Image.Resampling.BILINEAR)
+        
+        with self.lock:
+            self.renders[key] = image
+            while len(self.renders) > self.max_renders:
+                self.renders.popitem(last=False)
+        return image
+    
+    def prefetch(self, paths, box_size):
+        """Render paths for box_size in the background, replacing any older request"""
+        try:
+            while True:
+                self.prefetch_queue.get_nowait()
+        except queue.Empty:
+            pass
+        for path in paths:
+            self.prefetch_queue.put((path, box_size))
+    
+    def prefetch_worker(self):
+        while True:
+            path, box_size = self.prefetch_queue.get()
+            try:
+                _, size = fit_scale(self.original_size(path), box_size)
+                self.render(path, size)
+            except Exception as e:
+                print(f"Error prefetching crop image: {e}")
+    
+    def clear(self):
+        with self.lock:
+            self.decoded.clear()
+            self.renders.clear()
+            self.sizes.clear()
+
+
+class TilePyramid:
+    """Lazily built multi-resolution tiles for zoomed crop views.
+    
+    Level k is the source reduced by 2**k, decoded in JPEG draft mode where
+    the reduction allows it. Levels and display-sized tiles are cached in
+    LRUs; missing tiles are rendered on a worker thread and handed to
+    on_tile(key, image). A new request() supersedes all queued tiles.
+    """
+    
+    def __init__(self, on_tile, tile_size=256, max_level_pixels=64000000, max_tiles=384):
+        self.on_tile = on_tile
+        self.tile_size = tile_size
+        self.max_level_pixels = max_level_pixels
+        self.max_tiles = max_tiles
+        self.lock = threading.Lock()
+        self.levels = OrderedDict()  # (path, level) -> image
+        self.tiles = OrderedDict()  # tile key -> image
+        self.generation = 0
+        self.requests = queue.Queue()
+        
+        thread = threading.Thread(target=self.worker)
+        thread.daemon = True
+        thread.start()
+    
+    @staticmethod
+    def level_for_scale(size, scale):
+        """Coarsest level that still has at least one pixel per display pixel"""
+        level = 0
+        while scale * 2 ** (level + 1) <= 1.0 and min(size) >> (level + 1) >= 1:
+            level += 1
+        return level
+    
+    def get_level(self, path, level):
+        """Source reduced by 2**level"""
+        with self.lock:
+            image = self.levels.get((path, level))
+            if image is not None:
+                self.levels.move_to_end((path, level))
+                return image
+        
+        image = open_keyframe_image(path)
+        target = (-(-image.width // 2 ** level), -(-image.height // 2 ** level))
+        image.draft('RGB', target)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        factor = max(1, round(image.width / target[0]))
+        if factor > 1:
+            image = image.reduce(factor)
+        image.load()
+        
+        with self.lock:
+            self.levels[(path, level)] = image
+            pixels = sum(im.width * im.height for im in self.levels.values())
+            while pixels > self.max_level_pixels and len(self.levels) > 1:
+                _, dropped = self.levels.popitem(last=False)
+                pixels -= dropped.width * dropped.height
+        return image
+    
+    def tile_grid(self, path, original_size, scale, view):
+        """Tiles covering view (x1, y1, x2, y2 in display pixels) at the level for scale.
+        
+        Returns [(key, (x, y))] where key is (path, level, tile size, tx, ty, width, height)
+        and (x, y) is the tile's display position. Edges are rounded from exact
+        level-to-original ratios so neighbouring tiles never overlap or gap.
+        """
+        level = self.level_for_scale(original_size, scale)
+        level_w = -(-original_size[0] // 2 ** level)
+        level_h = -(-original_size[1] // 2 ** level)
+        fx = original_size[0] / level_w * scale
+        fy = original_size[1] / level_h * scale
+        # Keep upsampled tiles around tile_size on screen
+        tile = max(32, self.tile_size // max(1, int(math.ceil(max(fx, fy)))))
+        
+        x1, y1, x2, y2 = view
+        tx1, ty1 = max(0, int(x1 / (tile * fx))), max(0, int(y1 / (tile * fy)))
+        tx2 = min(-(-level_w // tile), int(math.ceil(x2 / (tile * fx))))
+        ty2 = min(-(-level_h // tile), int(math.ceil(y2 / (tile * fy))))
+        
+        grid = []
+        for ty in range(ty1, ty2):
+            top = int(round(ty * tile * fy))
+            bottom = int(round(min((ty + 1) * tile, level_h) * fy))
+            for tx in range(tx1, tx2):
+                left = int(round(tx * tile * fx))
+                right = int(round(min((tx + 1) * tile, level_w) * fx))
+                if right > left and bottom > top:
+                    grid.append(((path, level, tile, tx, ty, right - left, bottom - top), (left, top)))
+        return grid
+    
+    def cached(self, key):
+        with self.lock:
+            image = self.tiles.get(key)
+            if image is not None:
+                self.tiles.move_to_end(key)
+            return image
+    
+    def render_tile(self, key):
+        path, level, tile, tx, ty, width, height = key
+        source = self.get_level(path, level)
+        region = source.crop((tx * tile, ty * tile,
+                              min((tx + 1) * tile, source.width), min((ty + 1) * tile, source.height)))
+        zoom = width / region.width
+        if zoom >= 3:
+            resample = Image.Resampling.NEAREST  # Exact pixels when zoomed far in
+        elif zoom > 1:
+            resample = Image.Resampling.BILINEAR
+        else:
+            resample = Image.Resampling.LANCZOS
+        image = region.resize((width, height), resample)
+        
+        with self.lock:
+            self.tiles[key] = image
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        return image
+    
+    def request(self, keys):
+        """Render keys in the background, dropping anything still queued from earlier requests"""
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        for key in keys:
+            self.requests.put((generation, key))
+    
+    def worker(self):
+        while True:
+            generation, key = self.requests.get()
+            if generation != self.generation:
+                continue
+            try:
+                image = self.cached(key) or self.render_tile(key)
+            except Exception as e:
+                print(f"Error rendering tile: {e}")
+                continue
+            self.on_tile(key, image)
+    
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.levels.clear()
+            self.tiles.clear()
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v')
+EXTRACTION_MARKER_FILENAME = '.extraction_complete.json'
+
+# Keyframe extraction settings, the GUI and the headless modes start from a copy
+DEFAULT_EXTRACTION_SETTINGS = {
+    'scene_threshold': 0.1,      # Your original setting
+    'min_frames_between': 3,      # Your original: only 3 frames
+    'black_threshold': 15,
+    'black_ratio': 0.90,
+    'max_keyframes_per_minute': 180,  # Your original: 180 not 30!
+    'jpeg_quality': 95,
+    'keyframe_storage': 'files'  # See KEYFRAME_STORAGE_LABELS
+}
+
+
+class ExtractionCancelled(Exception):
+    """Raised by extract_video_keyframes when its cancel event is set"""
+
+
+def frame_difference(frame1, frame2):
+    """Scene change between two BGR frames: 1 - HSV histogram correlation"""
+    hsv1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2HSV)
+    hsv2 = cv2.cvtColor(frame2, cv2.COLOR_BGR2HSV)
+    
+    hist1 = cv2.calcHist([hsv1], [0, 1, 2], None, [50, 60, 60],
+                        [0, 180, 0, 256, 0, 256])
+    hist2 = cv2.calcHist([hsv2], [0, 1, 2], None, [50, 60, 60],
+                        [0, 180, 0, 256, 0, 256])
+    
+    hist1 = cv2.normalize(hist1, hist1).flatten()
+    hist2 = cv2.normalize(hist2, hist2).flatten()
+    
+    correlation = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL)
+    return 1 - max(0, correlation)
+
+
+SIGNATURE_BLOCK_SIZE = 16  # Frames per FrameSignatures batch in select_scene_keyframes
+
+
+class FrameSignatures:
+    """HSV histograms of a block of frames, the signature frame_difference compares.
+    
+    Histograms are kept as raw counts, one float64 row per frame, with
+    their sums and sums of squares: the L2 normalisation in
+    frame_difference does not change a correlation, and with these any
+    pair of frames correlates in one dot product. Scores match
+    frame_difference to rounding.
+    """
+    
+    def __init__(self, frames):
+        self.counts = np.empty((len(frames), 50 * 60 * 60))
+        for row, frame in zip(self.counts, frames):
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            row[:] = cv2.calcHist([hsv], [0, 1, 2], None, [50, 60, 60], [0, 180, 0, 256, 0, 256]).ravel()
+        self.sums = self.counts.sum(axis=1)
+        self.squares = np.einsum('ij,ij->i', self.counts, self.counts)
+    
+    def correlations(self, rows, other, other_rows):
+        """cv2.HISTCMP_CORREL of rows here with other_rows of other, elementwise"""
+        bins = self.counts.shape[1]
+        covariance = (np.einsum('...i,...i->...', self.counts[rows], other.counts[other_rows])
+                      - self.sums[rows] * other.sums[other_rows] / bins)
+        variance = ((self.squares[rows] - self.sums[rows] ** 2 / bins)
+                    * (other.squares[other_rows] - other.sums[other_rows] ** 2 / bins))
+        # compareHist counts a flat histogram as a perfect match
+        return np.where(variance > 0, covariance / np.sqrt(np.maximum(variance, 1e-300)), 1.0)
+    
+    def consecutive_differences(self):
+        """frame_difference of every frame and the next one, all pairs at once"""
+        return 1 - np.maximum(0, self.correlations(slice(None, -1), self, slice(1, None)))
+    
+    def difference(self, row, other, other_row):
+        """frame_difference of frame row here and frame other_row of other"""
+        return 1 - max(0.0, float(self.correlations(row, other, other_row)))
+
+
+def frame_dhash(frame):
+    """64-bit difference hash of a BGR frame as 16 hex digits"""
+    gray = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+    return np.packbits((gray[:, 1:] > gray[:, :-1]).ravel()).tobytes().hex()
+
+
+def is_black_frame(frame, settings):
+    """Check if frame is mostly black"""
+    gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    black_pixels = np.sum(gray_frame < settings['black_threshold'])
+    total_pixels = gray_frame.shape[0] * gray_frame.shape[1]
+    return black_pixels / total_pixels >= settings['black_ratio']
+
+
+def keyframes_folder_for(video_path):
+    """Output folder of a video: {video_name}_keyframes next to it"""
+    return os.path.join(os.path.dirname(os.path.abspath(video_path)), f"{Path(video_path).stem}_keyframes")
+
+
+def read_extraction_marker(video_path):
+    """Completion marker of a video's keyframes folder, None if absent or for another file version"""
+    try:
+        with open(os.path.join(keyframes_folder_for(video_path), EXTRACTION_MARKER_FILENAME),
+                  encoding='utf-8') as f:
+            marker = json.load(f)
+        st = os.stat(video_path)
+    except (OSError, ValueError):
+        return None
+    if marker.get('size') != st.st_size or marker.get('mtime_ns') != st.st_mtime_ns:
+        return None
+    return marker
+
+
+def read_video_frames(cap, video_path, total_frames, on_progress=None, cancel=None):
+    """Decode stage: (frame index, BGR frame) for every frame of an open capture.
+    
+    Checks cancel and reports on_progress(frame_index, total_frames) every 30
+    frames, before the frame is handed on.
+    """
+    frame_index = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            return
+        if frame_index and frame_index % 30 == 0:
+            if cancel is not None and cancel.is_set():
+                raise ExtractionCancelled(video_path)
+            if on_progress:
+                on_progress(frame_index, total_frames)
+        yield frame_index, frame
+        frame_index += 1
+
+
+def select_scene_keyframes(frames, video_name, fps, max_allowed, settings, counts):
+    """Scene detection stage: (filename, frame index, frame, scene score) for every keyframe.
+    
+    This is the keyframe choice of extract_video_keyframes. The first frame
+    is a keyframe unless black, after it a frame needs min_frames_between
+    frames of distance and a frame_difference of at least scene_threshold.
+    counts['keyframes_detected'] and counts['black_filtered'] are kept up
+    to date. Frames are taken SIGNATURE_BLOCK_SIZE at a time: the histogram
+    of every frame that can be compared is computed once, the scores of
+    consecutive ones in one go, and scores against an earlier frame (after
+    a keyframe or a black frame) on demand.
+    """
+    prev_signatures = None  # Signatures block and row of the last compared frame
+    prev_row = None
+    frames_since_last = 0
+    while True:
+        block = list(itertools.islice(frames, SIGNATURE_BLOCK_SIZE))
+        if not block:
+            return
+        
+        # Frames that are compared unless a keyframe or a black frame comes first; in the
+        # usual case each one is compared with the one before, so those scores come in one go
+        candidates = []
+        since = frames_since_last
+        for position, (frame_index, frame) in enumerate(block):
+            if frame_index == 0:
+                candidates.append(position)
+                continue
+            since += 1
+            if since >= settings['min_frames_between'] and counts['keyframes_detected'] < max_allowed:
+                candidates.append(position)
+        signatures = consecutive = None
+        rows = {position: row for row, position in enumerate(candidates)}
+        if candidates:
+            signatures = FrameSignatures([block[position][1] for position in candidates])
+            consecutive = signatures.consecutive_differences()
+        
+        for position, (frame_index, frame) in enumerate(block):
+            if frame_index == 0:
+                if not is_black_frame(frame, settings):
+                    counts['keyframes_detected'] += 1
+                    prev_signatures, prev_row = signatures, rows[position]
+                    yield f"{video_name}_keyframe_{0:04d}.jpg", 0, frame, None
+                continue
+            
+            frames_since_last += 1
+            
+            # Check if reached max keyframes
+            if counts['keyframes_detected'] >= max_allowed:
+                continue
+            
+            # Skip if too soon after last keyframe
+            if frames_since_last < settings['min_frames_between']:
+                continue
+            
+            # Skip black frames
+            if is_black_frame(frame, settings):
+                counts['black_filtered'] += 1
+                continue
+            
+            # Calculate scene change
+            row = rows[position]
+            if prev_signatures is not None:
+                if prev_signatures is signatures and prev_row == row - 1:
+                    difference = float(consecutive[row - 1])
+                else:
+                    difference = prev_signatures.difference(prev_row, signatures, row)
+                
+                if difference >= settings['scene_threshold']:
+                    timestamp = frame_index / fps
+                    minutes = int(timestamp // 60)
+                    seconds = int(timestamp % 60)
+                    filename = (f"{video_name}_keyframe_{counts['keyframes_detected']:04d}"
+                                f"_{minutes:02d}m{seconds:02d}s.jpg")
+                    counts['keyframes_detected'] += 1
+                    frames_since_last = 0
+                    yield filename, frame_index, frame, difference
+            
+            prev_signatures, prev_row = signatures, row
+
+
+def extract_video_keyframes(video_path, settings, on_start=None, on_progress=None,
+                            on_keyframe=None, cancel=None):
+    """Extract keyframes from a video using YOUR ORIGINAL ALGORITHM.
+    
+    Writes {video_name}_keyframes next to the video in the storage mode from
+    settings and finishes with a completion marker. Callbacks run on the
+    calling thread: on_start(output_folder, total_frames, duration_minutes),
+    on_progress(frame_count, total_frames) every 30 frames and
+    on_keyframe(count). Returns the marker contents, which list every
+    keyframe with its frame index, timestamp, scene score and dHash.
+    """
+    st = os.stat(video_path)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"无法打开视频文件: {video_path}")
+    
+    ref_writer = pack_writer = None
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        video_name = Path(video_path).stem
+        duration_minutes = total_frames / fps / 60
+        jpeg_quality = settings['jpeg_quality']
+        
+        # Create output directory, a stale marker must not outlive a new run
+        output_base = keyframes_folder_for(video_path)
+        os.makedirs(output_base, exist_ok=True)
+        marker_path = os.path.join(output_base, EXTRACTION_MARKER_FILENAME)
+        if os.path.exists(marker_path):
+            os.remove(marker_path)
+        if on_start:
+            on_start(output_base, total_frames, duration_minutes)
+        
+        # Reference mode keeps frame positions only, the sorter decodes on demand;
+        # pack mode writes one data file instead of a JPEG per keyframe
+        if settings['keyframe_storage'] == 'reference':
+            ref_writer = KeyframeRefWriter(output_base, video_path, fps, jpeg_quality)
+        elif settings['keyframe_storage'] == 'pack':
+            pack_writer = KeyframePackWriter(output_base)
+        
+        # Gallery thumbnails go straight into sprite sheets, the sorter reads a few files instead of every keyframe
+        atlas_writer = ThumbnailAtlasWriter(ThumbnailAtlas(output_base), fresh=True)
+        keyframes = []
+        
+        def save_keyframe(filename, frame_index, frame, score):
+            keyframes.append({'file': filename, 'frame': frame_index, 'timestamp': frame_index / fps,
+                              'score': score, 'dhash': frame_dhash(frame)})
+            stat = None
+            if ref_writer:
+                ref_writer.add(filename, frame_index, frame_index / fps, frame)
+            elif pack_writer:
+                pack_writer.add_frame(filename, frame, jpeg_quality)
+            else:
+                path = os.path.join(output_base, filename)
+                cv2.imwrite(path, frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+                stat = os.stat(path)
+            atlas_writer.add(filename, frame_thumbnail(frame), stat)
+        
+        # Calculate maximum allowed keyframes
+        max_allowed = int(duration_minutes * settings['max_keyframes_per_minute'])
+        counts = {'keyframes_detected': 0, 'black_filtered': 0}
+        frames = read_video_frames(cap, video_path, total_frames, on_progress, cancel)
+        for filename, frame_index, frame, score in select_scene_keyframes(frames, video_name, fps, max_allowed,
+                                                                          settings, counts):
+            save_keyframe(filename, frame_index, frame, score)
+            if on_keyframe and frame_index:
+                on_keyframe(counts['keyframes_detected'])
+        keyframes_detected = counts['keyframes_detected']
+        black_filtered = counts['black_filtered']
+        
+        if pack_writer:
+            pack_writer.close()
+            pack_writer = None
+        atlas_writer.flush()
+    finally:
+        cap.release()
+        if ref_writer:
+            ref_writer.close()
+        if pack_writer:
+            pack_writer.abort()
+    
+    marker = {
+        'video': os.path.abspath(video_path),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'video_name': video_name,
+        'output_folder': output_base,
+        'total_frames': total_frames,
+        'fps': fps,
+        'duration_minutes': duration_minutes,
+        'keyframes_detected': keyframes_detected,
+        'black_filtered': black_filtered,
+        'storage': settings['keyframe_storage'],
+        'settings': dict(settings),
+        'finished': time.time(),
+        'keyframes': keyframes
+    }
+    with open(marker_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(marker, f, ensure_ascii=False, indent=2)
+    os.replace(marker_path + '.tmp', marker_path)
+    return marker
+
+
+PIPELINE_REPORT_FILENAME = '.pipeline_report.json'
+PIPELINE_UNSURE_CHOICES = ('skip', 'background', 'human', 'both')
+
+DEFAULT_PIPELINE_SETTINGS = dict(DEFAULT_EXTRACTION_SETTINGS, **{
+    'autoclass_max_side': 512,              # Detection input, longest side in pixels
+    'autoclass_human_threshold': 0.5,       # Score at or above: human
+    'autoclass_background_threshold': 0.15,  # Score below: background
+    'unsure': 'skip',                       # Where keyframes in between go, see PIPELINE_UNSURE_CHOICES
+    'crop_people': True,
+    'crop_min_score': 0.5                   # Proposals at or above are cropped, the rest stay pending
+})
+
+
+def ordered_thread_map(fn, items, workers, name):
+    """fn over a stream on worker threads, results in input order with at most 2 * workers in flight"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def classify_keyframe_stream(keyframes, settings, workers):
+    """Classification stage: detection on a downscaled copy of each in-memory keyframe.
+    
+    Adds 'detection' (as detect_humans returns it), 'predicted' ('human',
+    'background' or None if unsure) and 'label', where unsure keyframes get
+    settings['unsure'] and 'skip' becomes None. Each worker thread has its
+    own detectors, Haar cascades must not be shared between threads.
+    """
+    local = threading.local()
+    max_side = settings['autoclass_max_side']
+    
+    def classify(item):
+        if not hasattr(local, 'detectors'):
+            local.detectors = build_human_detectors()
+        frame = item['image']
+        height, width = frame.shape[:2]
+        if max(width, height) > max_side:
+            ratio = max_side / max(width, height)
+            frame = cv2.resize(frame, (max(1, int(round(width * ratio))), max(1, int(round(height * ratio)))),
+                               interpolation=cv2.INTER_AREA)
+        score, boxes = detect_humans_in_frame(frame, width / frame.shape[1], local.detectors)
+        item['detection'] = {'score': score, 'boxes': boxes, 'image_size': [width, height]}
+        if score >= settings['autoclass_human_threshold']:
+            item['predicted'] = 'human'
+        elif score < settings['autoclass_background_threshold']:
+            item['predicted'] = 'background'
+        else:
+            item['predicted'] = None
+        unsure = None if settings['unsure'] == 'skip' else settings['unsure']
+        item['label'] = item['predicted'] or unsure
+        return item
+    
+    return ordered_thread_map(classify, keyframes, workers, 'pipeline-detect')
+
+
+def crop_person_regions(keyframes, settings):
+    """Crop stage: person proposals of every keyframe labelled human, cut from the full in-memory frame.
+    
+    Adds 'proposals' in the cropper's format and 'crops' [(proposal, BGR
+    view)] for the proposals scoring at least crop_min_score, which are
+    marked accepted; the others stay pending for review in the cropper.
+    """
+    for item in keyframes:
+        item['proposals'] = []
+        item['crops'] = []
+        if settings['crop_people'] and item['label'] in ('human', 'both'):
+            for n, box in enumerate(person_region_proposals(item['detection'])):
+                proposal = {'id': n, 'box': box[:4], 'score': round(box[4], 3), 'state': 'pending',
+                            'source': 'auto'}
+                if box[4] >= settings['crop_min_score']:
+                    proposal['state'] = 'accepted'
+                    x1, y1, x2, y2 = box[:4]
+                    item['crops'].append((proposal, item['image'][y1:y2, x1:x2]))
+                item['proposals'].append(proposal)
+        yield item
+
+
+def write_pipeline_keyframe(item, folders, jpeg_quality):
+    """Write stage: encode a keyframe once into its sorted folders, then its crops, and drop the pixels"""
+    params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+    item['dhash'] = frame_dhash(item['image'])
+    item['written'] = []
+    item['crop_outputs'] = []
+    if item['label']:
+        data = cv2.imencode('.jpg', item['image'], params)[1].tobytes()
+        item['source_hash'] = content_hash(data)
+        for label in (('background', 'human') if item['label'] == 'both' else (item['label'],)):
+            path = os.path.join(folders[label], item['file'])
+            write_bytes_atomic(path, data)
+            item['written'].append(path)
+        stem = Path(item['file']).stem
+        for proposal, crop in item['crops']:
+            output = os.path.join(folders['crop'], f"{stem}_person_{proposal['id']:02d}.jpg")
+            write_bytes_atomic(output, cv2.imencode('.jpg', crop, params)[1].tobytes())
+            item['crop_outputs'].append((output, proposal['box']))
+    item['image'] = None
+    item['crops'] = []
+    return item
+
+
+def run_streaming_pipeline(video_path, settings=None, output_folder=None, workers=None,
+                           on_start=None, on_progress=None, cancel=None):
+    """Video to sorted keyframes and person crops in one pass, without intermediate files.
+    
+    Chains read_video_frames, select_scene_keyframes, classify_keyframe_stream,
+    crop_person_regions and write_pipeline_keyframe as generator stages, so
+    every keyframe is decoded once and kept in memory until it is encoded.
+    Only final outputs are written: Background/ and Human/ of the sorted
+    folder ({video_name}_sorted next to the video unless output_folder is
+    given), person crops with their recipes and proposals in
+    Cropped_Figures/, and a report listing every keyframe with its score and
+    label. Callbacks are those of extract_video_keyframes. Returns the report.
+    """
+    settings = dict(DEFAULT_PIPELINE_SETTINGS, **(settings or {}))
+    workers = workers or min(4, os.cpu_count() or 2)
+    get_human_detectors()  # Fails here, before any output, on builds without detectors
+    
+    st = os.stat(video_path)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"无法打开视频文件: {video_path}")
+    
+    video_name = Path(video_path).stem
+    sorted_folder = os.path.abspath(output_folder or os.path.join(
+        os.path.dirname(os.path.abspath(video_path)), f"{video_name}_sorted"))
+    folders = {label: os.path.join(sorted_folder, sub) for label, sub in DATASET_CLASSES.items()}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+    recipes = CropRecipeStore(folders['crop'])
+    keyframes = []
+    proposals = {}
+    crops = []
+    started = time.time()
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        duration_minutes = total_frames / fps / 60
+        if on_start:
+            on_start(sorted_folder, total_frames, duration_minutes)
+        
+        max_allowed = int(duration_minutes * settings['max_keyframes_per_minute'])
+        counts = {'keyframes_detected': 0, 'black_filtered': 0}
+        stream = read_video_frames(cap, video_path, total_frames, on_progress, cancel)
+        stream = ({'file': filename, 'frame': frame_index, 'timestamp': frame_index / fps, 'score': score,
+                   'image': frame}
+                  for filename, frame_index, frame, score in select_scene_keyframes(
+                      stream, video_name, fps, max_allowed, settings, counts))
+        stream = classify_keyframe_stream(stream, settings, workers)
+        stream = crop_person_regions(stream, settings)
+        stream = ordered_thread_map(lambda item: write_pipeline_keyframe(item, folders, settings['jpeg_quality']),
+                                    stream, workers, 'pipeline-write')
+        
+        for item in stream:
+            keyframes.append({'file': item['file'], 'frame': item['frame'], 'timestamp': item['timestamp'],
+                              'score': item['score'], 'dhash': item['dhash'],
+                              'human_score': item['detection']['score'], 'predicted': item['predicted'],
+                              'label': item['label'], 'crops': [os.path.basename(output)
+                                                                for output, box in item['crop_outputs']]})
+            if item['proposals']:
+                proposals[item['file']] = item['proposals']
+            for output, box in item['crop_outputs']:
+                recipes.add(output, item['written'][-1], item['source_hash'], box)
+                crops.append((output, item['written'][-1], box))
+    finally:
+        cap.release()
+    
+    if proposals:
+        path = os.path.join(folders['crop'], '.crop_proposals.json')
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                proposals = dict(json.load(f), **proposals)
+        except (OSError, ValueError):
+            pass
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(proposals, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+    
+    report = {
+        'video': os.path.abspath(video_path),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'video_name': video_name,
+        'output_folder': sorted_folder,
+        'total_frames': total_frames,
+        'fps': fps,
+        'duration_minutes': duration_minutes,
+        'keyframes_detected': counts['keyframes_detected'],
+        'black_filtered': counts['black_filtered'],
+        'labels': {label or 'skip': sum(1 for kf in keyframes if kf['label'] == label)
+                   for label in ('background', 'human', 'both', None)},
+        'crops': len(crops),
+        'storage': 'pipeline',
+        'settings': settings,
+        'seconds': time.time() - started,
+        'finished': time.time(),
+        'keyframes': keyframes
+    }
+    report_path = os.path.join(sorted_folder, PIPELINE_REPORT_FILENAME)
+    with open(report_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(report_path + '.tmp', report_path)
+    
+    # The project is catalogued under the keyframes folder it would have had, which stays empty
+    keyframes_folder = keyframes_folder_for(video_path)
+    try:
+        catalog = ProjectCatalog()
+        catalog.record_extraction(dict(report, output_folder=keyframes_folder))
+        catalog.ensure_project(keyframes_folder, sorted_folder=sorted_folder)
+        catalog.set_labels(keyframes_folder, {kf['file']: kf['label'] for kf in keyframes})
+        for output, source, box in crops:
+            catalog.add_crop(folders['crop'], output, source, box)
+    except sqlite3.Error:
+        pass  # The sorted folder is complete either way, 'catalog scan' catches up
+    return report
+
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    video_name TEXT NOT NULL,
+    video_path TEXT,
+    keyframes_folder TEXT NOT NULL UNIQUE,
+    sorted_folder TEXT,
+    cropped_folder TEXT,
+    fps REAL,
+    total_frames INTEGER,
+    duration_minutes REAL,
+    storage TEXT,
+    extracted REAL,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS projects_sorted ON projects(sorted_folder);
+CREATE TABLE IF NOT EXISTS keyframes (
+    id INTEGER PRIMARY KEY,
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    keyframe_index INTEGER,
+    frame INTEGER,
+    timestamp REAL,
+    scene_score REAL,
+    dhash TEXT,
+    label TEXT,
+    labelled REAL,
+    UNIQUE (project_id, name)
+);
+CREATE INDEX IF NOT EXISTS keyframes_label ON keyframes(label, project_id, timestamp);
+CREATE INDEX IF NOT EXISTS keyframes_time ON keyframes(project_id, timestamp);
+CREATE TABLE IF NOT EXISTS crops (
+    id INTEGER PRIMARY KEY,
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    output TEXT NOT NULL,
+    source_name TEXT NOT NULL,
+    x0 INTEGER, y0 INTEGER, x1 INTEGER, y1 INTEGER,
+    created REAL,
+    UNIQUE (project_id, output)
+);
+CREATE INDEX IF NOT EXISTS crops_source ON crops(project_id, source_name);
+"""
+
+
+def default_catalog_path():
+    """HISTORICAL_SCENE_CATALOG if set, otherwise a file in the home folder"""
+    return os.environ.get('HISTORICAL_SCENE_CATALOG') or \
+        os.path.join(os.path.expanduser('~'), '.historical_scene_catalog.sqlite3')
+
+
+class ProjectCatalog:
+    """SQLite index of every project: keyframes, their sort labels and their crops.
+    
+    Projects are keyed by keyframes folder. Extraction, sorting and cropping
+    update it as they go; the folders stay the source of truth, and
+    scan_project rebuilds a project's rows from them. One connection per
+    thread, WAL mode so the GUI, the watch daemon and job processes can
+    write to the same file.
+    """
+    
+    def __init__(self, path=None):
+        self.path = path or default_catalog_path()
+        self.local = threading.local()
+    
+    def connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            conn.executescript(CATALOG_SCHEMA)
+            self.local.conn = conn
+        return conn
+    
+    def ensure_project(self, keyframes_folder, **fields):
+        """Project id of a keyframes folder, created if needed; given fields are updated"""
+        keyframes_folder = os.path.abspath(keyframes_folder)
+        video_name = fields.pop('video_name', None) or re.sub(r'_keyframes$', '', os.path.basename(keyframes_folder))
+        conn = self.connect()
+        with conn:
+            conn.execute("INSERT INTO projects (video_name, keyframes_folder, updated) VALUES (?, ?, ?) "
+                         "ON CONFLICT (keyframes_folder) DO UPDATE SET updated = excluded.updated",
+                         (video_name, keyframes_folder, time.time()))
+            if fields:
+                conn.execute(f"UPDATE projects SET {', '.join(f'{key} = ?' for key in fields)} "
+                             f"WHERE keyframes_folder = ?", (*fields.values(), keyframes_folder))
+            return conn.execute("SELECT id FROM projects WHERE keyframes_folder = ?",
+                                (keyframes_folder,)).fetchone()[0]
+    
+    def record_extraction(self, marker):
+        """Index a finished extraction (the completion marker); labels of unchanged names survive"""
+        project_id = self.ensure_project(
+            marker['output_folder'], video_name=marker['video_name'], video_path=marker['video'],
+            fps=marker['fps'], total_frames=marker['total_frames'],
+            duration_minutes=marker['duration_minutes'], storage=marker['storage'],
+            extracted=marker['finished'])
+        rows = [(project_id, kf['file'], index, kf['frame'], kf['timestamp'], kf['score'], kf['dhash'])
+                for index, kf in enumerate(marker.get('keyframes', []))]
+        conn = self.connect()
+        with conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS extracted_names (name TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM extracted_names")
+            conn.executemany("INSERT OR IGNORE INTO extracted_names VALUES (?)", [(row[1],) for row in rows])
+            conn.execute("DELETE FROM keyframes WHERE project_id = ? AND name NOT IN "
+                         "(SELECT name FROM extracted_names)", (project_id,))
+            conn.executemany(
+                "INSERT INTO keyframes (project_id, name, keyframe_index, frame, timestamp, scene_score, dhash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (project_id, name) DO UPDATE SET "
+                "keyframe_index = excluded.keyframe_index, frame = excluded.frame, "
+                "timestamp = excluded.timestamp, scene_score = excluded.scene_score, dhash = excluded.dhash",
+                rows)
+        return project_id
+    
+    def index_names(self, keyframes_folder, names, **fields):
+        """Add keyframes known only by filename (folders sorted without a recorded extraction)"""
+        project_id = self.ensure_project(keyframes_folder, **fields)
+        rows = []
+        for name in names:
+            meta = keyframe_metadata(os.path.splitext(name)[0])
+            rows.append((project_id, name, meta['keyframe_index'], meta['timestamp']))
+        conn = self.connect()
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO keyframes (project_id, name, keyframe_index, timestamp) "
+                             "VALUES (?, ?, ?, ?)", rows)
+        return project_id
+    
+    def set_labels(self, keyframes_folder, labels, replace_all=False):
+        """labels: {name: 'background' | 'human' | 'both' | 'skip' | None}; replace_all clears the rest"""
+        project_id = self.index_names(keyframes_folder, labels)
+        now = time.time()
+        conn = self.connect()
+        with conn:
+            if replace_all:
+                conn.execute("UPDATE keyframes SET label = NULL, labelled = NULL "
+                             "WHERE project_id = ? AND label IS NOT NULL", (project_id,))
+            conn.executemany("UPDATE keyframes SET label = ?, labelled = ? WHERE project_id = ? AND name = ?",
+                             [(label, now if label else None, project_id, name)
+                              for name, label in labels.items()])
+    
+    def add_crop(self, cropped_folder, output_path, source_path, box):
+        """Record a crop of a sorted keyframe, ignored if its project is unknown"""
+        sorted_folder = os.path.dirname(os.path.abspath(cropped_folder))
+        conn = self.connect()
+        with conn:
+            project = conn.execute("SELECT id FROM projects WHERE sorted_folder = ?", (sorted_folder,)).fetchone()
+            if project is None:
+                return False
+            conn.execute("UPDATE projects SET cropped_folder = ?, updated = ? WHERE id = ?",
+                         (os.path.abspath(cropped_folder), time.time(), project[0]))
+            conn.execute("INSERT INTO crops (project_id, output, source_name, x0, y0, x1, y1, created) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (project_id, output) DO UPDATE SET "
+                         "source_name = excluded.source_name, x0 = excluded.x0, y0 = excluded.y0, "
+                         "x1 = excluded.x1, y1 = excluded.y1, created = excluded.created",
+                         (project[0], os.path.basename(output_path), os.path.basename(source_path),
+                          *[int(v) for v in box], time.time()))
+        return True
+    
+    def scan_project(self, keyframes_folder):
+        """Rebuild a project's rows from its folders: marker or filenames, sorted folders, crop recipes"""
+        keyframes_folder = os.path.abspath(keyframes_folder)
+        video_name = re.sub(r'_keyframes$', '', os.path.basename(keyframes_folder))
+        marker = None
+        try:
+            with open(os.path.join(keyframes_folder, EXTRACTION_MARKER_FILENAME), encoding='utf-8') as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if marker and 'keyframes' in marker:
+            self.record_extraction(dict(marker, output_folder=keyframes_folder))
+        names = list_keyframe_names(keyframes_folder, ('.jpg', '.jpeg', '.png'))
+        
+        sorted_folder = os.path.join(os.path.dirname(keyframes_folder), f"{video_name}_sorted")
+        labels = {}
+        if os.path.isdir(sorted_folder):
+            for label, sub in (('background', 'Background'), ('human', 'Human')):
+                folder = os.path.join(sorted_folder, sub)
+                if os.path.isdir(folder):
+                    for name in os.listdir(folder):
+                        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                            labels[name] = 'both' if name in labels else label
+            known = set(names)
+            names += [name for name in labels if name not in known]
+        self.index_names(keyframes_folder, names,
+                         sorted_folder=sorted_folder if os.path.isdir(sorted_folder) else None)
+        self.set_labels(keyframes_folder, labels, replace_all=True)
+        
+        cropped_folder = os.path.join(sorted_folder, 'Cropped_Figures')
+        recipes = CropRecipeStore(cropped_folder).load() if os.path.isdir(cropped_folder) else {}
+        for recipe in recipes.values():
+            self.add_crop(cropped_folder, recipe['output'], recipe['source'], recipe['box'])
+        return len(names), len(labels), len(recipes)
+    
+    def projects(self):
+        """Every project with keyframe, label and crop counts, most recently updated first"""
+        return [dict(row) for row in self.connect().execute(
+            "SELECT p.*, "
+            "(SELECT COUNT(*) FROM keyframes k WHERE k.project_id = p.id) AS keyframes, "
+            "(SELECT COUNT(*) FROM keyframes k WHERE k.project_id = p.id AND k.label IN ('human', 'both')) AS human, "
+            "(SELECT COUNT(*) FROM keyframes k WHERE k.project_id = p.id AND k.label IS NOT NULL) AS labelled, "
+            "(SELECT COUNT(*) FROM crops c WHERE c.project_id = p.id) AS crops "
+            "FROM projects p ORDER BY p.updated DESC")]
+    
+    def query(self, videos=None, labels=None, from_minute=None, to_minute=None, has_crops=None, limit=None):
+        """Keyframes matching every given filter; videos are GLOB patterns on the video name.
+        
+        Labels name the folder a keyframe was sorted into, so 'human' and
+        'background' both include keyframes labelled 'both'.
+        """
+        where, params = [], []
+        if videos:
+            where.append('(' + ' OR '.join('p.video_name GLOB ?' for _ in videos) + ')')
+            params += list(videos)
+        if labels:
+            labels = set(labels)
+            if labels & {'human', 'background'}:
+                labels.add('both')
+            where.append(f"k.label IN ({', '.join('?' for _ in labels)})")
+            params += list(labels)
+        if from_minute is not None:
+            where.append('k.timestamp >= ?')
+            params.append(from_minute * 60)
+        if to_minute is not None:
+            where.append('k.timestamp < ?')
+            params.append(to_minute * 60)
+        if has_crops is not None:
+            where.append(('' if has_crops else 'NOT ') +
+                         'EXISTS (SELECT 1 FROM crops c WHERE c.project_id = k.project_id AND c.source_name = k.name)')
+        sql = ("SELECT k.*, p.video_name, p.keyframes_folder, p.sorted_folder, "
+               "(SELECT COUNT(*) FROM crops c WHERE c.project_id = k.project_id AND c.source_name = k.name) AS crops "
+               "FROM keyframes k JOIN projects p ON p.id = k.project_id")
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY p.video_name, k.timestamp, k.name'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        return [dict(row) for row in self.connect().execute(sql, params)]
+    
+    def crops_of(self, project_id, source_name):
+        return [dict(row) for row in self.connect().execute(
+            "SELECT * FROM crops WHERE project_id = ? AND source_name = ? ORDER BY output",
+            (project_id, source_name))]
+
+
+def catalog_keyframe_path(row):
+    """Where a catalogued keyframe's image is: its sorted copy if labelled, else the keyframes folder"""
+    if row['sorted_folder'] and row['label'] in ('human', 'both', 'background'):
+        sub = 'Background' if row['label'] == 'background' else 'Human'
+        path = os.path.join(row['sorted_folder'], sub, row['name'])
+        if os.path.lexists(path):
+            return path
+    return os.path.join(row['keyframes_folder'], row['name'])
+
+
+class InotifyWatcher:
+    """Linux inotify on a set of folders through ctypes, raises OSError where unavailable"""
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    
+    def __init__(self, folders):
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}
+        for folder in folders:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), self.IN_CLOSE_WRITE | self.IN_MOVED_TO)
+            if wd < 0:
+                error = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(error, f"inotify_add_watch failed: {folder}")
+            self.folders[wd] = folder
+    
+    def wait(self, timeout):
+        """Paths written or moved into the folders, blocks up to timeout seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            offset += 16 + length
+            if name and wd in self.folders:
+                paths.append(os.path.join(self.folders[wd], os.fsdecode(name)))
+        return paths
+    
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback without change notifications, the daemon's periodic rescan finds new files"""
+    
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return []
+    
+    def close(self):
+        pass
+
+
+def open_folder_watcher(folders):
+    """InotifyWatcher where the platform has it, PollingWatcher otherwise"""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher()
+
+
+def ignore_interrupts():
+    """Worker initializer: Ctrl+C stops the daemon, which lets running jobs finish"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class WatchFolderDaemon:
+    """Headless ingestion: extract keyframes from videos dropped into watched folders.
+    
+    A file is picked up once its size and mtime have not changed for settle
+    seconds. inotify only speeds up discovery, every folder is also rescanned
+    each poll seconds because network shares deliver no events for remote
+    writes. The state file records finished and failed videos by size and
+    mtime, so a restart skips them and a replaced file is processed again.
+    
+    A video whose decoder kills its worker process breaks the whole pool. The
+    pool is then recreated and every video it was running is retried alone,
+    so only the one that crashes again is marked failed.
+    """
+    
+    def __init__(self, folders, settings, state_path, workers=2, settle=10.0, poll=10.0,
+                 retry_failed=False, log=print):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.settings = settings
+        self.state_path = state_path
+        self.workers = max(1, workers)
+        self.settle = settle
+        self.poll = poll
+        self.retry_failed = retry_failed
+        self.log = log
+        self.state = self.load_state()
+        self.candidates = {}  # path -> (size, mtime_ns, unchanged since)
+        self.queued = []
+        self.running = {}  # future -> (path, size, mtime_ns)
+        self.suspects = set()  # Paths running when the pool broke, retried one at a time
+        self.pool = None
+        self.stopping = False
+        self.catalog = ProjectCatalog()
+    
+    def load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f).get('videos', {})
+        except (OSError, ValueError):
+            return {}
+    
+    def save_state(self):
+        with open(self.state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'videos': self.state}, f, ensure_ascii=False, indent=1)
+        os.replace(self.state_path + '.tmp', self.state_path)
+    
+    def is_handled(self, path, st):
+        """True if this version of the file was already extracted (or failed)"""
+        entry = self.state.get(path)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry['status'] == 'done' or not self.retry_failed
+        # Videos extracted from the GUI or before the state file existed
+        return read_extraction_marker(path) is not None
+    
+    def busy_paths(self):
+        return set(self.queued) | {job[0] for job in self.running.values()}
+    
+    def scan(self):
+        """Add every unhandled video in the folders to the candidates"""
+        for folder in self.folders:
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.name.lower().endswith(VIDEO_EXTENSIONS) and entry.is_file():
+                            self.candidates.setdefault(entry.path, None)
+            except OSError as e:
+                self.log(f"Cannot list {folder}: {e}")
+    
+    def check_candidates(self):
+        """Queue candidates whose size and mtime have settled"""
+        now = time.monotonic()
+        busy = self.busy_paths()
+        for path, seen in list(self.candidates.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.candidates[path]
+                continue
+            if path in busy or self.is_handled(path, st):
+                del self.candidates[path]
+                continue
+            if seen is None or seen[:2] != (st.st_size, st.st_mtime_ns):
+                self.candidates[path] = (st.st_size, st.st_mtime_ns, now)
+            elif st.st_size and now - seen[2] >= self.settle:
+                del self.candidates[path]
+                self.queued.append(path)
+    
+    def start_pool(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=ignore_interrupts)
+    
+    def submit_ready(self):
+        while self.queued and len(self.running) < self.workers:
+            path = self.queued[0]
+            if self.suspects & self.busy_paths():
+                # Suspects go first, each alone, so a second crash names the video that causes it
+                if self.running:
+                    break
+                path = next(p for p in self.queued if p in self.suspects)
+            self.queued.remove(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.suspects.discard(path)
+                continue
+            try:
+                future = self.pool.submit(extract_video_keyframes, path, self.settings)
+            except BrokenProcessPool:
+                # A worker died since the last collect, its videos are re-queued there
+                self.queued.insert(0, path)
+                break
+            self.log(f"Extracting {path}")
+            self.running[future] = (path, st.st_size, st.st_mtime_ns)
+    
+    def collect_finished(self):
+        broken = False
+        for future in [f for f in self.running if f.done()]:
+            path, size, mtime_ns = self.running.pop(future)
+            try:
+                marker = future.result()
+            except BrokenProcessPool as e:
+                broken = True
+                if self.stopping:
+                    continue
+                if path not in self.suspects:
+                    self.suspects.add(path)
+                    self.queued.insert(0, path)
+                    self.log(f"Worker crashed while extracting {path}, retrying it alone")
+                    continue
+                self.suspects.discard(path)
+                self.state[path] = {'status': 'failed', 'size': size, 'mtime_ns': mtime_ns,
+                                    'error': f"worker process crashed: {e}", 'finished': time.time()}
+                self.log(f"Failed {path}: worker process crashed")
+            except BaseException as e:
+                if self.stopping:
+                    continue  # Interrupted, picked up again after a restart
+                self.suspects.discard(path)
+                self.state[path] = {'status': 'failed', 'size': size, 'mtime_ns': mtime_ns,
+                                    'error': str(e), 'finished': time.time()}
+                self.log(f"Failed {path}: {e}")
+            else:
+                self.suspects.discard(path)
+                self.state[path] = {'status': 'done', 'size': size, 'mtime_ns': mtime_ns,
+                                    'output_folder': marker['output_folder'],
+                                    'keyframes': marker['keyframes_detected'],
+                                    'finished': marker['finished']}
+                self.log(f"Done {path}: {marker['keyframes_detected']} keyframes")
+                try:
+                    self.catalog.record_extraction(marker)
+                except sqlite3.Error as e:
+                    self.log(f"Catalog not updated for {path}: {e}")
+            self.save_state()
+        if broken and not self.stopping:
+            self.start_pool()
+    
+    def stop(self, *args):
+        self.stopping = True
+    
+    def run(self, once=False):
+        """Watch until stop() (or, with once, until the current backlog is done)"""
+        watcher = open_folder_watcher(self.folders)
+        self.log(f"Watching {len(self.folders)} folder(s) with {type(watcher).__name__}, "
+                 f"{self.workers} worker(s)")
+        next_scan = 0
+        self.start_pool()
+        try:
+            while not self.stopping:
+                if time.monotonic() >= next_scan:
+                    self.scan()
+                    next_scan = time.monotonic() + self.poll
+                self.check_candidates()
+                self.submit_ready()
+                self.collect_finished()
+                if once and not (self.candidates or self.queued or self.running):
+                    break
+                for path in watcher.wait(min(1.0, self.poll)):
+                    if path.lower().endswith(VIDEO_EXTENSIONS):
+                        self.candidates.setdefault(path, None)
+            if self.stopping:
+                self.log("Stopping, waiting for running extractions")
+                for future in self.running:
+                    future.cancel()
+                wait(list(self.running))
+                self.collect_finished()
+        finally:
+            self.pool.shutdown()
+            watcher.close()
+
+
+JOB_KINDS = ('extract', 'export-crops', 'export-dataset')
+JOB_FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+
+def prepare_job(kind, params):
+    """Validate a submitted job, returns (normalised params, output folder), raises ValueError"""
+    params = dict(params or {})
+    if kind == 'extract':
+        video_path = params.get('video_path')
+        if not video_path or not os.path.isfile(video_path):
+            raise ValueError(f"video not found: {video_path}")
+        settings = dict(DEFAULT_EXTRACTION_SETTINGS)
+        for key, value in (params.get('settings') or {}).items():
+            if key not in settings:
+                raise ValueError(f"unknown extraction setting: {key}")
+            try:
+                settings[key] = type(settings[key])(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"bad value for {key}: {value!r}")
+        if settings['keyframe_storage'] not in KEYFRAME_STORAGE_LABELS:
+            raise ValueError(f"unknown keyframe storage: {settings['keyframe_storage']}")
+        return {'video_path': os.path.abspath(video_path), 'settings': settings}, keyframes_folder_for(video_path)
+    
+    if kind == 'export-crops':
+        crop_folder = params.get('crop_folder')
+        if not crop_folder or not os.path.isdir(crop_folder):
+            raise ValueError(f"crop folder not found: {crop_folder}")
+        image_format = params.get('format', 'jpeg')
+        if image_format not in CROP_EXPORT_FORMATS:
+            raise ValueError(f"unknown format: {image_format}")
+        output = os.path.abspath(params.get('output') or os.path.join(crop_folder, 'Export'))
+        return {'crop_folder': os.path.abspath(crop_folder), 'output': output, 'format': image_format,
+                'size': int(params['size']) if params.get('size') else None,
+                'quality': int(params.get('quality', 95)), 'padding': float(params.get('padding', 0.0)),
+                'aspect': parse_aspect(str(params['aspect'])) if params.get('aspect') else None,
+                'force': bool(params.get('force'))}, output
+    
+    if kind == 'export-dataset':
+        sorted_folder = params.get('sorted_folder')
+        if not sorted_folder or not os.path.isdir(sorted_folder):
+            raise ValueError(f"sorted folder not found: {sorted_folder}")
+        classes = list(params.get('classes') or DATASET_CLASSES)
+        unknown = [c for c in classes if c not in DATASET_CLASSES]
+        if unknown:
+            raise ValueError(f"unknown classes: {', '.join(unknown)}")
+        output = os.path.abspath(params.get('output') or os.path.join(sorted_folder, 'Dataset'))
+        return {'sorted_folder': os.path.abspath(sorted_folder), 'output': output,
+                'shard_size': int(params.get('shard_size', 1000)),
+                'max_bytes': int(float(params.get('max_shard_mb', 0)) * 1024 * 1024) or None,
+                'classes': classes, 'prefix': str(params.get('prefix', 'shard'))}, output
+    
+    raise ValueError(f"unknown job kind: {kind} (choose from {', '.join(JOB_KINDS)})")
+
+
+def run_job(kind, params, events, cancel, throttle=None, niceness=0):
+    """Body of a job process: ('progress', done, total) messages, then one ('done' | 'failed' | 'cancelled', value).
+    
+    throttle is a shared double: while it is above zero the job sleeps that
+    many times as long as it just worked at every progress report.
+    """
+    ignore_interrupts()
+    if niceness and hasattr(os, 'nice'):
+        os.nice(niceness)
+    worked_since = [time.monotonic()]
+    
+    def progress(done, total):
+        events.put(('progress', done, total))
+        if throttle is not None and throttle.value > 0:
+            time.sleep(min(2.0, (time.monotonic() - worked_since[0]) * throttle.value))
+        worked_since[0] = time.monotonic()
+    
+    try:
+        if kind == 'extract':
+            marker = extract_video_keyframes(params['video_path'], params['settings'],
+                                             on_progress=progress, cancel=cancel)
+            try:
+                ProjectCatalog().record_extraction(marker)
+            except sqlite3.Error:
+                pass  # The keyframes folder is complete either way, 'catalog scan' catches up
+            result = {key: value for key, value in marker.items() if key != 'keyframes'}
+        elif kind == 'export-crops':
+            result = export_crop_recipes(params['crop_folder'], params['output'], params['format'],
+                                         params['size'], params['quality'], params['padding'],
+                                         params['aspect'], None, params['force'], progress)
+        else:
+            index = export_dataset_shards(params['sorted_folder'], params['output'], params['shard_size'],
+                                          params['max_bytes'], tuple(params['classes']), params['prefix'],
+                                          None, progress)
+            result = {'samples': index['samples'], 'shards': len(index['shards']),
+                      'skipped': len(index['skipped'])}
+        events.put(('done', result))
+    except ExtractionCancelled:
+        events.put(('cancelled', None))
+    except Exception as e:
+        events.put(('failed', str(e)))
+
+
+class JobStore:
+    """Jobs of the local job service, saved to a JSON file on every status change.
+    
+    Progress is kept in memory only. Jobs that were running when the service
+    stopped go back to the queue on the next start.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.changed = threading.Condition()
+        self.jobs = OrderedDict()
+        try:
+            with open(path, encoding='utf-8') as f:
+                jobs = json.load(f).get('jobs', [])
+        except (OSError, ValueError):
+            jobs = []
+        for job in jobs:
+            if job['status'] == 'running':
+                job.update(status='queued', progress=None, started=None)
+            self.jobs[job['id']] = job
+    
+    def save(self):
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'jobs': list(self.jobs.values())}, f, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+    
+    def add(self, kind, params, output_folder, priority=0):
+        job = {'id': os.urandom(6).hex(), 'kind': kind, 'params': params, 'output_folder': output_folder,
+               'status': 'queued', 'priority': priority, 'progress': None, 'result': None, 'error': None,
+               'cancel_requested': False, 'created': time.time(), 'started': None, 'finished': None,
+               'version': 1}
+        with self.changed:
+            self.jobs[job['id']] = job
+            self.save()
+            self.changed.notify_all()
+            return dict(job)
+    
+    def reorder(self, job_ids):
+        """Give these jobs this relative order, every other job keeps its place"""
+        with self.changed:
+            wanted = set(job_ids)
+            keys = list(self.jobs)
+            slots = [i for i, job_id in enumerate(keys) if job_id in wanted]
+            for slot, job_id in zip(slots, job_ids):
+                keys[slot] = job_id
+            self.jobs = OrderedDict((job_id, self.jobs[job_id]) for job_id in keys)
+            self.save()
+            self.changed.notify_all()
+    
+    def remove_finished(self):
+        with self.changed:
+            for job_id in [job_id for job_id, job in self.jobs.items() if job['status'] in JOB_FINISHED_STATES]:
+                del self.jobs[job_id]
+            self.save()
+            self.changed.notify_all()
+    
+    def update(self, job_id, persist=True, **fields):
+        with self.changed:
+            job = self.jobs[job_id]
+            job.update(fields)
+            job['version'] += 1
+            if persist:
+                self.save()
+            self.changed.notify_all()
+            return dict(job)
+    
+    def get(self, job_id):
+        with self.changed:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+    
+    def cancel_queued(self, job_id):
+        """Cancel the job if it is still queued, returns the job as it is afterwards (None if unknown)"""
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] == 'queued':
+                # Checked and set under the lock, next_queued cannot start the job in between
+                job.update(status='cancelled', finished=time.time())
+                job['version'] += 1
+                self.save()
+                self.changed.notify_all()
+            return dict(job)
+    
+    def list(self):
+        with self.changed:
+            return [dict(job) for job in self.jobs.values()]
+    
+    def next_queued(self, timeout):
+        """First queued job of the highest priority marked as running, None after timeout seconds without one"""
+        with self.changed:
+            deadline = time.monotonic() + timeout
+            while True:
+                queued = [job for job in self.jobs.values() if job['status'] == 'queued']
+                if queued:
+                    job = max(queued, key=lambda j: j.get('priority', 0))
+                    job.update(status='running', started=time.time())
+                    job['version'] += 1
+                    self.save()
+                    self.changed.notify_all()
+                    return dict(job)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.changed.wait(remaining):
+                    return None
+    
+    def wait_change(self, job_id, version, timeout):
+        """The job once its version is past version, or as it is after timeout seconds"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.jobs[job_id]['version'] > version, timeout)
+            return dict(self.jobs[job_id])
+
+
+class JobService:
+    """Runs queued jobs in separate processes, up to workers at a time.
+    
+    set_throttle(ratio) slows running jobs down (see run_job) and, while
+    above zero, lets no more than one job run so new ones wait.
+    """
+    
+    def __init__(self, state_dir, workers=2, log=print, niceness=0):
+        os.makedirs(state_dir, exist_ok=True)
+        self.store = JobStore(os.path.join(state_dir, 'jobs.json'))
+        self.workers = max(1, workers)
+        self.log = log
+        self.niceness = niceness
+        self.context = multiprocessing.get_context('spawn')  # No fork from a threaded server
+        self.throttle = self.context.Value('d', 0.0, lock=False)
+        self.cancel_events = {}
+        self.processes = {}  # job id -> running job process
+        self.stopping = threading.Event()
+        self.threads = []
+    
+    def start(self):
+        self.set_workers(self.workers)
+    
+    def set_workers(self, workers):
+        """Change how many jobs may run at once, running jobs above the limit finish first"""
+        self.workers = max(1, workers)
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self.worker, args=(len(self.threads),), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+    
+    def set_throttle(self, ratio):
+        self.throttle.value = ratio
+    
+    def stop(self, timeout=None):
+        """Stop the workers, running jobs are killed and re-queued on the next start"""
+        self.stopping.set()
+        for process in list(self.processes.values()):
+            process.terminate()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        # Left over after the timeout, killed so interpreter exit does not wait for them either
+        for process in list(self.processes.values()):
+            if process.is_alive():
+                process.kill()
+    
+    def submit(self, kind, params, priority=0):
+        params, output_folder = prepare_job(kind, params)
+        job = self.store.add(kind, params, output_folder, priority)
+        self.log(f"Queued {kind} job {job['id']}")
+        return job
+    
+    def cancel(self, job_id):
+        """Cancel a queued or running job, returns the job or None if unknown"""
+        job = self.store.cancel_queued(job_id)
+        if job is None or job['status'] in JOB_FINISHED_STATES:
+            return job
+        job = self.store.update(job_id, cancel_requested=True)
+        event = self.cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+        return job
+    
+    def outputs(self, job):
+        """Files in a job's output folder as [{'name', 'size'}]"""
+        try:
+            with os.scandir(job['output_folder']) as entries:
+                files = [{'name': entry.name, 'size': entry.stat().st_size}
+                         for entry in entries if entry.is_file()]
+        except OSError:
+            return []
+        return sorted(files, key=lambda f: natural_sort_key(f['name']))
+    
+    def worker(self, slot):
+        while not self.stopping.is_set():
+            if slot >= (1 if self.throttle.value > 0 else self.workers):
+                self.stopping.wait(0.5)
+                continue
+            job = self.store.next_queued(timeout=1.0)
+            if job:
+                self.run(job)
+    
+    def run(self, job):
+        job_id = job['id']
+        events = self.context.Queue()
+        cancel = self.context.Event()
+        self.cancel_events[job_id] = cancel
+        if self.store.get(job_id)['cancel_requested']:
+            cancel.set()
+        process = self.context.Process(target=run_job, args=(job['kind'], job['params'], events, cancel,
+                                                             self.throttle, self.niceness))
+        if self.stopping.is_set():
+            self.cancel_events.pop(job_id, None)
+            return  # Taken from the queue during stop, re-queued on the next start
+        process.start()
+        self.processes[job_id] = process
+        self.log(f"Started {job['kind']} job {job_id}")
+        
+        outcome = None
+        cancel_seen = None
+        while outcome is None:
+            # Checked before every message, progress arrives faster than the queue timeout
+            if self.stopping.is_set():
+                process.terminate()
+                process.join(5)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+                self.processes.pop(job_id, None)
+                self.cancel_events.pop(job_id, None)
+                return  # Stays 'running' on disk, re-queued on the next start
+            # Exports do not poll the cancel event, stop them the hard way
+            if cancel.is_set():
+                cancel_seen = cancel_seen or time.monotonic()
+                if time.monotonic() - cancel_seen > 5:
+                    process.terminate()
+            try:
+                message = events.get(timeout=0.5)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+                continue
+            if message[0] == 'progress':
+                self.store.update(job_id, persist=False, progress={'done': message[1], 'total': message[2]})
+            else:
+                outcome = message
+        process.join()
+        self.processes.pop(job_id, None)
+        self.cancel_events.pop(job_id, None)
+        
+        if outcome is None:
+            outcome = (('cancelled', None) if cancel.is_set()
+                       else ('failed', f"job process exited with code {process.exitcode}"))
+        status, value = outcome
+        fields = {'status': status, 'finished': time.time()}
+        if status == 'done':
+            fields['result'] = value
+        elif status == 'failed':
+            fields['error'] = value
+        self.store.update(job_id, **fields)
+        self.log(f"{status.capitalize()} {job['kind']} job {job_id}" + (f": {value}" if status == 'failed' else ""))
+
+
+GOVERNOR_IDLE_SECONDS = 3.0  # Sorting or cropping counts as active this long after the last input
+GOVERNOR_THROTTLE = 3.0      # While active, queued extraction sleeps 3x what it works (about 25% duty)
+JOB_PRIORITY_LABELS = {1: '高', 0: '普通', -1: '低'}
+JOB_STATUS_LABELS = {'queued': '排队中', 'running': '提取中', 'done': '已完成',
+                     'failed': '失败', 'cancelled': '已取消'}
+
+
+def default_extraction_queue_dir():
+    """HISTORICAL_SCENE_QUEUE if set, otherwise a folder in the home folder"""
+    return os.environ.get('HISTORICAL_SCENE_QUEUE') or \
+        os.path.join(os.path.expanduser('~'), '.historical_scene_queue')
+
+
+DEFAULT_JOB_SERVICE_DIR = os.path.join(os.path.expanduser('~'), '.historical_scene_jobs')
+JOB_SERVICE_TOKEN_FILENAME = 'token'
+
+
+def job_service_token(state_dir, create=False):
+    """Secret clients of the job service must send, kept in its state folder (None if there is none)"""
+    path = os.path.join(state_dir, JOB_SERVICE_TOKEN_FILENAME)
+    if create and not os.path.exists(path):
+        os.makedirs(state_dir, exist_ok=True)
+        # Readable by this user only, like the job queue next to it
+        fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(os.urandom(24).hex())
+        os.replace(path + '.tmp', path)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def job_request_handler_class():
+    """HTTP handler of the job service, built on demand to keep http.server out of GUI startup"""
+    import hmac
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlsplit, parse_qsl
+    
+    class JobRequestHandler(BaseHTTPRequestHandler):
+        """GET /jobs, POST /jobs, GET /jobs/<id>[?since=<version>&wait=<s>],
+        GET /jobs/<id>/events (SSE), GET /jobs/<id>/outputs, POST /jobs/<id>/cancel
+        
+        Every request needs Authorization: Bearer <token> (see job_service_token)
+        and a loopback Host header, which a DNS-rebound page cannot send."""
+        
+        server_version = 'HistoricalSceneJobs/1.0'
+        
+        def log_message(self, format, *args):
+            pass
+        
+        def send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def authorised(self):
+            """Check Host and token, answering the request if either is wrong"""
+            port = self.server.server_address[1]
+            if self.headers.get('Host', '') not in (f'127.0.0.1:{port}', f'localhost:{port}'):
+                self.send_json(403, {'error': 'Host must be 127.0.0.1 or localhost with the port'})
+                return False
+            expected = f"Bearer {self.server.token}".encode('utf-8')
+            if not hmac.compare_digest(self.headers.get('Authorization', '').encode('utf-8'), expected):
+                self.send_json(401, {'error': 'missing or wrong token'})
+                return False
+            return True
+        
+        def route(self):
+            """(job id, action, query) for /jobs[/<id>[/<action>]], None for other paths"""
+            url = urlsplit(self.path)
+            parts = [part for part in url.path.split('/') if part]
+            if not parts or parts[0] != 'jobs' or len(parts) > 3:
+                return None
+            parts += [None] * (3 - len(parts))
+            return parts[1], parts[2], dict(parse_qsl(url.query))
+        
+        def do_GET(self):
+            if not self.authorised():
+                return
+            store = self.server.service.store
+            route = self.route()
+            if route is None:
+                return self.send_json(404, {'error': 'not found'})
+            job_id, action, query = route
+            if job_id is None:
+                return self.send_json(200, {'jobs': store.list()})
+            job = store.get(job_id)
+            if job is None:
+                return self.send_json(404, {'error': f"no job {job_id}"})
+            if action is None:
+                if 'since' in query:
+                    try:
+                        since, wait_seconds = int(query['since']), float(query.get('wait', 30))
+                    except ValueError:
+                        return self.send_json(400, {'error': "since and wait must be numbers"})
+                    job = store.wait_change(job_id, since, min(max(wait_seconds, 0), 120))
+                return self.send_json(200, job)
+            if action == 'outputs':
+                return self.send_json(200, {'output_folder': job['output_folder'],
+                                            'files': self.server.service.outputs(job)})
+            if action == 'events':
+                return self.stream_events(job)
+            return self.send_json(404, {'error': 'not found'})
+        
+        def do_POST(self):
+            if not self.authorised():
+                return
+            service = self.server.service
+            route = self.route()
+            if route is None or route[1] not in (None, 'cancel') or (route[0] is None) != (route[1] is None):
+                return self.send_json(404, {'error': 'not found'})
+            # Browsers cannot send JSON cross-origin without a preflight we never answer
+            if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+                return self.send_json(415, {'error': "Content-Type must be application/json"})
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > 1024 * 1024:
+                return self.send_json(413, {'error': 'request too large'})
+            try:
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                return self.send_json(400, {'error': 'invalid JSON'})
+            
+            job_id, action, _ = route
+            if action == 'cancel':
+                job = service.cancel(job_id)
+                if job is None:
+                    return self.send_json(404, {'error': f"no job {job_id}"})
+                return self.send_json(200, job)
+            try:
+                job = service.submit(payload.get('kind'), payload.get('params'))
+            except ValueError as e:
+                return self.send_json(400, {'error': str(e)})
+            return self.send_json(201, job)
+        
+        def stream_events(self, job):
+            """Server-sent events, one 'job' event per change until the job finishes"""
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.close_connection = True
+            store = self.server.service.store
+            try:
+                self.wfile.write(f"event: job\ndata: {json.dumps(job, ensure_ascii=False)}\n\n".encode('utf-8'))
+                while job['status'] not in JOB_FINISHED_STATES:
+                    version = job['version']
+                    job = store.wait_change(job['id'], version, 15)
+                    if job['version'] == version:
+                        self.wfile.write(b": keepalive\n\n")
+                    else:
+                        self.wfile.write(f"event: job\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+                                         .encode('utf-8'))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+    
+    return JobRequestHandler
+
+
+# Handlers timed by UITracer, wrapped on the app instance so Tk callbacks bound later pick them up
+TRACED_APP_METHODS = (
+    'on_global_key_press', 'next_sort_image', 'previous_sort_image', 'select_sort_image',
+    'display_sort_image', 'save_sorted_image', 'skip_sort_image', 'undo_sort_action',
+    'redo_sort_action', 'add_thumbnails', 'update_sort_progress', 'scan_sorted_folder',
+    'display_crop_image', 'render_crop_view', 'on_crop_canvas_resize', 'next_crop_image',
+    'prev_crop_image', 'accept_crop_proposals', 'save_crop',
+)
+# File and decode helpers the handlers call, none of them is ever pickled for a process pool
+TRACED_MODULE_FUNCTIONS = (
+    'list_keyframe_names', 'open_keyframe_image', 'open_keyframe_thumbnail',
+    'materialise_file', 'copy_file_atomic',
+)
+
+
+class UITracer:
+    """Opt-in spans around GUI handlers and a Tk heartbeat that records event-loop stalls
+    
+    Spans go into a ring buffer. While the loop is stuck a watchdog thread
+    samples the main thread's stack, and when the heartbeat runs again the
+    stall is stored with that stack and the slowest spans that overlapped it.
+    """
+    
+    def __init__(self, root, stall_ms=100, interval_ms=50, max_spans=20000, max_stalls=200):
+        self.root = root
+        self.stall_ms = stall_ms
+        self.interval_ms = interval_ms
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.main_thread = threading.main_thread().ident
+        self.thread_names = {}
+        self.spans = deque(maxlen=max_spans)    # (name, start, duration, thread ident)
+        self.stalls = deque(maxlen=max_stalls)  # dicts, see beat()
+        self.lags = deque(maxlen=2000)          # Heartbeat lag in seconds
+        self.next_due = None
+        self.sampled_stack = None
+        self.generation = 0
+    
+    def instrument(self, owner, names):
+        """Replace owner.<name> with a timed wrapper, owner is an instance or a module dict"""
+        is_dict = isinstance(owner, dict)
+        for name in names:
+            original = owner[name] if is_dict else getattr(owner, name)
+            # Module functions stay wrapped after an earlier app, rewrap them for this tracer
+            original = getattr(original, '__wrapped__', original)
+            
+            def timed(*args, _original=original, _name=name, **kwargs):
+                if not self.enabled:
+                    return _original(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return _original(*args, **kwargs)
+                finally:
+                    self.add_span(_name, start, time.perf_counter() - start)
+            
+            timed.__wrapped__ = original
+            timed.__name__ = name
+            if is_dict:
+                owner[name] = timed
+            else:
+                setattr(owner, name, timed)
+    
+    def add_span(self, name, start, duration):
+        ident = threading.get_ident()
+        if ident not in self.thread_names:
+            self.thread_names[ident] = threading.current_thread().name
+        self.spans.append((name, start, duration, ident))
+    
+    def start(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.generation += 1
+        self.sampled_stack = None
+        self.next_due = time.perf_counter() + self.interval_ms / 1000
+        self.root.after(self.interval_ms, self.beat, self.generation)
+        threading.Thread(target=self.watchdog, args=(self.generation,), daemon=True,
+                         name='ui-trace-watchdog').start()
+    
+    def stop(self):
+        self.enabled = False
+        self.generation += 1
+    
+    def clear(self):
+        self.spans.clear()
+        self.stalls.clear()
+        self.lags.clear()
+    
+    def beat(self, generation):
+        """Heartbeat on the Tk loop, lag is how late it ran"""
+        if generation != self.generation:
+            return
+        now = time.perf_counter()
+        due = self.next_due
+        lag = now - due
+        self.lags.append(lag)
+        if lag * 1000 >= self.stall_ms:
+            overlapping = []
+            for span in reversed(self.spans):
+                if span[1] + span[2] < due:
+                    break
+                overlapping.append(span)
+            overlapping.sort(key=lambda s: -s[2])
+            self.stalls.append({'start': due, 'lag': lag, 'spans': overlapping[:8],
+                                'stack': self.sampled_stack})
+        self.sampled_stack = None
+        self.next_due = now + self.interval_ms / 1000
+        self.root.after(self.interval_ms, self.beat, generation)
+    
+    def watchdog(self, generation):
+        """Sample the main thread's stack once per stall, while it is still stuck"""
+        while generation == self.generation:
+            time.sleep(min(self.interval_ms, self.stall_ms) / 2000)
+            due = self.next_due
+            if self.sampled_stack is None and (time.perf_counter() - due) * 1000 >= self.stall_ms:
+                frame = sys._current_frames().get(self.main_thread)
+                if frame is not None and due == self.next_due:
+                    self.sampled_stack = ''.join(traceback.format_stack(frame))
+                del frame
+    
+    def span_stats(self):
+        """name -> {'count', 'p50', 'p95', 'max', 'total'} in ms over the ring buffer"""
+        by_name = {}
+        for name, _, duration, _ in list(self.spans):
+            by_name.setdefault(name, []).append(duration * 1000)
+        stats = {}
+        for name, durations in by_name.items():
+            durations.sort()
+            n = len(durations)
+            stats[name] = {'count': n, 'p50': durations[n // 2],
+                           'p95': durations[min(n - 1, int(n * 0.95))],
+                           'max': durations[-1], 'total': sum(durations)}
+        return stats
+    
+    def lag_stats(self):
+        """(p95, max) heartbeat lag in ms, None without beats"""
+        lags = sorted(lag * 1000 for lag in list(self.lags))
+        if not lags:
+            return None
+        return lags[min(len(lags) - 1, int(len(lags) * 0.95))], lags[-1]
+    
+    def chrome_trace(self):
+        """Spans and stalls in Chrome trace event format (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        us = lambda seconds: round((seconds - self.origin) * 1e6, 1)
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'historical-scene'}},
+                  {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                   'args': {'name': 'event loop stalls'}}]
+        for ident, name in list(self.thread_names.items()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': ident,
+                           'args': {'name': 'Tk main' if ident == self.main_thread else name}})
+        for name, start, duration, ident in list(self.spans):
+            events.append({'name': name, 'cat': 'handler', 'ph': 'X', 'pid': pid, 'tid': ident,
+                           'ts': us(start), 'dur': round(duration * 1e6, 1)})
+        for stall in list(self.stalls):
+            events.append({'name': f"stall {stall['lag'] * 1000:.0f} ms", 'cat': 'stall', 'ph': 'X',
+                           'pid': pid, 'tid': 0, 'ts': us(stall['start']),
+                           'dur': round(stall['lag'] * 1e6, 1),
+                           'args': {'slowest': [f"{s[0]} {s[2] * 1000:.1f} ms" for s in stall['spans']],
+                                    'stack': stall['stack'] or ''}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    
+    def export(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+        os.replace(tmp, path)
 
 
 class HistoricalSceneApp:
@@ -42,6 +4088,20 @@ class HistoricalSceneApp:
             'extraction_stats': None
         }
         
+        # Every project ever opened, see ProjectCatalog
+        self.catalog = ProjectCatalog()
+        self.catalog_window = None
+        self.catalog_writes = queue.Queue()
+        self.catalog_writer = None  # Started by the first catalog_write
+        
+        # Handler timing and stall monitor, off unless HISTORICAL_SCENE_TRACE is set or F12 turns it on
+        self.tracer = UITracer(root)
+        self.tracer.instrument(self, TRACED_APP_METHODS)
+        self.tracer.instrument(globals(), TRACED_MODULE_FUNCTIONS)
+        self.trace_window = None
+        
+        mark_startup('window setup')
+        
         # Style configuration
         style = ttk.Style()
         style.theme_use('default')
@@ -65,25 +4125,94 @@ class HistoricalSceneApp:
         self.notebook.add(self.sort_frame, text="步骤2: 分类图像")
         self.notebook.add(self.crop_frame, text="步骤3: 裁剪人物")
         
-        # Initialize each module
-        self.setup_extractor()
-        self.setup_sorter()
-        self.setup_cropper()
+        mark_startup('status bar and notebook')
+        
+        # Each module is built the first time its tab is shown
+        self.tab_builders = [self.setup_extractor, self.setup_sorter, self.setup_cropper]
+        self.tabs_built = set()
+        self.ensure_tab(0)
+        self.notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
         
         # Use YOUR original extraction settings
-        self.extraction_settings = {
-            'scene_threshold': 0.1,      # Your original setting
-            'min_frames_between': 3,      # Your original: only 3 frames
-            'black_threshold': 15,
-            'black_ratio': 0.90,
-            'max_keyframes_per_minute': 180,  # Your original: 180 not 30!
-            'jpeg_quality': 95
+        self.extraction_settings = dict(DEFAULT_EXTRACTION_SETTINGS)
+        
+        # Sorter settings
+        self.sort_settings = {
+            'reconcile_interval_ms': 30000,  # Background recount of output folders, 0 disables
+            'materialise_strategy': 'auto',   # See SORT_STRATEGY_LABELS
+            'autoclass_max_side': 512,        # Detection resolution for pre-classification
+            'autoclass_human_threshold': 0.5,       # Score at or above: pre-labelled human
+            'autoclass_background_threshold': 0.15,  # Score below: pre-labelled background
+            'cluster_hist_threshold': 0.25,  # Max colour histogram distance within a group
+            'cluster_hash_threshold': 14     # Max differing dHash bits within a group
         }
         
         # Bind global keyboard shortcuts
         self.root.bind('<Key>', self.on_global_key_press)
+        self.root.bind('<F12>', lambda e: self.open_trace_window())
         self.root.focus_set()
         
+        # HISTORICAL_SCENE_TRACE=1 traces from startup, a .json path also writes the trace on close
+        trace_setting = os.environ.get('HISTORICAL_SCENE_TRACE', '')
+        if trace_setting not in ('', '0'):
+            self.tracer.start()
+        
+        # Let queued sort file operations finish before the window closes
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        # Import OpenCV/NumPy/PIL in the background once the window is up
+        self.root.after(200, lambda: threading.Thread(target=preload_heavy_modules, daemon=True).start())
+        mark_startup('settings and bindings')
+    
+    def ensure_tab(self, index):
+        """Build a tab's widgets if they do not exist yet"""
+        if index in self.tabs_built:
+            return
+        self.tabs_built.add(index)
+        self.tab_builders[index]()
+        mark_startup(f'build tab {index + 1}')
+    
+    def on_tab_changed(self, event=None):
+        """Build a tab on its first visit"""
+        self.ensure_tab(self.notebook.index('current'))
+    
+    def on_close(self):
+        """Flush background work and close the application"""
+        if 1 in self.tabs_built:
+            if self.sort_indexer:
+                self.sort_indexer.stop()
+            self.clear_thumbnails()
+            self.gallery_loader.shutdown(wait=False)
+            self.stop_autoclassify()
+            self.stop_clustering()
+        if 2 in self.tabs_built:
+            if self.crop_indexer:
+                self.crop_indexer.stop()
+            self.stop_crop_proposals()
+            self.save_crop_proposals()
+            self.crop_writer.shutdown(wait=True)
+        if 1 in self.tabs_built:
+            if self.sort_session:
+                self.save_sort_cursor()
+                self.sort_session.close()
+            if self.sort_file_queue:
+                # Anything still unfinished after the timeout is replayed from the journal
+                self.sort_file_queue.close(timeout=10)
+        if self.catalog_writer:
+            # The catalog is rebuilt from the folders, so a slow database is not waited on for long
+            self.catalog_writes.put(None)
+            self.catalog_writer.join(timeout=2)
+        # Running extractions are killed and start over next time, closing waits at most a second for that
+        self.extract_queue.stop(timeout=1)
+        trace_setting = os.environ.get('HISTORICAL_SCENE_TRACE', '')
+        if trace_setting.lower().endswith('.json'):
+            try:
+                self.tracer.export(trace_setting)
+            except OSError as e:
+                print(f"Error writing trace: {e}")
+        self.tracer.stop()
+        self.root.destroy()
+        
     def create_status_bar(self):
         """Create workflow status bar at top"""
         status_frame = tk.Frame(self.root, bg='#2d2d2d', height=50, relief='solid', bd=1)
@@ -106,6 +4235,11 @@ class HistoricalSceneApp:
                                font=('Microsoft YaHei', 10))
             indicator.pack(side='left', padx=15, pady=10)
             self.step_indicators.append(indicator)
+        
+        tk.Button(status_frame, text="项目库", bg='#404040', fg='white', padx=15,
+                  command=self.open_catalog_window).pack(side='right', padx=10, pady=8)
+        tk.Button(status_frame, text="卡顿监视", bg='#404040', fg='white', padx=15,
+                  command=self.open_trace_window).pack(side='right', pady=8)
     
     def update_workflow_status(self, step_completed=None):
         """Update the workflow status display"""
@@ -119,6 +4253,224 @@ class HistoricalSceneApp:
         elif step_completed == 3:
             self.step_indicators[2].config(text="✓ 裁剪完成", fg='#4CAF50')
     
+    def catalog_update(self, method, *args, **kwargs):
+        """Call a catalog method, a failing catalog never interrupts the workflow"""
+        try:
+            return method(*args, **kwargs)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Error updating catalog: {e}")
+    
+    def catalog_write(self, method, *args, **kwargs):
+        """Queue a catalog update for the writer thread, updates apply in order and never wait on the UI"""
+        if self.catalog_writer is None:
+            self.catalog_writer = threading.Thread(target=self.run_catalog_writer, daemon=True)
+            self.catalog_writer.start()
+        self.catalog_writes.put((method, args, kwargs))
+    
+    def run_catalog_writer(self):
+        while True:
+            task = self.catalog_writes.get()
+            if task is None:
+                break
+            method, args, kwargs = task
+            self.catalog_update(method, *args, **kwargs)
+    
+    def sync_sort_catalog(self):
+        """Index the sorted folder's keyframes and resumed labels in the catalog, off the UI thread"""
+        labels = {}
+        for items in self.sort_undo_stack:
+            for item in items:
+                labels[item['filename']] = item['save_type']
+        names = [os.path.basename(path) for path in self.sort_images]
+        folder = self.sort_folder_path
+        self.catalog_write(self.catalog.index_names, folder, names,
+                           sorted_folder=self.current_workflow['sorted_folder'])
+        self.catalog_write(self.catalog.set_labels, folder, labels, replace_all=True)
+    
+    def catalog_sort_items(self, items, applied):
+        """Mirror an applied or reverted sort action in the catalog"""
+        labels = {}
+        for item in items:
+            if applied:
+                labels[item['filename']] = item['save_type']
+            else:
+                labels[item['filename']] = item['replaces']['save_type'] if item.get('replaces') else None
+        self.catalog_write(self.catalog.set_labels, self.sort_folder_path, labels)
+    
+    def open_catalog_window(self):
+        """List catalogued projects, double-click reopens one"""
+        projects = self.catalog_update(self.catalog.projects)
+        if projects is None:
+            messagebox.showerror("错误", "无法打开项目库")
+            return
+        if self.catalog_window is not None and self.catalog_window.winfo_exists():
+            self.catalog_window.destroy()
+        
+        win = self.catalog_window = tk.Toplevel(self.root)
+        win.title(f"项目库 ({len(projects)} 个项目)")
+        win.configure(bg='#1a1a1a')
+        win.geometry("900x500")
+        
+        columns = ('video', 'keyframes', 'labelled', 'human', 'crops', 'updated')
+        tree = ttk.Treeview(win, columns=columns, show='headings', selectmode='browse')
+        for column, heading, width in zip(columns, ("视频", "关键帧", "已分类", "人物", "裁剪", "更新时间"),
+                                          (280, 90, 90, 90, 90, 160)):
+            tree.heading(column, text=heading)
+            tree.column(column, width=width, anchor='w' if column == 'video' else 'e')
+        for project in projects:
+            tree.insert('', 'end', iid=str(project['id']), values=(
+                project['video_name'], project['keyframes'], project['labelled'], project['human'],
+                project['crops'], time.strftime('%Y-%m-%d %H:%M', time.localtime(project['updated'] or 0))))
+        tree.pack(fill='both', expand=True, padx=10, pady=10)
+        
+        by_id = {str(project['id']): project for project in projects}
+        tree.bind('<Double-1>', lambda e: tree.selection() and self.open_catalog_project(by_id[tree.selection()[0]]))
+        tk.Label(win, text="双击打开项目，继续分类", bg='#1a1a1a', fg='#888',
+                 font=('Microsoft YaHei', 9)).pack(pady=(0, 8))
+    
+    def open_trace_window(self):
+        """Stall monitor panel: stalls with their slowest spans and stack, per-handler timings"""
+        if self.trace_window is not None and self.trace_window.winfo_exists():
+            self.trace_window.lift()
+            return
+        tracer = self.tracer
+        win = self.trace_window = tk.Toplevel(self.root)
+        win.title("卡顿监视")
+        win.configure(bg='#1a1a1a')
+        win.geometry("1000x700")
+        
+        controls = tk.Frame(win, bg='#1a1a1a')
+        controls.pack(fill='x', padx=10, pady=(10, 5))
+        enabled_var = tk.BooleanVar(value=tracer.enabled)
+        tk.Checkbutton(controls, text="启用监视", variable=enabled_var, bg='#1a1a1a', fg='white',
+                       selectcolor='#2d2d2d', activebackground='#1a1a1a',
+                       command=lambda: tracer.start() if enabled_var.get() else tracer.stop()
+                       ).pack(side='left')
+        tk.Label(controls, text="卡顿阈值 (ms):", bg='#1a1a1a', fg='white').pack(side='left', padx=(20, 5))
+        stall_var = tk.IntVar(value=tracer.stall_ms)
+        tk.Spinbox(controls, from_=20, to=2000, increment=10, width=6,
+                   textvariable=stall_var).pack(side='left')
+        
+        def set_stall_ms(*_):
+            try:
+                tracer.stall_ms = max(10, stall_var.get())
+            except tk.TclError:
+                pass  # Half-typed value
+        
+        stall_var.trace_add('write', set_stall_ms)
+        summary_var = tk.StringVar()
+        tk.Label(controls, textvariable=summary_var, bg='#1a1a1a', fg='#888').pack(side='left', padx=20)
+        tk.Button(controls, text="导出 Chrome Trace", bg='#2196F3', fg='white',
+                  command=self.export_trace).pack(side='right')
+        tk.Button(controls, text="清空", bg='#404040', fg='white',
+                  command=lambda: (tracer.clear(), refresh())).pack(side='right', padx=5)
+        
+        panes = tk.PanedWindow(win, orient='vertical', bg='#1a1a1a', sashwidth=4)
+        panes.pack(fill='both', expand=True, padx=10, pady=(0, 10))
+        
+        top = tk.Frame(panes, bg='#1a1a1a')
+        stall_tree = ttk.Treeview(top, columns=('time', 'lag', 'slowest'), show='headings',
+                                  selectmode='browse', height=8)
+        for column, heading, width in (('time', "时间 (s)", 90), ('lag', "卡顿 (ms)", 90),
+                                       ('slowest', "最慢的调用", 300)):
+            stall_tree.heading(column, text=heading)
+            stall_tree.column(column, width=width, anchor='w' if column == 'slowest' else 'e')
+        stall_tree.pack(side='left', fill='both', expand=True)
+        detail = tk.Text(top, bg='#2d2d2d', fg='#e0e0e0', font=('Consolas', 9), wrap='none', width=60)
+        detail.pack(side='left', fill='both', expand=True, padx=(5, 0))
+        panes.add(top, height=380)
+        
+        columns = ('name', 'count', 'p50', 'p95', 'max', 'total')
+        stats_tree = ttk.Treeview(panes, columns=columns, show='headings', height=10)
+        for column, heading, width in zip(columns, ("调用", "次数", "p50 (ms)", "p95 (ms)", "最大 (ms)", "合计 (ms)"),
+                                          (260, 70, 90, 90, 90, 100)):
+            stats_tree.heading(column, text=heading)
+            stats_tree.column(column, width=width, anchor='w' if column == 'name' else 'e')
+        panes.add(stats_tree)
+        
+        stalls = []
+        
+        def show_stall(event=None):
+            selection = stall_tree.selection()
+            if not selection:
+                return
+            stall = stalls[int(selection[0])]
+            lines = [f"卡顿 {stall['lag'] * 1000:.0f} ms, 开始于 {stall['start'] - tracer.origin:.3f} s", "",
+                     "最慢的调用:"]
+            lines += [f"  {name:<28} {duration * 1000:8.1f} ms  ({tracer.thread_names.get(ident, ident)})"
+                      for name, _, duration, ident in stall['spans']] or ["  (无记录)"]
+            lines += ["", "主线程堆栈:", stall['stack'] or "  (卡顿太短，未采样)"]
+            detail.delete('1.0', 'end')
+            detail.insert('1.0', '\n'.join(lines))
+        
+        def refresh():
+            if not win.winfo_exists():
+                return
+            lag = tracer.lag_stats()
+            summary_var.set(f"卡顿 {len(tracer.stalls)} 次" +
+                            (f"   心跳延迟 p95 {lag[0]:.1f} ms, 最大 {lag[1]:.0f} ms" if lag else ""))
+            if len(stalls) != len(tracer.stalls) or (stalls and stalls[-1] is not tracer.stalls[-1]):
+                stalls[:] = list(tracer.stalls)
+                stall_tree.delete(*stall_tree.get_children())
+                for i, stall in enumerate(stalls):
+                    slowest = f"{stall['spans'][0][0]} {stall['spans'][0][2] * 1000:.0f} ms" if stall['spans'] else ""
+                    stall_tree.insert('', 0, iid=str(i), values=(
+                        f"{stall['start'] - tracer.origin:.1f}", f"{stall['lag'] * 1000:.0f}", slowest))
+            stats_tree.delete(*stats_tree.get_children())
+            for name, s in sorted(tracer.span_stats().items(), key=lambda item: -item[1]['max']):
+                stats_tree.insert('', 'end', values=(name, s['count'], f"{s['p50']:.1f}", f"{s['p95']:.1f}",
+                                                     f"{s['max']:.1f}", f"{s['total']:.0f}"))
+            win.after(1000, refresh)
+        
+        stall_tree.bind('<<TreeviewSelect>>', show_stall)
+        refresh()
+    
+    def export_trace(self):
+        """Save the recorded spans and stalls as Chrome trace JSON"""
+        if not self.tracer.spans and not self.tracer.stalls:
+            messagebox.showinfo("提示", "还没有记录，请先启用监视")
+            return
+        path = filedialog.asksaveasfilename(title="导出 Chrome Trace", defaultextension='.json',
+                                            initialfile=f"trace_{time.strftime('%Y%m%d_%H%M%S')}.json",
+                                            filetypes=[("JSON", "*.json")])
+        if not path:
+            return
+        try:
+            self.tracer.export(path)
+            messagebox.showinfo("完成", f"已导出 {len(self.tracer.spans)} 个调用和 {len(self.tracer.stalls)} 次卡顿\n"
+                                        f"在 chrome://tracing 或 ui.perfetto.dev 中打开")
+        except OSError as e:
+            messagebox.showerror("错误", f"导出失败: {str(e)}")
+    
+    def open_catalog_project(self, project):
+        """Make a catalogued project current and continue sorting it"""
+        if not os.path.isdir(project['keyframes_folder']):
+            messagebox.showerror("错误", f"关键帧文件夹不存在: {project['keyframes_folder']}")
+            return
+        if self.catalog_window is not None:
+            self.catalog_window.destroy()
+            self.catalog_window = None
+        
+        sorted_folder = project['sorted_folder']
+        self.current_workflow.update({
+            'video_path': project['video_path'],
+            'video_name': project['video_name'],
+            'keyframes_folder': project['keyframes_folder'],
+            'sorted_folder': sorted_folder,
+            'background_folder': os.path.join(sorted_folder, 'Background') if sorted_folder else None,
+            'human_folder': os.path.join(sorted_folder, 'Human') if sorted_folder else None,
+            'cropped_folder': project['cropped_folder'],
+            'extraction_stats': {'keyframes_detected': project['keyframes'],
+                                 'total_frames': project['total_frames'],
+                                 'duration_minutes': project['duration_minutes']}
+        })
+        self.update_workflow_status(step_completed=1)
+        if project['labelled']:
+            self.update_workflow_status(step_completed=2)
+        if project['crops']:
+            self.update_workflow_status(step_completed=3)
+        self.continue_to_sorting()
+    
     def setup_extractor(self):
         """Setup keyframe extraction interface"""
         main_frame = tk.Frame(self.extract_frame, bg='#1a1a1a')
@@ -167,6 +4519,18 @@ class HistoricalSceneApp:
                                   bg='#2d2d2d', fg='#888', font=('Microsoft YaHei', 9))
         threshold_label.grid(row=0, column=2, padx=10)
         
+        tk.Label(settings_frame, text="关键帧存储:",
+                bg='#2d2d2d', fg='white').grid(row=1, column=0, sticky='w', padx=10, pady=(0, 10))
+        
+        self.keyframe_storage_var = tk.StringVar(value=KEYFRAME_STORAGE_LABELS['files'])
+        storage_menu = tk.OptionMenu(settings_frame, self.keyframe_storage_var,
+                                     *KEYFRAME_STORAGE_LABELS.values())
+        storage_menu.config(bg='#404040', fg='white', highlightthickness=0)
+        storage_menu.grid(row=1, column=1, sticky='w', padx=10, pady=(0, 10))
+        
+        tk.Label(settings_frame, text="(打包=单个数据文件, 引用=只记录帧位置，分类时才写入图像)",
+                bg='#2d2d2d', fg='#888', font=('Microsoft YaHei', 9)).grid(row=1, column=2, padx=10, pady=(0, 10))
+        
         # Progress bar
         self.extract_progress = ttk.Progressbar(main_frame, length=600, mode='determinate')
         self.extract_progress.pack(pady=20)
@@ -195,10 +4559,73 @@ class HistoricalSceneApp:
         self.continue_sort_btn.pack(side='left', padx=10)
         
         # Results display
-        self.results_text = tk.Text(main_frame, height=8, width=80,
+        self.results_text = tk.Text(main_frame, height=5, width=80,
                                    bg='#2d2d2d', fg='white',
                                    font=('Consolas', 9))
         self.results_text.pack(pady=10)
+        
+        self.setup_extraction_queue(main_frame)
+    
+    def setup_extraction_queue(self, parent):
+        """Queue panel: many videos extracted in background processes, throttled while the user sorts or crops"""
+        queue_frame = tk.LabelFrame(parent, text="提取队列",
+                                    font=('Microsoft YaHei', 11, 'bold'),
+                                    bg='#2d2d2d', fg='white', relief='solid', bd=1)
+        queue_frame.pack(fill='both', expand=True)
+        
+        columns = ('video', 'priority', 'status', 'progress', 'keyframes')
+        self.queue_tree = ttk.Treeview(queue_frame, columns=columns, show='headings',
+                                       selectmode='browse', height=6)
+        for column, heading, width in zip(columns, ("视频", "优先级", "状态", "进度", "关键帧"),
+                                          (380, 70, 160, 70, 70)):
+            self.queue_tree.heading(column, text=heading)
+            self.queue_tree.column(column, width=width, anchor='w' if column in ('video', 'status') else 'e')
+        self.queue_tree.pack(side='left', fill='both', expand=True, padx=(10, 5), pady=10)
+        self.queue_tree.bind('<Double-1>', lambda e: self.open_queued_result())
+        
+        controls = tk.Frame(queue_frame, bg='#2d2d2d')
+        controls.pack(side='right', fill='y', padx=(5, 10), pady=10)
+        for text, command in (("添加视频", self.add_videos_to_queue),
+                              ("上移", lambda: self.move_queued_job(-1)),
+                              ("下移", lambda: self.move_queued_job(1)),
+                              ("优先级", self.cycle_queued_priority),
+                              ("取消", self.cancel_queued_job),
+                              ("清除已完成", self.clear_finished_jobs)):
+            tk.Button(controls, text=text, bg='#404040', fg='white', width=10,
+                      command=command).pack(pady=1)
+        
+        workers_row = tk.Frame(controls, bg='#2d2d2d')
+        workers_row.pack(pady=(6, 0))
+        tk.Label(workers_row, text="并发:", bg='#2d2d2d', fg='white').pack(side='left')
+        workers = max(1, (os.cpu_count() or 2) // 2)
+        self.queue_workers_var = tk.IntVar(value=workers)
+        tk.Spinbox(workers_row, from_=1, to=os.cpu_count() or 4, width=3,
+                   textvariable=self.queue_workers_var).pack(side='left')
+        
+        def set_workers(*_):
+            try:
+                self.extract_queue.set_workers(self.queue_workers_var.get())
+            except tk.TclError:
+                pass  # Half-typed value
+        
+        self.queue_workers_var.trace_add('write', set_workers)
+        
+        self.governor_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(controls, text="分类/裁剪时降速", variable=self.governor_var,
+                       bg='#2d2d2d', fg='white', selectcolor='#1a1a1a',
+                       activebackground='#2d2d2d').pack(pady=(4, 0))
+        self.governor_label = tk.Label(controls, text="", bg='#2d2d2d', fg='#FFC107',
+                                       font=('Microsoft YaHei', 9))
+        self.governor_label.pack()
+        
+        # Started by main(), so apps built for profiling or benchmarks never resume the user's jobs
+        self.extract_queue = JobService(default_extraction_queue_dir(), workers, log=print, niceness=10)
+        self.extract_job_id = None  # The job started with 开始提取, it becomes the current project
+        self.queue_view_key = None
+        self.last_user_activity = 0.0
+        for sequence in ('<KeyPress>', '<ButtonPress>', '<B1-Motion>', '<MouseWheel>'):
+            self.root.bind_all(sequence, self.note_user_activity, add='+')
+        self.root.after(500, self.tick_extraction_queue)
     
     def setup_sorter(self):
         """Setup image sorting interface with thumbnail gallery"""
@@ -220,7 +4647,7 @@ class HistoricalSceneApp:
                                       font=('Microsoft YaHei', 11, 'bold'),
                                       bg='#2196F3', fg='black', padx=20, pady=10,
                                       command=self.load_current_project_for_sorting,
-                                      state='disabled')
+                                      state='normal' if self.current_workflow['extraction_stats'] else 'disabled')
         self.auto_load_btn.pack(side='left', padx=10)
 
         self.continue_crop_btn = tk.Button(top_frame, text="继续到裁剪 →",
@@ -230,11 +4657,37 @@ class HistoricalSceneApp:
                                         state='disabled')
         self.continue_crop_btn.pack(side='left', padx=10)
         
+        self.autoclass_btn = tk.Button(top_frame, text="自动预分类",
+                                      font=('Microsoft YaHei', 11, 'bold'),
+                                      bg='#9C27B0', fg='black', padx=15, pady=10,
+                                      command=self.toggle_autoclassify,
+                                      state='disabled')
+        self.autoclass_btn.pack(side='left', padx=10)
+        
+        self.confirm_predictions_btn = tk.Button(top_frame, text="确认预标注",
+                                                font=('Microsoft YaHei', 11, 'bold'),
+                                                bg='#607D8B', fg='black', padx=15, pady=10,
+                                                command=self.confirm_predictions,
+                                                state='disabled')
+        self.confirm_predictions_btn.pack(side='left', padx=10)
+        
+        self.cluster_btn = tk.Button(top_frame, text="相似分组",
+                                    font=('Microsoft YaHei', 11, 'bold'),
+                                    bg='#009688', fg='black', padx=15, pady=10,
+                                    command=self.toggle_clustering,
+                                    state='disabled')
+        self.cluster_btn.pack(side='left', padx=10)
+        
         self.sort_progress_label = tk.Label(top_frame, text="请选择包含关键帧的文件夹",
                                            bg='#1a1a1a', fg='#e0e0e0',
                                            font=('Microsoft YaHei', 11))
         self.sort_progress_label.pack(side='right')
         
+        self.sort_pending_label = tk.Label(top_frame, text="",
+                                          bg='#1a1a1a', fg='#FFC107',
+                                          font=('Microsoft YaHei', 10))
+        self.sort_pending_label.pack(side='right', padx=15)
+        
         # Main content area
         content_frame = tk.Frame(main_container, bg='#1a1a1a')
         content_frame.pack(fill='both', expand=True, padx=15)
@@ -323,6 +4776,22 @@ class HistoricalSceneApp:
                            command=lambda: self.save_sorted_image('both'))
         both_btn.pack(fill='x', pady=8)
         
+        # Materialisation strategy
+        strategy_frame = tk.Frame(actions_frame, bg='#2d2d2d')
+        strategy_frame.pack(fill='x', pady=(8,0))
+        
+        tk.Label(strategy_frame, text="保存方式:",
+                bg='#2d2d2d', fg='white',
+                font=('Microsoft YaHei', 10)).pack(side='left')
+        
+        self.sort_strategy_var = tk.StringVar(value=SORT_STRATEGY_LABELS['auto'])
+        strategy_menu = tk.OptionMenu(strategy_frame, self.sort_strategy_var,
+                                      *SORT_STRATEGY_LABELS.values(),
+                                      command=self.sort_strategy_changed)
+        strategy_menu.config(bg='#404040', fg='black', highlightthickness=0,
+                             font=('Microsoft YaHei', 10))
+        strategy_menu.pack(side='right', fill='x', expand=True, padx=(5,0))
+        
         # Separator
         separator = tk.Frame(actions_frame, height=2, bg='#404040')
         separator.pack(fill='x', pady=(20,15))
@@ -335,6 +4804,13 @@ class HistoricalSceneApp:
                                       command=self.undo_sort_action)
         self.sort_undo_btn.pack(fill='x', pady=8)
         
+        self.sort_redo_btn = tk.Button(actions_frame, text="重做",
+                                      font=('Microsoft YaHei', 11, 'bold'),
+                                      bg='#FFC107', fg='#333', pady=10,
+                                      state='disabled',
+                                      command=self.redo_sort_action)
+        self.sort_redo_btn.pack(fill='x', pady=8)
+        
         skip_btn = tk.Button(actions_frame, text="⏭ 跳过",
                            font=('Microsoft YaHei', 11),
                            bg='#757575', fg='black', pady=10,
@@ -354,7 +4830,9 @@ B 背景文档
 H 人物文档
 T 背景+人物
 U 撤销上一步
-S 跳过当前"""
+R 重做
+S 跳过当前
+G 相似分组视图"""
         
         tk.Label(info_frame, text=shortcuts,
                 bg='#353535', fg='#ccc',
@@ -368,10 +4846,46 @@ S 跳过当前"""
         self.sort_images = []
         self.sort_current_index = 0
         self.sort_processed = set()
-        self.sort_thumbnails = []
-        self.sort_last_action = None
+        self.sort_undo_stack = []  # Each entry is the list of items one action sorted
+        self.sort_redo_stack = []
+        self.sort_index_by_name = {}
+        self.sort_name_keys = {}  # filename -> natural sort key
+        self.sort_folder_path = None
+        self.sort_indexer = None  # Set while the folder is still being listed
+        self.sort_first_shown = None
+        self.thumbnail_generation = 0
+        self.thumbnail_builder = None
+        self.thumbnail_atlas = None
+        self.sort_thumbnail_tiles = {}  # filename -> atlas tile, grows while the atlas is built
+        self.gallery_order = None  # Image indices shown in the gallery, None when it must be rebuilt
+        self.gallery_sheet_photos = OrderedDict()  # Decoded atlas sheets, least recently used first
+        self.gallery_tile_photos = OrderedDict()   # filename -> PhotoImage cut from a sheet
+        self.gallery_sheet_loads = set()
+        self.gallery_loader = ThreadPoolExecutor(max_workers=1)
+        self.gallery_render_job = None
+        self.sort_session = None
+        self.sort_cursor_job = None
+        self.sort_relocated = {}  # index -> current path of images sorted in move mode
+        self.sort_predictions = {}  # filename -> cached human detection result
+        self.autoclass_pass = None
+        self.sort_clusters = []  # cluster id -> image indices
+        self.sort_cluster_of = {}  # image index -> cluster id
+        self.cluster_pass = None
+        self.cluster_window = None
+        self.cluster_view_id = None
+        self.cluster_overrides = {}  # image index -> save type or 'exclude' in the group view
+        self.cluster_photos = {}  # image index -> PhotoImage shown in the group view
         self.background_count = 0
         self.human_count = 0
+        
+        # In-memory view of the output folders, kept current by the sort actions
+        self.sort_background_files = set()
+        self.sort_human_files = set()
+        self.sort_action_seq = 0
+        self.sort_reconcile_job = None
+        self.sort_reconcile_running = False
+        self.sort_file_queue = None
+        self.sort_folder_waiting = None  # Folder to open once the previous one's writes finish
     
     def setup_thumbnail_gallery(self, parent):
         """Setup thumbnail gallery at bottom - from your original code"""
@@ -397,36 +4911,43 @@ S 跳过当前"""
         self.thumbnail_canvas = tk.Canvas(canvas_frame, bg='#2d2d2d', height=120,
                                          highlightthickness=0, relief='solid', bd=1)
         
-        # Horizontal scrollbar
+        # Horizontal scrollbar, every view change redraws the cells that came into view
         h_scrollbar = tk.Scrollbar(canvas_frame, orient=tk.HORIZONTAL,
                                   command=self.thumbnail_canvas.xview)
-        self.thumbnail_canvas.configure(xscrollcommand=h_scrollbar.set)
+        
+        def on_gallery_xview(first, last):
+            h_scrollbar.set(first, last)
+            self.schedule_gallery_render()
+        
+        self.thumbnail_canvas.configure(xscrollcommand=on_gallery_xview)
+        self.thumbnail_canvas.bind('<Configure>', lambda e: self.schedule_gallery_render())
         
         self.thumbnail_canvas.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
 
-        # Add drag scrolling for gallery
-        self.gallery_drag_data = {"x": 0, "y": 0}
+        # Add drag scrolling for gallery, a click without dragging selects the thumbnail
+        self.gallery_drag_data = {"x": 0, "y": 0, "moved": 0}
 
         def on_gallery_press(event):
             self.gallery_drag_data["x"] = event.x
+            self.gallery_drag_data["moved"] = 0
 
         def on_gallery_drag(event):
             delta = event.x - self.gallery_drag_data["x"] 
             self.thumbnail_canvas.xview_scroll(int(-delta/10), "units")
             self.gallery_drag_data["x"] = event.x
+            self.gallery_drag_data["moved"] += abs(delta)
+
+        def on_gallery_release(event):
+            if self.gallery_drag_data["moved"] < 5:
+                slot = int(self.thumbnail_canvas.canvasx(event.x) // GALLERY_CELL[0])
+                order = self.get_gallery_order()
+                if 0 <= slot < len(order):
+                    self.select_sort_image(order[slot])
 
         self.thumbnail_canvas.bind("<ButtonPress-1>", on_gallery_press)
         self.thumbnail_canvas.bind("<B1-Motion>", on_gallery_drag)
-        
-        # Frame inside canvas for thumbnails
-        self.thumbnail_frame = tk.Frame(self.thumbnail_canvas, bg='#2d2d2d')
-        self.thumbnail_canvas.create_window(0, 0, anchor=tk.NW, window=self.thumbnail_frame)
-        
-        # Bind scrolling events
-        self.thumbnail_frame.bind('<Configure>',
-                                 lambda e: self.thumbnail_canvas.configure(
-                                     scrollregion=self.thumbnail_canvas.bbox("all")))
+        self.thumbnail_canvas.bind("<ButtonRelease-1>", on_gallery_release)
         
         # Mouse wheel scrolling
         # Enhanced mouse wheel scrolling
@@ -474,7 +4995,7 @@ S 跳过当前"""
                                             font=('Microsoft YaHei', 11, 'bold'),
                                             bg='#2196F3', fg='black', padx=20, pady=8,
                                             command=self.load_current_human_folder,
-                                            state='disabled')
+                                            state='normal' if self.current_workflow['human_folder'] else 'disabled')
         self.auto_load_human_btn.pack(side='left', padx=10, pady=5)
         
         self.crop_info = tk.Label(control_frame, text="请选择包含人物图像的文件夹",
@@ -489,21 +5010,44 @@ S 跳过当前"""
         save_btn.pack(side='right', padx=10, pady=5)
         self.crop_save_btn = save_btn
         
+        self.crop_export_btn = tk.Button(control_frame, text="批量导出",
+                                        font=('Microsoft YaHei', 11, 'bold'),
+                                        bg='#009688', fg='black', padx=15, pady=8,
+                                        command=self.export_accepted_crops, state='disabled')
+        self.crop_export_btn.pack(side='right', padx=5, pady=5)
+        
+        self.crop_detect_btn = tk.Button(control_frame, text="人物检测",
+                                        font=('Microsoft YaHei', 11, 'bold'),
+                                        bg='#9C27B0', fg='black', padx=15, pady=8,
+                                        command=self.toggle_crop_proposals, state='disabled')
+        self.crop_detect_btn.pack(side='right', padx=5, pady=5)
+        
         # Canvas for image and cropping
         canvas_frame = tk.Frame(main_frame, bg='#2d2d2d', relief='solid', bd=1)
         canvas_frame.pack(fill='both', expand=True, pady=10)
         
         self.crop_canvas = tk.Canvas(canvas_frame, bg='#2d2d2d', cursor="cross")
         self.crop_canvas.pack(fill='both', expand=True, padx=5, pady=5)
+        self.crop_canvas.bind("<Configure>", self.on_crop_canvas_resize)
         
         # Bind mouse events
         self.crop_canvas.bind("<ButtonPress-1>", self.start_crop)
         self.crop_canvas.bind("<B1-Motion>", self.draw_crop)
         self.crop_canvas.bind("<ButtonRelease-1>", self.end_crop)
+        self.crop_canvas.bind("<Double-Button-1>", self.edit_crop_proposal)
+        self.crop_canvas.bind("<MouseWheel>", self.on_crop_wheel)
+        self.crop_canvas.bind("<Button-4>", self.on_crop_wheel)
+        self.crop_canvas.bind("<Button-5>", self.on_crop_wheel)
+        for button in (2, 3):
+            self.crop_canvas.bind(f"<ButtonPress-{button}>", self.start_crop_pan)
+            self.crop_canvas.bind(f"<B{button}-Motion>", self.drag_crop_pan)
         
         # Instructions
         instructions = tk.Label(main_frame,
-                              text="使用方法：点击并拖动鼠标来选择裁剪区域，然后点击保存裁剪。可以在同一图像上裁剪多个区域。",
+                              text="使用方法：点击并拖动鼠标来选择裁剪区域，然后点击保存裁剪。可以在同一图像上裁剪多个区域。\n"
+                                   "人物检测框：单击接受/拒绝，双击转为可调整的裁剪框，拖动红框边缘调整，"
+                                   "A 接受(当前红框或全部待定框)，X 拒绝待定框，批量导出所有已接受的框。\n"
+                                   "滚轮或 +/- 缩放，中键/右键拖动平移，0 适应窗口。",
                               bg='#1a1a1a', fg='#888',
                               font=('Microsoft YaHei', 9))
         instructions.pack(pady=5)
@@ -539,15 +5083,36 @@ S 跳过当前"""
         self.crop_start_y = None
         self.crop_rect = None
         self.current_crop_image = None
+        self.current_crop_size = None
         self.crop_scale_factor = 1.0
-        self.crop_count = 0
+        self.crop_count = 0  # Crops submitted, only ever increases so output names are never reused
+        self.crop_failed = 0
+        self.crop_image_cache = CropImageCache()
+        self.crop_image_item = None
+        self.crop_canvas_size = None
+        self.crop_hq_job = None
+        self.crop_zoom = 1.0  # Relative to the fit-to-canvas scale
+        self.crop_pyramid = TilePyramid(
+            on_tile=lambda key, image: self.root.after(0, lambda: self.crop_tile_ready(key, image)))
+        self.crop_tiles = {}  # tile key -> (canvas item, PhotoImage)
+        self.crop_wanted_tiles = {}  # tile key -> display position, for the current view
+        self.crop_proposals = {}  # filename -> [{'id', 'box', 'score', 'state', 'source'}]
+        self.crop_proposal_pass = None
+        self.crop_writer = CropWriterPool(
+            on_done=lambda job, error: self.root.after(0, lambda: self.crop_write_finished(job, error)))
+        self.crop_export_batch = None
+        self.crop_recipes = None
+        self.crop_folder_path = None
+        self.crop_indexer = None  # Set while the folder is still being listed
+        self.crop_drag_edges = None  # Edges of the red rectangle being dragged
+        self.crop_pressed = False
     
     # Extraction methods
     def select_video(self):
         """Select video file for extraction"""
         video_path = filedialog.askopenfilename(
             title="选择视频文件",
-            filetypes=[("Video files", "*.mp4 *.avi *.mov *.mkv *.wmv *.flv *.webm *.m4v"),
+            filetypes=[("Video files", " ".join(f"*{ext}" for ext in VIDEO_EXTENSIONS)),
                       ("All files", "*.*")]
         )
         if video_path:
@@ -558,180 +5123,225 @@ S 跳过当前"""
             self.update_workflow_status()
     
     def start_extraction(self):
-        """Start keyframe extraction in a separate thread"""
+        """Queue the selected video ahead of everything else, it becomes the current project when done"""
         video_path = self.current_workflow['video_path']
         if not video_path or not os.path.exists(video_path):
             messagebox.showerror("错误", "视频文件不存在")
             return
         
-        self.extract_btn.config(state='disabled')
+        try:
+            job = self.queue_video(video_path, priority=1)
+        except ValueError as e:
+            messagebox.showerror("错误", f"无法加入队列: {str(e)}")
+            return
+        # In front of everything else already queued
+        queued = [j['id'] for j in self.queued_jobs_in_order() if j['id'] != job['id']]
+        self.extract_queue.store.reorder([job['id']] + queued)
+        self.extract_job_id = job['id']
+        self.extract_progress.config(value=0)
+        self.extract_status.config(text=f"已加入队列: {Path(video_path).stem}")
+    
+    def queue_video(self, video_path, priority=0):
+        """Submit an extraction job with the tab's current settings"""
         self.extraction_settings['scene_threshold'] = self.threshold_var.get()
-        
-        # Run extraction in thread
-        thread = threading.Thread(target=self.extract_keyframes, args=(video_path,))
-        thread.daemon = True
-        thread.start()
+        for storage, label in KEYFRAME_STORAGE_LABELS.items():
+            if label == self.keyframe_storage_var.get():
+                self.extraction_settings['keyframe_storage'] = storage
+        return self.extract_queue.submit('extract', {'video_path': video_path,
+                                                     'settings': dict(self.extraction_settings)}, priority)
     
-    def extract_keyframes(self, video_path):
-        """Extract keyframes from video using YOUR ORIGINAL ALGORITHM"""
-        try:
-            cap = cv2.VideoCapture(video_path)
-            if not cap.isOpened():
-                self.root.after(0, lambda: messagebox.showerror("错误", "无法打开视频文件"))
+    def add_videos_to_queue(self):
+        """Queue several videos at once, videos already waiting or running are skipped"""
+        paths = filedialog.askopenfilenames(
+            title="选择视频文件",
+            filetypes=[("Video files", " ".join(f"*{ext}" for ext in VIDEO_EXTENSIONS)),
+                      ("All files", "*.*")]
+        )
+        pending = {os.path.abspath(job['params']['video_path']) for job in self.extract_queue.store.list()
+                   if job['status'] in ('queued', 'running')}
+        for path in paths:
+            if os.path.abspath(path) in pending:
+                continue
+            try:
+                self.queue_video(path)
+            except ValueError as e:
+                messagebox.showerror("错误", f"无法加入队列: {str(e)}")
                 return
-            
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            video_name = Path(video_path).stem
-            duration_minutes = total_frames / fps / 60
-            
-            # Create output directory
-            output_base = os.path.join(os.path.dirname(video_path), f"{video_name}_keyframes")
-            output_base = Path(output_base)    
-            output_base.mkdir(exist_ok=True)     
-            
-            # Store in workflow
-            self.current_workflow['keyframes_folder'] = str(output_base)
-            
-            # Update UI
-            self.root.after(0, lambda: self.extract_status.config(
-                text=f"正在处理: {video_name} ({total_frames:,} 帧, {duration_minutes:.1f} 分钟)"))
-            
-            # Calculate maximum allowed keyframes
-            max_allowed = int(duration_minutes * self.extraction_settings['max_keyframes_per_minute'])
-            
-            keyframes_detected = 0
-            frame_count = 0
-            prev_frame = None
-            frames_since_last = 0
-            black_filtered = 0
-            
-            # Process first frame
-            ret, first_frame = cap.read()
-            if ret and not self.is_black_frame(first_frame):
-                output_path = os.path.join(str(output_base), f"{video_name}_keyframe_{keyframes_detected:04d}.jpg")
-                cv2.imwrite(output_path, first_frame,
-                           [cv2.IMWRITE_JPEG_QUALITY, self.extraction_settings['jpeg_quality']])
-                keyframes_detected += 1
-                prev_frame = first_frame.copy()
-            
-            # Process remaining frames
-            while True:
-                ret, current_frame = cap.read()
-                if not ret:
-                    break
-                
-                frame_count += 1
-                frames_since_last += 1
-                
-                # Update progress
-                if frame_count % 30 == 0:
-                    progress = (frame_count / total_frames) * 100
-                    self.root.after(0, lambda p=progress: self.extract_progress.config(value=p))
-                
-                # Check if reached max keyframes
-                if keyframes_detected >= max_allowed:
-                    continue
-                
-                # Skip if too soon after last keyframe
-                if frames_since_last < self.extraction_settings['min_frames_between']:
-                    continue
-                
-                # Skip black frames
-                if self.is_black_frame(current_frame):
-                    black_filtered += 1
-                    continue
-                
-                # Calculate scene change
-                if prev_frame is not None:
-                    difference = self.calculate_frame_difference(prev_frame, current_frame)
-                    
-                    if difference >= self.extraction_settings['scene_threshold']:
-                        # Save keyframe
-                        timestamp = frame_count / fps
-                        minutes = int(timestamp // 60)
-                        seconds = int(timestamp % 60)
-                        
-                        filename = f"{video_name}_keyframe_{keyframes_detected:04d}_{minutes:02d}m{seconds:02d}s.jpg"
-                        output_path = os.path.join(str(output_base), filename)
-                        cv2.imwrite(output_path, current_frame,
-                                   [cv2.IMWRITE_JPEG_QUALITY, self.extraction_settings['jpeg_quality']])
-                        keyframes_detected += 1
-                        frames_since_last = 0
-                        
-                        # Update status
-                        self.root.after(0, lambda kf=keyframes_detected: 
-                                      self.extract_status.config(text=f"已提取 {kf} 个关键帧"))
-                
-                prev_frame = current_frame.copy()
-            
-            cap.release()
-            
-            # Store stats
-            self.current_workflow['extraction_stats'] = {
-                'total_frames': total_frames,
-                'keyframes_detected': keyframes_detected,
-                'duration_minutes': duration_minutes,
-                'black_filtered': black_filtered
-            }
-            
-            # Update UI with results
-            results = f"""✅ 提取完成！
+    
+    def queued_jobs_in_order(self):
+        """Queued jobs in the order they will start: priority, then queue position"""
+        queued = [job for job in self.extract_queue.store.list() if job['status'] == 'queued']
+        return sorted(queued, key=lambda job: -job.get('priority', 0))
+    
+    def selected_queue_job(self):
+        selection = self.queue_tree.selection()
+        return self.extract_queue.store.get(selection[0]) if selection else None
+    
+    def move_queued_job(self, direction):
+        """Swap a queued job with its neighbour, taking the neighbour's priority"""
+        job = self.selected_queue_job()
+        if job is None or job['status'] != 'queued':
+            return
+        order = self.queued_jobs_in_order()
+        i = [j['id'] for j in order].index(job['id'])
+        if not 0 <= i + direction < len(order):
+            return
+        neighbour = order[i + direction]
+        if neighbour.get('priority', 0) != job.get('priority', 0):
+            self.extract_queue.store.update(job['id'], priority=neighbour.get('priority', 0))
+        order[i], order[i + direction] = order[i + direction], order[i]
+        self.extract_queue.store.reorder([j['id'] for j in order])
+        self.tick_extraction_queue(reschedule=False)
+    
+    def cycle_queued_priority(self):
+        """普通 -> 高 -> 低 -> 普通"""
+        job = self.selected_queue_job()
+        if job is None or job['status'] != 'queued':
+            return
+        self.extract_queue.store.update(job['id'], priority={0: 1, 1: -1, -1: 0}[job.get('priority', 0)])
+        self.tick_extraction_queue(reschedule=False)
+    
+    def cancel_queued_job(self):
+        job = self.selected_queue_job()
+        if job is not None:
+            self.extract_queue.cancel(job['id'])
+            self.tick_extraction_queue(reschedule=False)
+    
+    def clear_finished_jobs(self):
+        self.extract_queue.store.remove_finished()
+        self.tick_extraction_queue(reschedule=False)
+    
+    def note_user_activity(self, event=None):
+        """Input on the sorting or cropping tab, the governor slows the queue down for a while"""
+        if self.notebook.index('current') in (1, 2):
+            self.last_user_activity = time.monotonic()
+    
+    def tick_extraction_queue(self, reschedule=True):
+        """Resource governor and queue view, every half second"""
+        interactive = (self.governor_var.get()
+                       and time.monotonic() - self.last_user_activity < GOVERNOR_IDLE_SECONDS)
+        throttle = GOVERNOR_THROTTLE if interactive else 0.0
+        if self.extract_queue.throttle.value != throttle:
+            self.extract_queue.set_throttle(throttle)
+        
+        jobs = self.extract_queue.store.list()
+        running = [job for job in jobs if job['status'] == 'running']
+        self.governor_label.config(text="正在分类/裁剪，后台提取已降速" if interactive and running else "")
+        self.refresh_queue_view(jobs)
+        self.track_extraction_job(jobs)
+        if reschedule:
+            self.root.after(500, self.tick_extraction_queue)
+    
+    def refresh_queue_view(self, jobs):
+        """Running jobs, then queued ones in start order, then finished ones newest first"""
+        running = sorted((job for job in jobs if job['status'] == 'running'), key=lambda job: job['started'])
+        queued = sorted((job for job in jobs if job['status'] == 'queued'), key=lambda job: -job.get('priority', 0))
+        finished = sorted((job for job in jobs if job['status'] in JOB_FINISHED_STATES),
+                          key=lambda job: -(job['finished'] or 0))
+        rows = running + queued + finished
+        key = [(job['id'], job['version']) for job in rows]
+        if key == self.queue_view_key:
+            return
+        self.queue_view_key = key
+        
+        selection = self.queue_tree.selection()
+        self.queue_tree.delete(*self.queue_tree.get_children())
+        for job in rows:
+            progress = job['progress']
+            percent = f"{progress['done'] / progress['total'] * 100:.0f}%" if progress and progress['total'] else ""
+            if job['status'] == 'done':
+                percent = "100%"
+            status = JOB_STATUS_LABELS[job['status']]
+            if job['status'] == 'failed':
+                status += f": {job['error']}"
+            self.queue_tree.insert('', 'end', iid=job['id'], values=(
+                Path(job['params']['video_path']).name, JOB_PRIORITY_LABELS.get(job.get('priority', 0), ''),
+                status, percent, (job['result'] or {}).get('keyframes_detected', '')))
+        if selection and self.queue_tree.exists(selection[0]):
+            self.queue_tree.selection_set(selection[0])
+    
+    def track_extraction_job(self, jobs):
+        """Progress of the job started with 开始提取, results once it finishes"""
+        job = next((job for job in jobs if job['id'] == self.extract_job_id), None)
+        if job is None:
+            return
+        video_name = Path(job['params']['video_path']).stem
+        if job['status'] == 'queued':
+            self.extract_status.config(text=f"排队中: {video_name}")
+        elif job['status'] == 'running':
+            progress = job['progress']
+            if progress and progress['total']:
+                self.extract_progress.config(value=progress['done'] / progress['total'] * 100)
+            self.extract_status.config(text=f"正在处理: {video_name}")
+        else:
+            self.extract_job_id = None
+            if job['status'] == 'done':
+                self.show_extraction_results(job)
+            elif job['status'] == 'failed':
+                self.extract_status.config(text="提取失败")
+                messagebox.showerror("错误", f"提取失败: {job['error']}")
+            else:
+                self.extract_status.config(text="已取消")
+    
+    def open_queued_result(self):
+        """Make a finished queue job the current project"""
+        job = self.selected_queue_job()
+        if job is not None and job['status'] == 'done':
+            self.show_extraction_results(job)
+    
+    def show_extraction_results(self, job):
+        """Show a finished extraction and make its video the current project"""
+        stats = job['result']
+        video_path = job['params']['video_path']
+        video_name = Path(video_path).stem
+        self.current_workflow['video_path'] = video_path
+        self.current_workflow['video_name'] = video_name
+        self.current_workflow['keyframes_folder'] = stats['output_folder']
+        self.current_workflow['extraction_stats'] = stats
+        self.video_path_var.set(video_path)
+        
+        duration_minutes = stats['duration_minutes']
+        keyframes_detected = stats['keyframes_detected']
+        results = f"""✅ 提取完成！
 视频: {video_name}
-总帧数: {total_frames:,}
+总帧数: {stats['total_frames']:,}
 时长: {duration_minutes:.1f} 分钟
 提取关键帧: {keyframes_detected}
 每分钟关键帧: {keyframes_detected/duration_minutes:.1f}
-过滤黑帧: {black_filtered}
-输出目录: {output_base}"""
-            
-            self.root.after(0, lambda: self.results_text.delete('1.0', tk.END))
-            self.root.after(0, lambda: self.results_text.insert('1.0', results))
-            self.root.after(0, lambda: self.extract_btn.config(state='normal'))
-            self.root.after(0, lambda: self.continue_sort_btn.config(state='normal'))
-            self.root.after(0, lambda: self.auto_load_btn.config(state='normal'))
-            self.root.after(0, lambda: self.extract_progress.config(value=100))
-            self.root.after(0, lambda: self.update_workflow_status(step_completed=1))
-            
-        except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("错误", f"提取失败: {str(e)}"))
-            self.root.after(0, lambda: self.extract_btn.config(state='normal'))
-    
-    def calculate_frame_difference(self, frame1, frame2):
-        """Calculate difference between frames using YOUR ORIGINAL METHOD"""
-        hsv1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2HSV)
-        hsv2 = cv2.cvtColor(frame2, cv2.COLOR_BGR2HSV)
-        
-        hist1 = cv2.calcHist([hsv1], [0, 1, 2], None, [50, 60, 60],
-                            [0, 180, 0, 256, 0, 256])
-        hist2 = cv2.calcHist([hsv2], [0, 1, 2], None, [50, 60, 60],
-                            [0, 180, 0, 256, 0, 256])
+过滤黑帧: {stats['black_filtered']}
+输出目录: {stats['output_folder']}"""
+        if stats['storage'] == 'reference':
+            results += "\n引用模式: 只记录了帧位置，分类时才写入图像"
+        elif stats['storage'] == 'pack':
+            results += f"\n打包存储: {KEYFRAME_PACK_INDEX_FILENAME}"
         
-        hist1 = cv2.normalize(hist1, hist1).flatten()
-        hist2 = cv2.normalize(hist2, hist2).flatten()
-        
-        correlation = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL)
-        return 1 - max(0, correlation)
-    
-    def is_black_frame(self, frame):
-        """Check if frame is mostly black"""
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        black_pixels = np.sum(gray_frame < self.extraction_settings['black_threshold'])
-        total_pixels = gray_frame.shape[0] * gray_frame.shape[1]
-        black_ratio = black_pixels / total_pixels
-        return black_ratio >= self.extraction_settings['black_ratio']
+        self.results_text.delete('1.0', tk.END)
+        self.results_text.insert('1.0', results)
+        self.extract_btn.config(state='normal')
+        self.continue_sort_btn.config(state='normal')
+        if 1 in self.tabs_built:
+            self.auto_load_btn.config(state='normal')
+        self.extract_progress.config(value=100)
+        self.extract_status.config(text=f"已提取 {keyframes_detected} 个关键帧")
+        self.update_workflow_status(step_completed=1)
     
     def continue_to_sorting(self):
         """Automatically move to sorting tab with current project"""
+        self.ensure_tab(1)
         self.notebook.select(1)  # Switch to sorting tab
         self.load_current_project_for_sorting()
 
     def continue_to_cropping(self):
         """Automatically move to cropping tab with current project"""
+        self.flush_sort_file_queue(self.open_cropping_for_project)
+    
+    def open_cropping_for_project(self):
+        """Switch to the cropping tab once the sorted images are on disk"""
         if self.current_workflow['human_folder'] and os.path.exists(self.current_workflow['human_folder']):
             human_files = [f for f in os.listdir(self.current_workflow['human_folder']) 
                         if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
             if human_files:
+                self.ensure_tab(2)
                 self.notebook.select(2)  # Switch to cropping tab
                 self.load_current_human_folder()
             else:
@@ -753,10 +5363,22 @@ S 跳过当前"""
     
     def load_sorting_folder(self, folder_path):
         """Load images from folder for sorting"""
+        self.ensure_tab(1)
         if not os.path.exists(folder_path):
             messagebox.showerror("错误", "文件夹不存在")
             return
         
+        # The previous folder's queued writes finish first, polled so the window stays responsive
+        waiting = self.sort_folder_waiting is not None
+        self.sort_folder_waiting = folder_path
+        if self.sort_file_queue and self.sort_file_queue.depth():
+            self.sort_info_label.configure(text=f"正在写入上一个文件夹的 {self.sort_file_queue.depth()} 个文件...")
+            self.update_sort_pending()
+            if not waiting:
+                self.root.after(200, self.retry_load_sorting_folder)
+            return
+        self.sort_folder_waiting = None
+        
         # Create output folders
         folder_name = os.path.basename(folder_path)
         parent_dir = os.path.dirname(folder_path)
@@ -776,72 +5398,268 @@ S 跳过当前"""
         os.makedirs(self.sort_background_folder, exist_ok=True)
         os.makedirs(self.sort_human_folder, exist_ok=True)
         
+        # File operations run on a journaled worker, replaying anything a crash left behind
+        if self.sort_file_queue:
+            self.sort_file_queue.close(timeout=1)
+        self.sort_file_queue = SortFileQueue(os.path.join(output_base, '.sort_journal.jsonl'),
+                                             on_change=self.on_sort_file_op)
+        
+        # Count existing output once, afterwards counters follow the actions
+        self.sort_background_files = self.scan_sorted_folder(self.sort_background_folder)
+        self.sort_human_files = self.scan_sorted_folder(self.sort_human_folder)
+        self.sort_action_seq += 1
+        
         # Update workflow
         self.current_workflow['sorted_folder'] = output_base
         self.current_workflow['background_folder'] = self.sort_background_folder
         self.current_workflow['human_folder'] = self.sort_human_folder
         
-        # Load images
+        # Initialize sorting
         self.sort_images = []
-        supported_formats = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+        self.sort_index_by_name = {}
+        self.sort_name_keys = {}
+        self.sort_folder_path = folder_path
+        self.sort_first_shown = None
+        self.sort_current_index = 0
+        self.sort_processed = set()
+        self.sort_relocated = {}
+        self.stop_autoclassify()
+        self.sort_predictions = {}
+        self.stop_clustering()
+        self.close_cluster_view()
+        self.sort_clusters = []
+        self.sort_cluster_of = {}
+        self.clear_thumbnails()
         
-        for filename in sorted(os.listdir(folder_path)):
-            if filename.lower().endswith(supported_formats):
-                self.sort_images.append(os.path.join(folder_path, filename))
+        if self.sort_session:
+            self.sort_session.close()
+        self.sort_session = SortSession(os.path.join(output_base, '.sort_session.jsonl'))
+        self.sort_undo_stack = []
+        self.sort_redo_stack = []
+        self.update_sort_buttons()
+        self.autoclass_btn.config(state='disabled')
+        self.cluster_btn.config(state='disabled')
         
+        # Images are listed on a background thread, the first one is shown as soon as it is found
+        if self.sort_indexer:
+            self.sort_indexer.stop()
+        indexer = FolderIndexer(
+            folder_path, ('.jpg', '.jpeg', '.png', '.bmp', '.tiff'),
+            on_batch=lambda names: self.root.after(0, lambda: self.sort_index_batch(indexer, names)),
+            on_done=lambda error: self.root.after(0, lambda: self.sort_index_done(indexer, error)))
+        self.sort_indexer = indexer
+        self.sort_info_label.configure(text="正在读取文件夹...")
+        indexer.start()
+    
+    def sort_index_batch(self, indexer, names):
+        """Merge newly listed images in natural order, keeping the current image in view"""
+        if indexer is not self.sort_indexer:
+            return
+        new = [name for name in set(names) if name not in self.sort_index_by_name]
+        if not new:
+            return
+        for name in new:
+            self.sort_name_keys[name] = natural_sort_key(name)
+        
+        current = os.path.basename(self.sort_images[self.sort_current_index]) if self.sort_images else None
+        # Already sorted plus a batch: Timsort merges the runs in linear time
+        merged = sorted(list(self.sort_index_by_name) + new, key=self.sort_name_keys.__getitem__)
+        self.sort_images = [os.path.join(self.sort_folder_path, name) for name in merged]
+        self.sort_index_by_name = {name: i for i, name in enumerate(merged)}
+        self.gallery_order = None
+        
+        if current is None:
+            self.sort_current_index = 0
+            self.sort_first_shown = merged[0]
+            self.display_sort_image()
+        else:
+            self.sort_current_index = self.sort_index_by_name[current]
+            self.update_sort_info()
+        self.update_sort_progress()
+    
+    def sort_index_done(self, indexer, error):
+        """Folder fully listed: resume the session, then build the gallery and enable sorting"""
+        if indexer is not self.sort_indexer:
+            return
+        self.sort_indexer = None
+        if error is not None:
+            messagebox.showerror("错误", f"无法读取文件夹: {str(error)}")
         if not self.sort_images:
+            self.sort_info_label.configure(text="")
             messagebox.showwarning("警告", "未找到图像文件")
             return
         
-        # Initialize sorting
-        self.sort_current_index = 0
-        self.sort_processed = set()
-        self.sort_last_action = None
+        # Keep the image the user navigated to while the folder was being listed
+        current = os.path.basename(self.sort_images[self.sort_current_index])
+        
+        # Resume the previous session on this folder, if any
+        self.restore_sort_session(self.sort_folder_path)
+        if current != self.sort_first_shown and current in self.sort_index_by_name:
+            self.sort_current_index = self.sort_index_by_name[current]
+        self.update_sort_buttons()
+        self.sync_sort_catalog()
         
         # Load thumbnails
         self.load_thumbnails()
         
-        # Display first image
         self.display_sort_image()
         self.update_sort_progress()
+        self.schedule_sort_reconcile()
 
-        if os.path.exists(self.sort_human_folder):
-            human_files = [f for f in os.listdir(self.sort_human_folder) 
-                        if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-            if human_files:
-                self.continue_crop_btn.config(state='normal')
+        if self.sort_human_files:
+            self.continue_crop_btn.config(state='normal')
         
         # Enable human folder button
-        self.auto_load_human_btn.config(state='normal')
+        if 2 in self.tabs_built:
+            self.auto_load_human_btn.config(state='normal')
+        self.autoclass_btn.config(state='normal')
+        self.cluster_btn.config(state='normal')
+    
+    def clear_thumbnails(self):
+        """Empty the gallery and drop atlas updates still coming from an earlier load"""
+        self.thumbnail_generation += 1
+        if self.thumbnail_builder:
+            self.thumbnail_builder.stop()
+            self.thumbnail_builder = None
+        self.thumbnail_atlas = None
+        self.sort_thumbnail_tiles = {}
+        self.gallery_order = None
+        self.gallery_sheet_photos.clear()
+        self.gallery_tile_photos.clear()
+        self.gallery_sheet_loads = set()
+        self.thumbnail_canvas.delete('all')
+        self.thumbnail_canvas.configure(scrollregion=(0, 0, 0, 0))
     
     def load_thumbnails(self):
-        """Load and display thumbnails in gallery"""
-        # Clear existing
-        for widget in self.thumbnail_frame.winfo_children():
-            widget.destroy()
+        """Read the folder's thumbnail atlas, building missing tiles on a background thread"""
+        self.clear_thumbnails()
+        generation = self.thumbnail_generation
+        paths = {os.path.basename(path): self.get_sort_image_path(i) for i, path in enumerate(self.sort_images)}
+        builder = ThumbnailAtlasBuilder(
+            self.sort_folder_path, paths,
+            on_update=lambda tiles, sheets: self.root.after(
+                0, lambda: self.add_thumbnails(generation, tiles, sheets)),
+            on_done=lambda: self.root.after(0, lambda: self.thumbnails_done(generation)))
+        self.thumbnail_builder = builder
+        builder.start()
+    
+    def add_thumbnails(self, generation, tiles, sheets):
+        """Take new atlas tiles, dropping decoded sheets that were rewritten on disk"""
+        if generation != self.thumbnail_generation:
+            return
+        first = self.thumbnail_atlas is None
+        self.thumbnail_atlas = self.thumbnail_builder.atlas
+        for sheet in sheets or ():
+            self.gallery_sheet_photos.pop(sheet, None)
+        for name in tiles:
+            self.gallery_tile_photos.pop(name, None)
+        self.sort_thumbnail_tiles.update(tiles)
+        self.schedule_gallery_render()
+        if first:
+            self.scroll_gallery_to_current()
+    
+    def thumbnails_done(self, generation):
+        if generation == self.thumbnail_generation:
+            self.thumbnail_builder = None
+    
+    def get_gallery_order(self):
+        """Indices of the images the gallery shows, processed ones are left out"""
+        if self.gallery_order is None:
+            processed = self.sort_processed
+            self.gallery_order = [i for i in range(len(self.sort_images)) if i not in processed]
+        return self.gallery_order
+    
+    def schedule_gallery_render(self):
+        if self.gallery_render_job is None:
+            self.gallery_render_job = self.root.after_idle(self.render_gallery)
+    
+    def render_gallery(self):
+        """Draw only the cells in view, each a tile cut from an atlas sheet"""
+        self.gallery_render_job = None
+        canvas = self.thumbnail_canvas
+        order = self.get_gallery_order()
+        cell_width, cell_height = GALLERY_CELL
+        canvas.configure(scrollregion=(0, 0, len(order) * cell_width, cell_height))
+        canvas.delete('cell')
+        
+        left = canvas.canvasx(0)
+        first = max(0, int(left // cell_width))
+        last = min(len(order), int((left + canvas.winfo_width()) // cell_width) + 1)
+        for slot in range(first, last):
+            index = order[slot]
+            x = slot * cell_width
+            current = index == self.sort_current_index
+            canvas.create_rectangle(x + 3, 3, x + cell_width - 3, cell_height - 3, tags='cell',
+                                    fill='#2196F3' if current else self.thumbnail_color(index),
+                                    outline='#2196F3' if current else '', width=3 if current else 0)
+            photo = self.thumbnail_tile_photo(index)
+            if photo is not None:
+                canvas.create_image(x + cell_width / 2, cell_height / 2, image=photo, tags='cell')
+            else:
+                # Tile not built yet, or its sheet is still being decoded
+                canvas.create_text(x + cell_width / 2, cell_height / 2, text="…", fill='#888', tags='cell')
+    
+    def thumbnail_tile_photo(self, index, wait=False):
+        """PhotoImage of an image's thumbnail cut from its atlas sheet, None until it is available.
         
-        self.sort_thumbnails = []
+        Sheets are decoded on the gallery loader thread; with wait=True a
+        missing sheet is decoded right here instead.
+        """
+        name = os.path.basename(self.sort_images[index])
+        photo = self.gallery_tile_photos.get(name)
+        if photo is not None:
+            self.gallery_tile_photos.move_to_end(name)
+            return photo
+        tile = self.sort_thumbnail_tiles.get(name)
+        if tile is None:
+            return None
+        sheet_no, x, y, w, h = tile[:5]
+        sheet = self.gallery_sheet_photos.get(sheet_no)
+        if sheet is None:
+            if not wait:
+                self.request_gallery_sheet(sheet_no)
+                return None
+            self.install_gallery_sheet(self.thumbnail_generation, sheet_no,
+                                       load_atlas_sheet(self.thumbnail_atlas.sheet_path(sheet_no)))
+            sheet = self.gallery_sheet_photos[sheet_no]
+        self.gallery_sheet_photos.move_to_end(sheet_no)
         
-        for i, image_path in enumerate(self.sort_images):
+        # Tk copies the region inside the photo image, no Python pixel work
+        photo = tk.PhotoImage(master=self.root, width=w, height=h)
+        photo.tk.call(photo, 'copy', sheet, '-from', x, y, x + w, y + h)
+        self.gallery_tile_photos[name] = photo
+        if len(self.gallery_tile_photos) > GALLERY_TILE_CACHE:
+            self.gallery_tile_photos.popitem(last=False)
+        return photo
+    
+    def request_gallery_sheet(self, sheet_no):
+        """Decode an atlas sheet on the loader thread, the gallery redraws when it arrives"""
+        if sheet_no in self.gallery_sheet_loads:
+            return
+        self.gallery_sheet_loads.add(sheet_no)
+        generation = self.thumbnail_generation
+        path = self.thumbnail_atlas.sheet_path(sheet_no)
+        
+        def load():
             try:
-                img = Image.open(image_path)
-                img.thumbnail((100, 80), Image.Resampling.LANCZOS)
-                photo = ImageTk.PhotoImage(img)
-                
-                thumb_btn = tk.Button(self.thumbnail_frame, image=photo,
-                                    command=lambda idx=i: self.select_sort_image(idx),
-                                    bg='#404040', relief='solid', borderwidth=2)
-                thumb_btn.image = photo
-                thumb_btn.pack(side='left', padx=3, pady=3)
-                
-                self.sort_thumbnails.append(thumb_btn)
-                
+                img = load_atlas_sheet(path)
             except Exception as e:
-                print(f"Error loading thumbnail: {e}")
+                print(f"Error loading thumbnail sheet: {e}")
+                img = None
+            self.root.after(0, lambda: self.install_gallery_sheet(generation, sheet_no, img))
         
-        # Update scroll region
-        self.thumbnail_frame.update_idletasks()
-        self.thumbnail_canvas.configure(scrollregion=self.thumbnail_canvas.bbox("all"))
+        self.gallery_loader.submit(load)
+    
+    def install_gallery_sheet(self, generation, sheet_no, img):
+        if generation != self.thumbnail_generation:
+            return
+        self.gallery_sheet_loads.discard(sheet_no)
+        if img is None:
+            return
+        self.gallery_sheet_photos[sheet_no] = ImageTk.PhotoImage(img)
+        if len(self.gallery_sheet_photos) > GALLERY_SHEET_CACHE:
+            self.gallery_sheet_photos.popitem(last=False)
+        self.schedule_gallery_render()
     
     def select_sort_image(self, index):
         """Select image by clicking thumbnail"""
@@ -864,8 +5682,8 @@ S 跳过当前"""
             return
         
         try:
-            image_path = self.sort_images[self.sort_current_index]
-            img = Image.open(image_path)
+            image_path = self.get_sort_image_path(self.sort_current_index)
+            img = open_keyframe_image(image_path)
             
             # Resize for display
             display_width, display_height = 700, 450
@@ -875,130 +5693,633 @@ S 跳过当前"""
             self.sort_image_label.configure(image=photo, text="")
             self.sort_image_label.image = photo
             
-            # Update info
-            filename = os.path.basename(image_path)
-            self.sort_info_label.configure(
-                text=f"{filename}\n第 {self.sort_current_index + 1} / {len(self.sort_images)} 张")
-            
-            # Update slider position and range
-            if hasattr(self, 'nav_slider'):
-                self.nav_slider.config(to=len(self.sort_images))
-                self.nav_slider.set(self.sort_current_index + 1)
-                self.slider_label.config(text=f"{self.sort_current_index + 1}/{len(self.sort_images)}")
+            self.update_sort_info()
             
             # Highlight current thumbnail
             self.highlight_current_thumbnail()
+            self.schedule_cursor_save()
             
         except Exception as e:
             messagebox.showerror("错误", f"无法显示图像: {str(e)}")
     
+    def update_sort_info(self):
+        """Filename, position, prediction and slider range of the current image"""
+        filename = os.path.basename(self.sort_images[self.sort_current_index])
+        info = f"{filename}\n第 {self.sort_current_index + 1} / {len(self.sort_images)} 张"
+        prediction = self.sort_predictions.get(filename)
+        if prediction and prediction.get('score') is not None:
+            label = {'human': '人物', 'background': '背景'}.get(
+                self.predicted_sort_label(filename), '不确定')
+            info += f"  |  预标注: {label} ({prediction['score']:.2f})"
+        cluster_id = self.sort_cluster_of.get(self.sort_current_index)
+        if cluster_id is not None:
+            remaining = sum(1 for i in self.sort_clusters[cluster_id] if i not in self.sort_processed)
+            info += f"  |  分组 {cluster_id + 1}: {remaining} 张未处理 (G 查看)"
+        if self.sort_indexer:
+            info += "  |  正在读取文件夹..."
+        self.sort_info_label.configure(text=info)
+        
+        # Update slider position and range
+        if hasattr(self, 'nav_slider'):
+            self.nav_slider.config(to=len(self.sort_images))
+            self.nav_slider.set(self.sort_current_index + 1)
+            self.slider_label.config(text=f"{self.sort_current_index + 1}/{len(self.sort_images)}")
+    
+    def get_sort_image_path(self, index):
+        """Return where the image at index currently lives on disk"""
+        relocated = self.sort_relocated.get(index)
+        # A queued move may not have happened yet
+        if relocated and os.path.exists(relocated):
+            return relocated
+        return self.sort_images[index]
+    
+    def sort_strategy_changed(self, label):
+        """Switch how sorted images are materialised"""
+        for strategy, strategy_label in SORT_STRATEGY_LABELS.items():
+            if strategy_label == label:
+                self.sort_settings['materialise_strategy'] = strategy
+                break
+    
     def highlight_current_thumbnail(self):
         """Highlight current thumbnail in gallery"""
-        for i, thumb in enumerate(self.sort_thumbnails):
-            if i == self.sort_current_index:
-                thumb.configure(relief='solid', borderwidth=3, bg='#2196F3')
-            elif i in self.sort_processed:
-                thumb.pack_forget()
-            else:
-                thumb.configure(relief='solid', borderwidth=2, bg='#404040')
+        self.schedule_gallery_render()
+    
+    def thumbnail_color(self, index):
+        """Thumbnail border colour, tinted by the pre-classification label"""
+        label = self.predicted_sort_label(os.path.basename(self.sort_images[index]))
+        return {'human': '#B36B00', 'background': '#1F4E79'}.get(label, '#404040')
+    
+    def predicted_sort_label(self, filename):
+        """Pre-classification label for an image: 'human', 'background' or None if unsure"""
+        prediction = self.sort_predictions.get(filename)
+        if not prediction or prediction.get('score') is None:
+            return None
+        if prediction['score'] >= self.sort_settings['autoclass_human_threshold']:
+            return 'human'
+        if prediction['score'] < self.sort_settings['autoclass_background_threshold']:
+            return 'background'
+        return None
+    
+    def toggle_autoclassify(self):
+        """Start or stop the background pre-classification pass"""
+        if self.autoclass_pass and self.autoclass_pass.is_running():
+            self.stop_autoclassify()
+            return
+        
+        if not self.sort_images:
+            return
+        if not human_detection_available():
+            messagebox.showerror("错误", "当前 OpenCV 版本不包含 HOG/Haar 人物检测器")
+            return
+        
+        # Unprocessed images nearest to the current one are scored first
+        order = sorted((i for i in range(len(self.sort_images)) if i not in self.sort_processed),
+                       key=lambda i: (i < self.sort_current_index, abs(i - self.sort_current_index)))
+        
+        self.autoclass_pass = HumanDetectionPass(
+            [self.get_sort_image_path(i) for i in order],
+            os.path.join(self.current_workflow['sorted_folder'], '.autoclass_cache.json'),
+            on_results=lambda results, done, total: self.root.after(
+                0, lambda: self.autoclass_results(results, done, total)),
+            max_side=self.sort_settings['autoclass_max_side'])
+        self.autoclass_pass.start()
+        self.autoclass_btn.config(text="停止预分类")
+    
+    def stop_autoclassify(self):
+        """Stop the pre-classification pass, results so far stay cached"""
+        if self.autoclass_pass:
+            self.autoclass_pass.stop()
+            self.autoclass_pass = None
+        if hasattr(self, 'autoclass_btn'):
+            self.autoclass_btn.config(text="自动预分类")
+    
+    def autoclass_results(self, results, done, total):
+        """Merge a batch of detection results into the gallery and info line"""
+        if not self.autoclass_pass:
+            return  # Stopped, or the folder changed
+        
+        self.sort_predictions.update(results)
+        if done >= total:
+            self.autoclass_pass = None
+            self.autoclass_btn.config(text="自动预分类")
+        else:
+            self.autoclass_btn.config(text=f"停止预分类 {done}/{total}")
+        
+        if self.sort_predictions:
+            self.confirm_predictions_btn.config(state='normal')
+        
+        # Border colours follow the labels, only cells in view are redrawn
+        self.schedule_gallery_render()
+        
+        current = os.path.basename(self.sort_images[self.sort_current_index])
+        if current in results:
+            self.display_sort_image()
+    
+    def toggle_clustering(self):
+        """Start or stop grouping the folder by visual similarity"""
+        if self.cluster_pass and self.cluster_pass.is_running():
+            self.stop_clustering()
+            return
+        if not self.sort_images:
+            return
+        
+        self.cluster_pass = SignaturePass(
+            [self.get_sort_image_path(i) for i in range(len(self.sort_images))],
+            os.path.join(self.current_workflow['sorted_folder'], '.signature_cache.npz'),
+            on_progress=lambda done, total: self.root.after(
+                0, lambda: self.cluster_btn.config(text=f"分组中 {done}/{total}")),
+            on_done=lambda labels: self.root.after(0, lambda: self.clustering_done(labels)),
+            hist_threshold=self.sort_settings['cluster_hist_threshold'],
+            hash_threshold=self.sort_settings['cluster_hash_threshold'])
+        self.cluster_pass.start()
+        self.cluster_btn.config(text="分组中...")
+    
+    def stop_clustering(self):
+        """Stop the signature pass, computed signatures stay cached"""
+        if self.cluster_pass:
+            self.cluster_pass.stop()
+            self.cluster_pass = None
+        if hasattr(self, 'cluster_btn'):
+            self.cluster_btn.config(text="相似分组")
+    
+    def clustering_done(self, labels):
+        """Install the cluster assignment for the loaded folder"""
+        if not self.cluster_pass or len(labels) != len(self.sort_images):
+            return  # Stopped, or the folder changed
+        self.cluster_pass = None
+        
+        self.sort_clusters = [[] for _ in range(int(labels.max()) + 1 if len(labels) else 0)]
+        for index, cluster_id in enumerate(labels):
+            self.sort_clusters[int(cluster_id)].append(index)
+        self.sort_cluster_of = {index: int(cluster_id) for index, cluster_id in enumerate(labels)}
+        
+        grouped = sum(1 for members in self.sort_clusters if len(members) > 1)
+        self.cluster_btn.config(text=f"相似分组 ({grouped} 组)")
+        self.display_sort_image()
+    
+    def open_cluster_view(self, cluster_id=None):
+        """Show the unprocessed members of a cluster as a grid for one-key sorting"""
+        if cluster_id is None:
+            cluster_id = self.sort_cluster_of.get(self.sort_current_index)
+        if cluster_id is None:
+            if not self.sort_clusters:
+                messagebox.showinfo("提示", "请先点击“相似分组”")
+            return
+        
+        members = [i for i in self.sort_clusters[cluster_id] if i not in self.sort_processed]
+        if not members:
+            self.close_cluster_view()
+            return
+        
+        if self.cluster_window is None or not self.cluster_window.winfo_exists():
+            self.cluster_window = tk.Toplevel(self.root)
+            self.cluster_window.configure(bg='#1a1a1a')
+            self.cluster_window.geometry("900x600")
+            self.cluster_window.protocol("WM_DELETE_WINDOW", self.close_cluster_view)
+            self.cluster_window.bind('<Key>', self.on_cluster_key_press)
+        
+        if cluster_id != self.cluster_view_id:
+            self.cluster_overrides = {}
+        self.cluster_view_id = cluster_id
+        
+        win = self.cluster_window
+        for widget in win.winfo_children():
+            widget.destroy()
+        win.title(f"相似分组 {cluster_id + 1} / {len(self.sort_clusters)}")
+        
+        tk.Label(win, text=f"分组 {cluster_id + 1}: {len(members)} 张未处理\n"
+                           f"B 背景  H 人物  T 背景+人物  S 跳过  |  点击图片排除/恢复  右键单独标注  |  ← → 切换分组  Esc 关闭",
+                bg='#1a1a1a', fg='white', font=('Microsoft YaHei', 10)).pack(pady=8)
+        
+        grid = tk.Frame(win, bg='#2d2d2d')
+        grid.pack(fill='both', expand=True, padx=10, pady=(0, 10))
+        
+        # Cut sheet by sheet so each sheet the grid needs is decoded once, whatever the sheet cache holds.
+        # The grid keeps its own references: Tk deletes a tile the gallery's LRU drops.
+        by_sheet = {}
+        for index in members:
+            tile = self.sort_thumbnail_tiles.get(os.path.basename(self.sort_images[index]))
+            by_sheet.setdefault(tile[0] if tile else None, []).append(index)
+        self.cluster_photos = {index: self.thumbnail_tile_photo(index, wait=True)
+                               for indices in by_sheet.values() for index in indices}
+        
+        columns = 8
+        for n, index in enumerate(members):
+            photo = self.cluster_photos[index]
+            if photo is None:
+                continue
+            override = self.cluster_overrides.get(index)
+            cell = tk.Button(grid, image=photo,
+                             text={'exclude': '排除', 'background': '背景', 'human': '人物',
+                                   'both': '背景+人物', 'skip': '跳过'}.get(override, ''),
+                             compound='top', fg='white', font=('Microsoft YaHei', 8),
+                             bg='#F44336' if override == 'exclude' else
+                                ('#FFC107' if override else '#404040'),
+                             relief='solid', borderwidth=2,
+                             command=lambda idx=index: self.toggle_cluster_member(idx))
+            cell.bind('<Button-3>', lambda e, idx=index: self.cycle_cluster_override(idx))
+            cell.bind('<Button-2>', lambda e, idx=index: self.cycle_cluster_override(idx))
+            cell.grid(row=n // columns, column=n % columns, padx=3, pady=3)
+        
+        win.focus_set()
+    
+    def close_cluster_view(self):
+        """Close the group grid"""
+        if self.cluster_window is not None:
+            try:
+                self.cluster_window.destroy()
+            except tk.TclError:
+                pass
+        self.cluster_window = None
+        self.cluster_view_id = None
+        self.cluster_overrides = {}
+        self.cluster_photos = {}
+        self.root.focus_set()
+    
+    def toggle_cluster_member(self, index):
+        """Exclude a member from (or bring it back into) the group action"""
+        if self.cluster_overrides.get(index) == 'exclude':
+            del self.cluster_overrides[index]
+        else:
+            self.cluster_overrides[index] = 'exclude'
+        self.open_cluster_view(self.cluster_view_id)
+    
+    def cycle_cluster_override(self, index):
+        """Give one member its own label, overriding the group key"""
+        order = [None, 'background', 'human', 'both', 'skip']
+        current = self.cluster_overrides.get(index)
+        following = order[(order.index(current) + 1) % len(order)] if current in order else 'background'
+        if following is None:
+            self.cluster_overrides.pop(index, None)
+        else:
+            self.cluster_overrides[index] = following
+        self.open_cluster_view(self.cluster_view_id)
+    
+    def on_cluster_key_press(self, event):
+        """Keyboard shortcuts of the group grid"""
+        key = event.keysym.lower()
+        if key in ('b', 'h', 't', 's'):
+            self.classify_cluster({'b': 'background', 'h': 'human', 't': 'both', 's': 'skip'}[key])
+        elif key in ('left', 'right'):
+            self.step_cluster_view(-1 if key == 'left' else 1)
+        elif key == 'u':
+            self.undo_sort_action()
+            self.open_cluster_view(self.cluster_view_id)
+        elif key == 'escape':
+            self.close_cluster_view()
+    
+    def step_cluster_view(self, step):
+        """Move the grid to the next cluster in the given direction that still has work"""
+        count = len(self.sort_clusters)
+        cluster_id = self.cluster_view_id
+        for _ in range(count):
+            cluster_id = (cluster_id + step) % count
+            if any(i not in self.sort_processed for i in self.sort_clusters[cluster_id]):
+                self.open_cluster_view(cluster_id)
+                return
+        self.close_cluster_view()
+    
+    def classify_cluster(self, save_type):
+        """Sort all shown members of the group with one key, as a single undoable action"""
+        if self.cluster_view_id is None:
+            return
+        
+        items = []
+        for index in self.sort_clusters[self.cluster_view_id]:
+            override = self.cluster_overrides.get(index)
+            if index in self.sort_processed or override == 'exclude':
+                continue
+            item_type = override or save_type
+            items.append({'filename': os.path.basename(self.sort_images[index]),
+                          'save_type': item_type,
+                          'strategy': None if item_type == 'skip'
+                          else self.sort_settings['materialise_strategy']})
+        if not items:
+            return
+        
+        if any(item['save_type'] in ('human', 'both') for item in items):
+            self.continue_crop_btn.config(state='normal')
+        self.sort_current_index = self.sort_index_by_name[items[0]['filename']]
+        self.record_sort_action(items)
+        
+        # Excluded members stay in the grid, otherwise continue with the next group
+        if any(i not in self.sort_processed for i in self.sort_clusters[self.cluster_view_id]):
+            self.open_cluster_view(self.cluster_view_id)
+        else:
+            self.step_cluster_view(1)
+    
+    def confirm_predictions(self):
+        """Sort every unprocessed, confidently pre-labelled image as one undoable action"""
+        items = []
+        for i, image_path in enumerate(self.sort_images):
+            filename = os.path.basename(image_path)
+            label = self.predicted_sort_label(filename)
+            if label and i not in self.sort_processed:
+                items.append({'filename': filename, 'save_type': label,
+                              'strategy': self.sort_settings['materialise_strategy']})
+        
+        if not items:
+            messagebox.showinfo("提示", "没有可确认的预标注图像")
+            return
+        
+        humans = sum(1 for item in items if item['save_type'] == 'human')
+        if not messagebox.askyesno("确认预标注",
+                                   f"将按预标注分类 {len(items)} 张图像：\n"
+                                   f"人物: {humans} 张\n背景: {len(items) - humans} 张\n\n"
+                                   f"可以用撤销一次性恢复。"):
+            return
+        
+        if humans:
+            self.continue_crop_btn.config(state='normal')
+        self.record_sort_action(items)
 
     def scroll_gallery_to_current(self):
         """Scroll thumbnail gallery to show current image"""
-        if not self.sort_thumbnails:
+        order = self.get_gallery_order()
+        if not order:
             return
         
-        # Calculate position of current thumbnail
-        thumb_width = 106  # 100px image + 6px padding
-        current_position = self.sort_current_index * thumb_width
+        # Calculate position of current thumbnail, processed images take no cell
+        thumb_width = GALLERY_CELL[0]
+        current_position = (bisect.bisect_left(order, self.sort_current_index) + 0.5) * thumb_width
         
         # Get canvas viewport info
         canvas_width = self.thumbnail_canvas.winfo_width()
         
         # Calculate scroll position to center current thumbnail
-        scroll_to = (current_position - canvas_width/2) / (len(self.sort_thumbnails) * thumb_width)
+        scroll_to = (current_position - canvas_width/2) / (len(order) * thumb_width)
         scroll_to = max(0, min(1, scroll_to))  # Clamp between 0 and 1
         
         # Move scrollbar
         self.thumbnail_canvas.xview_moveto(scroll_to)
     
-    def save_sorted_image(self, save_type):
-        """Save image to specified folder(s)"""
-        if not self.sort_images:
-            return
+    def plan_sort_files(self, filename, save_type, strategy):
+        """Return the (folder type, destination, strategy) files a sort decision produces"""
+        plan = []
+        if save_type in ['background', 'both']:
+            plan.append(('background', os.path.join(self.sort_background_folder, filename), strategy))
+            if strategy == 'move':
+                # The second copy of "both" is linked from the moved file
+                strategy = 'auto'
+        if save_type in ['human', 'both']:
+            plan.append(('human', os.path.join(self.sort_human_folder, filename), strategy))
+        return plan
+    
+    def apply_sort_item(self, item):
+        """Queue the file operations for one sort decision and mark the image processed"""
+        if item.get('replaces'):
+            # Re-classified: the earlier decision's files go first
+            self.revert_sort_item(item['replaces'])
+        index = self.sort_index_by_name[item['filename']]
+        current_path = self.get_sort_image_path(index)
+        item['saved_files'] = []
         
-        current_path = self.sort_images[self.sort_current_index]
-        filename = os.path.basename(current_path)
+        # Only the intent is recorded here, the worker does the file I/O in order
+        for folder_type, dest, strategy in self.plan_sort_files(
+                item['filename'], item['save_type'], item['strategy']):
+            op_id = self.sort_file_queue.apply(folder_type, current_path, dest, strategy)
+            item['saved_files'].append((folder_type, dest, strategy, op_id))
+            if folder_type == 'background':
+                self.sort_background_files.add(item['filename'])
+            else:
+                self.sort_human_files.add(item['filename'])
+            if strategy == 'move':
+                current_path = dest
         
-        # Store for undo
-        self.sort_last_action = {
-            'index': self.sort_current_index,
-            'filename': filename,
-            'save_type': save_type,
-            'saved_files': []
-        }
+        if current_path != self.sort_images[index]:
+            self.sort_relocated[index] = current_path
+        self.sort_processed.add(index)
+        self.gallery_order = None
+    
+    def revert_sort_item(self, item):
+        """Queue reverting one sort decision and mark the image unprocessed"""
+        index = self.sort_index_by_name[item['filename']]
+        
+        # Revert saved files, derived copies first so a moved original can go back.
+        # Operations the worker has not started yet are simply cancelled.
+        for folder_type, file_path, strategy, op_id in reversed(item.get('saved_files', [])):
+            self.sort_file_queue.revert(op_id, file_path, strategy, self.sort_images[index])
+            if folder_type == 'background':
+                self.sort_background_files.discard(item['filename'])
+            else:
+                self.sort_human_files.discard(item['filename'])
         
+        self.sort_relocated.pop(index, None)
+        self.sort_processed.discard(index)
+        self.gallery_order = None
+        if item.get('replaces'):
+            self.apply_sort_item(item['replaces'])
+    
+    def latest_sort_item(self, filename):
+        """The applied item currently deciding an image, None if there is none"""
+        for items in reversed(self.sort_undo_stack):
+            for item in items:
+                if item['filename'] == filename:
+                    return item
+        return None
+    
+    def record_sort_action(self, items):
+        """Apply a new sort action, log it and make it undoable"""
+        if self.sort_indexer:
+            # The session is resumed once the listing is complete, actions wait for that
+            self.sort_info_label.configure(text="正在读取文件夹，请稍候再分类...")
+            return
+        for item in items:
+            if self.sort_index_by_name[item['filename']] not in self.sort_processed:
+                continue
+            # Re-classifying reverts the earlier decision in the same undoable action
+            previous = self.latest_sort_item(item['filename'])
+            if previous is None or 'move' in (previous['strategy'], item['strategy']):
+                # A moved image would be its own source and destination, the earlier decision is undone first
+                self.sort_info_label.configure(text="移动模式下已分类的图像，如需更改请先撤销")
+                return
+            if previous['save_type'] == item['save_type']:
+                return
+            item['replaces'] = previous
         try:
-            if save_type in ['background', 'both']:
-                dest = os.path.join(self.sort_background_folder, filename)
-                shutil.copy2(current_path, dest)
-                self.sort_last_action['saved_files'].append(('background', dest))
-            
-            if save_type in ['human', 'both']:
-                dest = os.path.join(self.sort_human_folder, filename)
-                shutil.copy2(current_path, dest)
-                self.sort_last_action['saved_files'].append(('human', dest))
-                if hasattr(self, 'continue_crop_btn'):
-                    self.continue_crop_btn.config(state='normal')
+            self.sort_file_queue.begin_batch()
+            try:
+                for item in items:
+                    self.apply_sort_item(item)
+            finally:
+                self.sort_file_queue.end_batch()
             
-            self.sort_processed.add(self.sort_current_index)
-            self.sort_undo_btn.config(state='normal')
+            self.sort_undo_stack.append(items)
+            self.sort_redo_stack = []
+            self.sort_session.append({'op': 'action', 'items': [self.session_item(item) for item in items]})
+            self.catalog_sort_items(items, applied=True)
+            self.sort_action_seq += 1
+            self.update_sort_buttons()
             self.update_sort_progress()
+            self.update_sort_pending()
             self.advance_to_next_unprocessed()
             
         except Exception as e:
+            self.sort_action_seq += 1
             messagebox.showerror("错误", f"保存失败: {str(e)}")
     
+    def session_item(self, item):
+        """Session log form of a sort item, a re-classification names no more than that"""
+        entry = {'file': item['filename'], 'type': item['save_type'], 'strategy': item['strategy']}
+        if item.get('replaces'):
+            entry['replaces'] = True
+        return entry
+    
+    def save_sorted_image(self, save_type):
+        """Save image to specified folder(s)"""
+        if not self.sort_images:
+            return
+        
+        if save_type in ['human', 'both'] and hasattr(self, 'continue_crop_btn'):
+            self.continue_crop_btn.config(state='normal')
+        
+        self.record_sort_action([{
+            'filename': os.path.basename(self.sort_images[self.sort_current_index]),
+            'save_type': save_type,
+            'strategy': self.sort_settings['materialise_strategy']
+        }])
+    
     def skip_sort_image(self):
         """Skip current image"""
-        self.sort_last_action = {
-            'index': self.sort_current_index,
+        if not self.sort_images:
+            return
+        
+        self.record_sort_action([{
             'filename': os.path.basename(self.sort_images[self.sort_current_index]),
             'save_type': 'skip',
-            'saved_files': []
-        }
-        
-        self.sort_processed.add(self.sort_current_index)
-        self.sort_undo_btn.config(state='normal')
-        self.update_sort_progress()
-        self.advance_to_next_unprocessed()
+            'strategy': None
+        }])
     
     def undo_sort_action(self):
-        """Undo last sorting action"""
-        if not self.sort_last_action:
+        """Undo last sorting action, repeatable back to the start of the session"""
+        if not self.sort_undo_stack:
             return
         
         try:
-            # Remove saved files
-            for folder_type, file_path in self.sort_last_action['saved_files']:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            
-            # Remove from processed
-            if self.sort_last_action['index'] in self.sort_processed:
-                self.sort_processed.remove(self.sort_last_action['index'])
+            items = self.sort_undo_stack.pop()
+            self.sort_file_queue.begin_batch()
+            try:
+                for item in reversed(items):
+                    self.revert_sort_item(item)
+            finally:
+                self.sort_file_queue.end_batch()
+            self.sort_redo_stack.append(items)
+            self.sort_session.append({'op': 'undo'})
+            self.catalog_sort_items(items, applied=False)
+            self.sort_action_seq += 1
             
             # Go back to that image
-            self.sort_current_index = self.sort_last_action['index']
+            self.sort_current_index = self.sort_index_by_name[items[0]['filename']]
             self.display_sort_image()
             self.update_sort_progress()
-            
-            # Disable undo
-            self.sort_undo_btn.config(state='disabled')
-            self.sort_last_action = None
+            self.update_sort_pending()
+            self.update_sort_buttons()
             
         except Exception as e:
             messagebox.showerror("错误", f"撤销失败: {str(e)}")
     
+    def redo_sort_action(self):
+        """Re-apply the most recently undone action"""
+        if not self.sort_redo_stack:
+            return
+        
+        try:
+            items = self.sort_redo_stack.pop()
+            self.sort_file_queue.begin_batch()
+            try:
+                for item in items:
+                    self.apply_sort_item(item)
+            finally:
+                self.sort_file_queue.end_batch()
+            self.sort_undo_stack.append(items)
+            self.sort_session.append({'op': 'redo'})
+            self.catalog_sort_items(items, applied=True)
+            self.sort_action_seq += 1
+            
+            self.sort_current_index = self.sort_index_by_name[items[-1]['filename']]
+            self.update_sort_progress()
+            self.update_sort_pending()
+            self.update_sort_buttons()
+            self.advance_to_next_unprocessed()
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"重做失败: {str(e)}")
+    
+    def update_sort_buttons(self):
+        """Enable undo/redo according to the history stacks"""
+        self.sort_undo_btn.config(state='normal' if self.sort_undo_stack else 'disabled')
+        self.sort_redo_btn.config(state='normal' if self.sort_redo_stack else 'disabled')
+    
+    def restore_sort_session(self, folder_path):
+        """Replay the folder's session log into processed state, history and cursor"""
+        undo_stack, redo_stack, cursor = self.sort_session.load()
+        
+        # Images sorted in move mode are no longer in the keyframe folder but belong to the session
+        known = set(self.sort_index_by_name)
+        missing = {entry['file'] for items in undo_stack for entry in items
+                   if entry['strategy'] == 'move' and entry['file'] not in known}
+        if missing:
+            self.sort_images = sorted(self.sort_images + [os.path.join(folder_path, name) for name in missing],
+                                      key=lambda path: natural_sort_key(os.path.basename(path)))
+            self.sort_index_by_name = {os.path.basename(p): i for i, p in enumerate(self.sort_images)}
+        
+        def to_items(stack):
+            return [[{'filename': entry['file'], 'save_type': entry['type'],
+                      'strategy': entry['strategy'], 'saved_files': [], 'replaces': entry.get('replaces')}
+                     for entry in items if entry['file'] in self.sort_index_by_name]
+                    for items in stack]
+        
+        self.sort_undo_stack = [items for items in to_items(undo_stack) if items]
+        self.sort_redo_stack = [items for items in to_items(redo_stack) if items]
+        
+        # A re-classification replaces the item that decided the image before it, in the order applied
+        latest = {}
+        for items in self.sort_undo_stack + self.sort_redo_stack[::-1]:
+            for item in items:
+                if item['replaces']:
+                    item['replaces'] = latest.get(item['filename'])
+                latest[item['filename']] = item
+        
+        # The files already exist, only the in-memory state is rebuilt
+        for items in self.sort_undo_stack:
+            for item in items:
+                index = self.sort_index_by_name[item['filename']]
+                self.sort_processed.add(index)
+                self.gallery_order = None
+                # Reverting a resumed item has no queued op to cancel, only the plan
+                item['saved_files'] = [plan + (None,) for plan in self.plan_sort_files(
+                    item['filename'], item['save_type'], item['strategy'])]
+                if item['saved_files'] and item['strategy'] == 'move':
+                    self.sort_relocated[index] = item['saved_files'][-1][1]
+        
+        if cursor in self.sort_index_by_name:
+            self.sort_current_index = self.sort_index_by_name[cursor]
+        
+        # Resume on the first unprocessed image at or after the cursor
+        for i in range(self.sort_current_index, len(self.sort_images)):
+            if i not in self.sort_processed:
+                self.sort_current_index = i
+                break
+        
+        # Keep the log proportional to the live history
+        self.sort_session.compact_if_needed(
+            [[self.session_item(item) for item in items] for items in self.sort_undo_stack],
+            [[self.session_item(item) for item in items] for items in self.sort_redo_stack],
+            cursor)
+    
+    def schedule_cursor_save(self):
+        """Remember the current image in the session once navigation settles"""
+        if self.sort_cursor_job is not None:
+            self.root.after_cancel(self.sort_cursor_job)
+        self.sort_cursor_job = self.root.after(2000, self.save_sort_cursor)
+    
+    def save_sort_cursor(self):
+        """Append the current image to the session log"""
+        self.sort_cursor_job = None
+        if self.sort_images and self.sort_session:
+            self.sort_session.append({'op': 'cursor',
+                                      'file': os.path.basename(self.sort_images[self.sort_current_index])})
+    
     def previous_sort_image(self):
         """Go to previous image"""
         if self.sort_current_index > 0:
@@ -1013,12 +6334,8 @@ S 跳过当前"""
 
     def refresh_gallery_visibility(self):
         """Hide processed thumbnails from gallery"""
-        for i, thumb in enumerate(self.sort_thumbnails):
-            if i in self.sort_processed:
-                thumb.pack_forget()
-        # Update scroll region after hiding
-        self.thumbnail_frame.update_idletasks()
-        self.thumbnail_canvas.configure(scrollregion=self.thumbnail_canvas.bbox("all"))
+        self.gallery_order = None
+        self.schedule_gallery_render()
     
     def advance_to_next_unprocessed(self):
         """Move to next unprocessed image"""
@@ -1050,14 +6367,9 @@ S 跳过当前"""
             total = len(self.sort_images)
             remaining = total - processed
             
-            # Count files
-            self.background_count = len([f for f in os.listdir(self.sort_background_folder)
-                                        if f.lower().endswith(('.jpg', '.jpeg', '.png'))]) \
-                                        if os.path.exists(self.sort_background_folder) else 0
-            
-            self.human_count = len([f for f in os.listdir(self.sort_human_folder)
-                                  if f.lower().endswith(('.jpg', '.jpeg', '.png'))]) \
-                                  if os.path.exists(self.sort_human_folder) else 0
+            # Counts come from memory, no folder listing on the hot path
+            self.background_count = len(self.sort_background_files)
+            self.human_count = len(self.sort_human_files)
             
             if self.human_count > 0 and hasattr(self, 'continue_crop_btn'):
                 self.continue_crop_btn.config(state='normal')
@@ -1065,11 +6377,120 @@ S 跳过当前"""
             self.sort_progress_label.config(
                 text=f"总计: {total} | 已处理: {processed} | 剩余: {remaining} | 背景: {self.background_count} | 人物: {self.human_count}")
     
+    def on_sort_file_op(self, op, error):
+        """Worker callback, hands the result over to the Tk thread"""
+        self.root.after(0, lambda: self.sort_file_op_finished(op, error))
+    
+    def sort_file_op_finished(self, op, error):
+        """Update pending depth and roll back counters of failed operations"""
+        if error is not None and op['kind'] == 'apply':
+            filename = os.path.basename(op['dst'])
+            if os.path.dirname(op['dst']) == self.sort_background_folder:
+                self.sort_background_files.discard(filename)
+            elif os.path.dirname(op['dst']) == self.sort_human_folder:
+                self.sort_human_files.discard(filename)
+            self.sort_action_seq += 1
+            self.update_sort_progress()
+            messagebox.showerror("错误", f"保存失败: {filename}\n{str(error)}")
+        elif error is not None:
+            messagebox.showerror("错误", f"撤销失败: {str(error)}")
+        
+        self.update_sort_pending()
+    
+    def update_sort_pending(self):
+        """Show how many file operations are still waiting for the worker"""
+        depth = self.sort_file_queue.depth() if self.sort_file_queue else 0
+        self.sort_pending_label.config(text=f"待写入: {depth}" if depth else "")
+    
+    def retry_load_sorting_folder(self):
+        """Open the folder asked for while the previous one was still writing"""
+        folder_path, self.sort_folder_waiting = self.sort_folder_waiting, None
+        if folder_path:
+            self.load_sorting_folder(folder_path)
+    
+    def flush_sort_file_queue(self, then, deadline=None):
+        """Call then() once queued sort file operations are written, giving up after 60 seconds"""
+        if deadline is None:
+            deadline = time.monotonic() + 60
+        if 1 in self.tabs_built and self.sort_file_queue and self.sort_file_queue.depth():
+            self.update_sort_pending()
+            if time.monotonic() < deadline:
+                self.root.after(100, lambda: self.flush_sort_file_queue(then, deadline))
+                return
+        if 1 in self.tabs_built:
+            self.update_sort_pending()
+        then()
+    
+    def scan_sorted_folder(self, folder):
+        """Return the set of image filenames currently in an output folder"""
+        if not folder or not os.path.isdir(folder):
+            return set()
+        with os.scandir(folder) as entries:
+            return {entry.name for entry in entries
+                    if entry.name.lower().endswith(('.jpg', '.jpeg', '.png'))}
+    
+    def schedule_sort_reconcile(self):
+        """Schedule the next low-frequency recount of the output folders"""
+        if self.sort_reconcile_job is not None:
+            self.root.after_cancel(self.sort_reconcile_job)
+            self.sort_reconcile_job = None
+        
+        interval = self.sort_settings.get('reconcile_interval_ms', 0)
+        if interval > 0:
+            self.sort_reconcile_job = self.root.after(interval, self.start_sort_reconcile)
+    
+    def start_sort_reconcile(self):
+        """Recount output folders on a worker thread to pick up external changes"""
+        self.sort_reconcile_job = None
+        if (self.sort_reconcile_running or not self.sort_images
+                or self.sort_file_queue.depth()):
+            self.schedule_sort_reconcile()
+            return
+        
+        self.sort_reconcile_running = True
+        background_folder = self.sort_background_folder
+        human_folder = self.sort_human_folder
+        action_seq = self.sort_action_seq
+        
+        def worker():
+            try:
+                background_files = self.scan_sorted_folder(background_folder)
+                human_files = self.scan_sorted_folder(human_folder)
+            except OSError as e:
+                print(f"Error reconciling sorted folders: {e}")
+                background_files = human_files = None
+            self.root.after(0, lambda: self.finish_sort_reconcile(
+                background_folder, human_folder, action_seq, background_files, human_files))
+        
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+    
+    def finish_sort_reconcile(self, background_folder, human_folder, action_seq,
+                              background_files, human_files):
+        """Apply a recount unless the folders or the counters changed meanwhile"""
+        self.sort_reconcile_running = False
+        
+        # Discard results that raced with a folder switch or a sort action
+        if (background_files is not None
+                and background_folder == self.sort_background_folder
+                and human_folder == self.sort_human_folder
+                and action_seq == self.sort_action_seq
+                and not self.sort_file_queue.depth()):
+            if (background_files != self.sort_background_files
+                    or human_files != self.sort_human_files):
+                self.sort_background_files = background_files
+                self.sort_human_files = human_files
+                self.update_sort_progress()
+        
+        self.schedule_sort_reconcile()
+    
     # Cropping methods
     def load_current_human_folder(self):
         """Load current project's human folder for cropping"""
-        if self.current_workflow['human_folder']:
-            self.load_cropping_folder(self.current_workflow['human_folder'])
+        folder = self.current_workflow['human_folder']
+        if folder:
+            self.flush_sort_file_queue(lambda: self.load_cropping_folder(folder))
     
     def load_crop_folder(self):
         """Manually select folder for cropping"""
@@ -1079,6 +6500,7 @@ S 跳过当前"""
     
     def load_cropping_folder(self, folder_path):
         """Load images for cropping"""
+        self.ensure_tab(2)
         if not os.path.exists(folder_path):
             messagebox.showerror("错误", "文件夹不存在")
             return
@@ -1095,27 +6517,71 @@ S 跳过当前"""
             self.crop_output_folder = os.path.join(parent_dir, "Cropped_Figures")
         os.makedirs(self.crop_output_folder, exist_ok=True)
         
+        self.crop_recipes = CropRecipeStore(self.crop_output_folder)
+        
         # Update workflow
         self.current_workflow['cropped_folder'] = self.crop_output_folder
         
-        # Load images
         self.crop_images = []
-        for filename in sorted(os.listdir(folder_path)):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
-                self.crop_images.append(os.path.join(folder_path, filename))
+        self.crop_folder_path = folder_path
+        self.crop_current_index = 0
+        self.crop_count = 0
+        self.crop_failed = 0
+        self.crop_image_cache.clear()
+        self.crop_pyramid.clear()
+        self.stop_crop_proposals()
+        self.crop_proposals = self.load_crop_proposals()
+        self.crop_detect_btn.config(state='disabled')
+        self.crop_export_btn.config(state='disabled')
+        
+        # Images are listed on a background thread, the first one is shown as soon as it is found
+        if self.crop_indexer:
+            self.crop_indexer.stop()
+        indexer = FolderIndexer(
+            folder_path, ('.jpg', '.jpeg', '.png', '.bmp'),
+            on_batch=lambda names: self.root.after(0, lambda: self.crop_index_batch(indexer, names)),
+            on_done=lambda error: self.root.after(0, lambda: self.crop_index_done(indexer, error)),
+            include_references=False)
+        self.crop_indexer = indexer
+        self.crop_status.config(text="正在读取文件夹...")
+        indexer.start()
+    
+    def crop_index_batch(self, indexer, names):
+        """Merge newly listed images in natural order, keeping the current image in view"""
+        if indexer is not self.crop_indexer:
+            return
+        known = {os.path.basename(path) for path in self.crop_images}
+        new = [name for name in set(names) if name not in known]
+        if not new:
+            return
+        current = os.path.basename(self.crop_images[self.crop_current_index]) if self.crop_images else None
+        merged = sorted(list(known) + new, key=natural_sort_key)
+        self.crop_images = [os.path.join(self.crop_folder_path, name) for name in merged]
         
+        if current is None:
+            self.display_crop_image()
+            # Enable controls
+            self.crop_prev_btn.config(state='normal')
+            self.crop_next_btn.config(state='normal')
+            self.crop_save_btn.config(state='normal')
+        else:
+            self.crop_current_index = merged.index(current)
+            self.update_crop_status()
+    
+    def crop_index_done(self, indexer, error):
+        """Folder fully listed: enable the whole-folder actions"""
+        if indexer is not self.crop_indexer:
+            return
+        self.crop_indexer = None
+        if error is not None:
+            messagebox.showerror("错误", f"无法读取文件夹: {str(error)}")
         if not self.crop_images:
+            self.crop_status.config(text="")
             messagebox.showwarning("警告", "未找到图像文件")
             return
-        
-        self.crop_current_index = 0
-        self.crop_count = 0
-        self.display_crop_image()
-        
-        # Enable controls
-        self.crop_prev_btn.config(state='normal')
-        self.crop_next_btn.config(state='normal')
-        self.crop_save_btn.config(state='normal')
+        self.update_crop_status()
+        self.crop_detect_btn.config(state='normal')
+        self.crop_export_btn.config(state='normal')
     
     def display_crop_image(self):
         """Display current image for cropping"""
@@ -1124,71 +6590,538 @@ S 跳过当前"""
         
         try:
             image_path = self.crop_images[self.crop_current_index]
-            self.current_crop_image = Image.open(image_path)
-            
-            # Calculate display size
-            canvas_width = self.crop_canvas.winfo_width()
-            canvas_height = self.crop_canvas.winfo_height()
-            
-            if canvas_width <= 1:
-                canvas_width = 800
-                canvas_height = 600
-            
-            # Calculate scale
-            scale_x = canvas_width / self.current_crop_image.width
-            scale_y = canvas_height / self.current_crop_image.height
-            self.crop_scale_factor = min(scale_x, scale_y, 1.0)
-            
-            new_width = int(self.current_crop_image.width * self.crop_scale_factor)
-            new_height = int(self.current_crop_image.height * self.crop_scale_factor)
-            
-            # Resize for display
-            display_image = self.current_crop_image.resize((new_width, new_height),
-                                                          Image.Resampling.LANCZOS)
-            
-            self.crop_photo = ImageTk.PhotoImage(display_image)
             
             # Clear and display
             self.crop_canvas.delete("all")
-            self.crop_canvas.create_image(0, 0, anchor='nw', image=self.crop_photo)
+            self.crop_rect = None
+            self.crop_image_item = None
+            self.crop_tiles = {}
+            self.crop_zoom = 1.0
+            self.crop_canvas.xview_moveto(0)
+            self.crop_canvas.yview_moveto(0)
+            self.render_crop_view(high_quality=True)
             
-            # Update status
-            filename = os.path.basename(image_path)
-            self.crop_status.config(
-                text=f"{filename} ({self.crop_current_index + 1}/{len(self.crop_images)})")
-            self.crop_info.config(text=f"已裁剪: {self.crop_count} 张")
+            # Neighbours are likely next, have them rendered before they are asked for
+            neighbours = [self.crop_images[i] for i in (self.crop_current_index + 1,
+                                                       self.crop_current_index - 1,
+                                                       self.crop_current_index + 2)
+                          if 0 <= i < len(self.crop_images)]
+            self.crop_image_cache.prefetch(neighbours, self.crop_canvas_box())
+            
+            self.update_crop_status()
+            self.update_crop_info()
             
         except Exception as e:
             messagebox.showerror("错误", f"无法显示图像: {str(e)}")
     
-    def start_crop(self, event):
-        """Start drawing crop rectangle"""
-        self.crop_start_x = event.x
-        self.crop_start_y = event.y
+    def update_crop_status(self):
+        """Filename, position and zoom of the crop view"""
+        filename = os.path.basename(self.crop_images[self.crop_current_index])
+        text = f"{filename} ({self.crop_current_index + 1}/{len(self.crop_images)})"
+        if self.crop_zoom > 1.0:
+            text += f"  {self.crop_scale_factor * 100:.0f}%"
+        if self.crop_indexer:
+            text += "  正在读取文件夹..."
+        self.crop_status.config(text=text)
+    
+    def crop_canvas_box(self):
+        """Current crop canvas size, with a default before the window is mapped"""
+        canvas_width = self.crop_canvas.winfo_width()
+        canvas_height = self.crop_canvas.winfo_height()
+        if canvas_width <= 1:
+            canvas_width = 800
+            canvas_height = 600
+        return canvas_width, canvas_height
+    
+    def render_crop_view(self, high_quality=True, anchor=None):
+        """Draw the current crop image at the fit scale times crop_zoom, keeping overlays in place.
         
-        if self.crop_rect:
-            self.crop_canvas.delete(self.crop_rect)
+        At fit scale the whole frame is one cached render; zoomed in, the canvas
+        scrolls over a full-size region and only visible pyramid tiles are drawn.
+        anchor is (canvas x, canvas y, original x, original y) to keep under the pointer.
+        """
+        image_path = self.crop_images[self.crop_current_index]
+        original_size = self.crop_image_cache.original_size(image_path)
+        old_scale = self.crop_scale_factor
+        fit, size = fit_scale(original_size, self.crop_canvas_box())
+        self.crop_scale_factor = fit * self.crop_zoom
+        self.current_crop_size = original_size
         
-        self.crop_rect = self.crop_canvas.create_rectangle(
-            event.x, event.y, event.x, event.y,
-            outline='red', width=2
-        )
+        if self.crop_zoom > 1.0:
+            size = (int(round(original_size[0] * self.crop_scale_factor)),
+                    int(round(original_size[1] * self.crop_scale_factor)))
+        self.crop_canvas.config(scrollregion=(0, 0, size[0], size[1]))
+        if anchor:
+            x, y, ox, oy = anchor
+            self.crop_canvas.xview_moveto((ox * self.crop_scale_factor - x) / size[0])
+            self.crop_canvas.yview_moveto((oy * self.crop_scale_factor - y) / size[1])
+        
+        if self.crop_zoom > 1.0:
+            if self.crop_image_item is not None:
+                self.crop_canvas.delete(self.crop_image_item)
+                self.crop_image_item = None
+            self.update_crop_tiles()
+        else:
+            self.clear_crop_tiles()
+            display_image = self.crop_image_cache.render(image_path, size, high_quality)
+            self.current_crop_image = display_image
+            self.crop_photo = ImageTk.PhotoImage(display_image)
+            
+            if self.crop_image_item is None:
+                self.crop_image_item = self.crop_canvas.create_image(0, 0, anchor='nw', image=self.crop_photo)
+            else:
+                self.crop_canvas.itemconfig(self.crop_image_item, image=self.crop_photo)
+            self.crop_canvas.tag_lower(self.crop_image_item)
+        
+        # Overlays live in original pixels, a rescale only changes their canvas position
+        if self.crop_rect and old_scale != self.crop_scale_factor:
+            ratio = self.crop_scale_factor / old_scale
+            self.crop_canvas.coords(self.crop_rect,
+                                    *[v * ratio for v in self.crop_canvas.coords(self.crop_rect)])
+        self.draw_crop_proposals()
+    
+    def crop_visible_region(self):
+        """Visible part of the scroll region, in canvas coordinates"""
+        width, height = self.crop_canvas_box()
+        x1 = self.crop_canvas.canvasx(0)
+        y1 = self.crop_canvas.canvasy(0)
+        return x1, y1, x1 + width, y1 + height
+    
+    def update_crop_tiles(self):
+        """Show the tiles covering the visible region, with a quick preview under any still missing"""
+        image_path = self.crop_images[self.crop_current_index]
+        x1, y1, x2, y2 = self.crop_visible_region()
+        grid = self.crop_pyramid.tile_grid(image_path, self.current_crop_size,
+                                           self.crop_scale_factor, (x1, y1, x2, y2))
+        self.crop_wanted_tiles = dict(grid)
+        
+        for key in list(self.crop_tiles):
+            if key not in self.crop_wanted_tiles:
+                self.crop_canvas.delete(self.crop_tiles.pop(key)[0])
+        
+        missing = []
+        for key, position in grid:
+            if key in self.crop_tiles:
+                continue
+            image = self.crop_pyramid.cached(key)
+            if image is None:
+                missing.append(key)
+            else:
+                self.place_crop_tile(key, image)
+        
+        self.crop_canvas.delete('crop_base')
+        if missing:
+            self.draw_crop_preview(image_path, x1, y1, x2, y2)
+            self.crop_pyramid.request(missing)
+    
+    def draw_crop_preview(self, image_path, x1, y1, x2, y2):
+        """Upscale the fit-size decode over the visible region until full tiles arrive"""
+        scale = self.crop_scale_factor
+        width, height = self.current_crop_size
+        x1, y1 = max(0, int(x1)), max(0, int(y1))
+        x2, y2 = min(int(round(width * scale)), int(x2)), min(int(round(height * scale)), int(y2))
+        if x2 <= x1 or y2 <= y1:
+            return
+        _, fit_size = fit_scale(self.current_crop_size, self.crop_canvas_box())
+        decoded = self.crop_image_cache.get_decoded(image_path, fit_size)
+        ratio = decoded.width / width / scale
+        preview = decoded.resize((x2 - x1, y2 - y1), Image.Resampling.BILINEAR,
+                                 box=(x1 * ratio, y1 * ratio, x2 * ratio, y2 * ratio))
+        self.crop_preview_photo = ImageTk.PhotoImage(preview)
+        item = self.crop_canvas.create_image(x1, y1, anchor='nw', image=self.crop_preview_photo,
+                                             tags='crop_base')
+        self.crop_canvas.tag_lower(item)
+    
+    def place_crop_tile(self, key, image):
+        photo = ImageTk.PhotoImage(image)
+        x, y = self.crop_wanted_tiles[key]
+        item = self.crop_canvas.create_image(x, y, anchor='nw', image=photo)
+        self.crop_canvas.tag_lower(item)
+        self.crop_canvas.tag_lower('crop_base')
+        self.crop_tiles[key] = (item, photo)
+    
+    def crop_tile_ready(self, key, image):
+        """Tile rendered by the pyramid worker, placed if the view still needs it"""
+        if key in self.crop_wanted_tiles and key not in self.crop_tiles:
+            self.place_crop_tile(key, image)
+            if all(k in self.crop_tiles for k in self.crop_wanted_tiles):
+                self.crop_canvas.delete('crop_base')
+    
+    def clear_crop_tiles(self):
+        for item, _ in self.crop_tiles.values():
+            self.crop_canvas.delete(item)
+        self.crop_canvas.delete('crop_base')
+        self.crop_tiles = {}
+        self.crop_wanted_tiles = {}
+    
+    def zoom_crop_view(self, factor, x=None, y=None):
+        """Zoom by factor around canvas point (x, y), the canvas centre by default"""
+        if not self.crop_images or self.current_crop_size is None:
+            return
+        if x is None:
+            width, height = self.crop_canvas_box()
+            x, y = width / 2, height / 2
+        fit = self.crop_scale_factor / self.crop_zoom
+        # Up to 8 screen pixels per source pixel, never below fit
+        zoom = max(1.0, min(self.crop_zoom * factor, 8.0 / fit))
+        if zoom == self.crop_zoom:
+            return
+        ox = self.crop_canvas.canvasx(x) / self.crop_scale_factor
+        oy = self.crop_canvas.canvasy(y) / self.crop_scale_factor
+        self.crop_zoom = zoom
+        try:
+            self.render_crop_view(high_quality=True, anchor=(x, y, ox, oy))
+        except Exception as e:
+            print(f"Error rendering crop image: {e}")
+        self.update_crop_status()
+    
+    def reset_crop_zoom(self):
+        if self.crop_zoom != 1.0:
+            self.zoom_crop_view(1.0 / self.crop_zoom)
+    
+    def on_crop_wheel(self, event):
+        """Mouse wheel zooms around the pointer"""
+        if event.num == 4 or getattr(event, 'delta', 0) > 0:
+            self.zoom_crop_view(1.25, event.x, event.y)
+        else:
+            self.zoom_crop_view(1 / 1.25, event.x, event.y)
+    
+    def start_crop_pan(self, event):
+        self.crop_canvas.scan_mark(event.x, event.y)
+    
+    def drag_crop_pan(self, event):
+        """Pan the zoomed view with the middle or right button"""
+        if self.crop_zoom > 1.0:
+            self.crop_canvas.scan_dragto(event.x, event.y, gain=1)
+            self.update_crop_tiles()
+    
+    def crop_event_point(self, event):
+        """Event position in canvas (scrolled) coordinates"""
+        return self.crop_canvas.canvasx(event.x), self.crop_canvas.canvasy(event.y)
+    
+    def on_crop_canvas_resize(self, event):
+        """Re-render on resize: a fast pass right away, full quality once resizing stops"""
+        size = (event.width, event.height)
+        if size == self.crop_canvas_size or not self.crop_images or self.current_crop_size is None:
+            self.crop_canvas_size = size
+            return
+        self.crop_canvas_size = size
+        
+        try:
+            self.render_crop_view(high_quality=False)
+        except Exception as e:
+            print(f"Error rendering crop image: {e}")
+            return
+        
+        if self.crop_hq_job is not None:
+            self.root.after_cancel(self.crop_hq_job)
+        self.crop_hq_job = self.root.after(250, self.finish_crop_resize)
+    
+    def finish_crop_resize(self):
+        """High quality render once the canvas size has settled"""
+        self.crop_hq_job = None
+        if self.crop_images and self.current_crop_size is not None:
+            self.render_crop_view(high_quality=True)
+    
+    def start_crop(self, event):
+        """Start drawing crop rectangle, or grab an edge of the current one"""
+        self.crop_start_x, self.crop_start_y = self.crop_event_point(event)
+        self.crop_pressed = True
+        self.crop_drag_edges = self.crop_rect_edges_at(self.crop_start_x, self.crop_start_y)
     
     def draw_crop(self, event):
         """Update crop rectangle"""
-        if self.crop_rect:
+        x, y = self.crop_event_point(event)
+        if self.crop_drag_edges:
+            x1, y1, x2, y2 = self.crop_canvas.coords(self.crop_rect)
+            left, top, right, bottom = self.crop_drag_edges
+            if left:
+                x1 = x
+            if right:
+                x2 = x
+            if top:
+                y1 = y
+            if bottom:
+                y2 = y
+            self.crop_canvas.coords(self.crop_rect, x1, y1, x2, y2)
+            return
+        
+        # A new rectangle replaces the old one only once the mouse really moves
+        if self.crop_pressed and (abs(x - self.crop_start_x) > 3 or abs(y - self.crop_start_y) > 3):
+            self.crop_pressed = False
+            if self.crop_rect:
+                self.crop_canvas.delete(self.crop_rect)
+            self.crop_rect = self.crop_canvas.create_rectangle(
+                self.crop_start_x, self.crop_start_y, x, y,
+                outline='red', width=2
+            )
+        elif not self.crop_pressed and self.crop_rect:
             self.crop_canvas.coords(
                 self.crop_rect,
                 self.crop_start_x, self.crop_start_y,
-                event.x, event.y
+                x, y
             )
     
     def end_crop(self, event):
-        """Finish drawing crop rectangle"""
-        pass
+        """Finish drawing crop rectangle, a plain click toggles a detection proposal"""
+        if self.crop_pressed and not self.crop_drag_edges:
+            proposal = self.crop_proposal_at(*self.crop_event_point(event))
+            if proposal:
+                proposal['state'] = 'rejected' if proposal['state'] == 'accepted' else 'accepted'
+                self.draw_crop_proposals()
+        self.crop_pressed = False
+        self.crop_drag_edges = None
+    
+    def canvas_box_to_original(self, x1, y1, x2, y2):
+        """Map a canvas rectangle to rounded full-resolution pixels, clamped to the image"""
+        box = [int(round(v / self.crop_scale_factor)) for v in (x1, y1, x2, y2)]
+        if self.current_crop_size:
+            width, height = self.current_crop_size
+            box = [max(0, min(width, box[0])), max(0, min(height, box[1])),
+                   max(0, min(width, box[2])), max(0, min(height, box[3]))]
+        return box
+    
+    def crop_rect_edges_at(self, x, y, margin=6):
+        """Which edges (left, top, right, bottom) of the red rectangle are under the pointer"""
+        if not self.crop_rect:
+            return None
+        coords = self.crop_canvas.coords(self.crop_rect)
+        if len(coords) != 4:
+            return None
+        x1, y1, x2, y2 = coords
+        if not (min(x1, x2) - margin <= x <= max(x1, x2) + margin
+                and min(y1, y2) - margin <= y <= max(y1, y2) + margin):
+            return None
+        edges = (abs(x - x1) <= margin, abs(y - y1) <= margin,
+                 abs(x - x2) <= margin, abs(y - y2) <= margin)
+        return edges if any(edges) else None
+    
+    def current_crop_proposals(self):
+        """Proposals of the image on the crop canvas"""
+        if not self.crop_images:
+            return []
+        return self.crop_proposals.get(os.path.basename(self.crop_images[self.crop_current_index]), [])
+    
+    def crop_proposal_at(self, x, y):
+        """Smallest proposal containing the canvas point"""
+        ox = x / self.crop_scale_factor
+        oy = y / self.crop_scale_factor
+        hits = [p for p in self.current_crop_proposals()
+                if p['box'][0] <= ox <= p['box'][2] and p['box'][1] <= oy <= p['box'][3]]
+        if not hits:
+            return None
+        return min(hits, key=lambda p: (p['box'][2] - p['box'][0]) * (p['box'][3] - p['box'][1]))
+    
+    def draw_crop_proposals(self):
+        """Overlay the current image's proposals: green accepted, yellow pending, grey rejected"""
+        self.crop_canvas.delete('proposal')
+        scale = self.crop_scale_factor
+        styles = {'accepted': ('#4CAF50', 2, ()), 'pending': ('#FFC107', 2, (6, 3)),
+                  'rejected': ('#757575', 1, (2, 4))}
+        for proposal in self.current_crop_proposals():
+            color, width, dash = styles[proposal['state']]
+            x1, y1, x2, y2 = [v * scale for v in proposal['box']]
+            self.crop_canvas.create_rectangle(x1, y1, x2, y2, outline=color, width=width,
+                                              dash=dash, tags='proposal')
+            if proposal['source'] == 'auto':
+                self.crop_canvas.create_text(x1 + 3, y1 + 2, anchor='nw', fill=color,
+                                             text=f"{proposal['score']:.2f}", tags='proposal',
+                                             font=('Microsoft YaHei', 8))
+        if self.crop_rect:
+            self.crop_canvas.tag_raise(self.crop_rect)
+        
+        accepted = sum(1 for proposals in self.crop_proposals.values()
+                       for p in proposals if p['state'] == 'accepted')
+        if accepted:
+            self.crop_info.config(text=f"已裁剪: {self.crop_count - self.crop_failed} 张 | 已接受候选框: {accepted}")
+    
+    def edit_crop_proposal(self, event):
+        """Turn a proposal into the adjustable red crop rectangle"""
+        proposal = self.crop_proposal_at(*self.crop_event_point(event))
+        if not proposal:
+            return
+        self.current_crop_proposals().remove(proposal)
+        if self.crop_rect:
+            self.crop_canvas.delete(self.crop_rect)
+        x1, y1, x2, y2 = [v * self.crop_scale_factor for v in proposal['box']]
+        self.crop_rect = self.crop_canvas.create_rectangle(x1, y1, x2, y2, outline='red', width=2)
+        self.draw_crop_proposals()
+    
+    def accept_crop_proposals(self):
+        """Add the red rectangle as an accepted proposal, or accept every pending one"""
+        if not self.crop_images:
+            return
+        filename = os.path.basename(self.crop_images[self.crop_current_index])
+        proposals = self.crop_proposals.setdefault(filename, [])
+        
+        coords = self.crop_canvas.coords(self.crop_rect) if self.crop_rect else []
+        if len(coords) == 4:
+            x1, y1, x2, y2 = coords
+            box = self.canvas_box_to_original(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+            proposals.append({'id': max([p['id'] for p in proposals], default=-1) + 1,
+                              'box': box, 'score': 1.0, 'state': 'accepted', 'source': 'manual'})
+            self.crop_canvas.delete(self.crop_rect)
+            self.crop_rect = None
+        else:
+            for proposal in proposals:
+                if proposal['state'] == 'pending':
+                    proposal['state'] = 'accepted'
+        self.draw_crop_proposals()
+    
+    def reject_crop_proposals(self):
+        """Reject every pending proposal on the current image"""
+        for proposal in self.current_crop_proposals():
+            if proposal['state'] == 'pending':
+                proposal['state'] = 'rejected'
+        self.draw_crop_proposals()
+    
+    def toggle_crop_proposals(self):
+        """Start or stop detecting person regions for every image in the crop folder"""
+        if self.crop_proposal_pass and self.crop_proposal_pass.is_running():
+            self.stop_crop_proposals()
+            return
+        if not human_detection_available():
+            messagebox.showerror("错误", "当前 OpenCV 版本不包含 HOG/Haar 人物检测器")
+            return
+        
+        # Current image first, then onwards
+        order = self.crop_images[self.crop_current_index:] + self.crop_images[:self.crop_current_index]
+        self.crop_proposal_pass = HumanDetectionPass(
+            order,
+            # Shared with the sorter's pre-classification, same filenames and file contents
+            os.path.join(os.path.dirname(self.crop_output_folder), '.autoclass_cache.json'),
+            on_results=lambda results, done, total: self.root.after(
+                0, lambda: self.crop_proposal_results(results, done, total)),
+            max_side=self.sort_settings['autoclass_max_side'])
+        self.crop_proposal_pass.start()
+        self.crop_detect_btn.config(text="停止检测")
+    
+    def stop_crop_proposals(self):
+        """Stop the proposal pass, finished detections stay cached"""
+        if self.crop_proposal_pass:
+            self.crop_proposal_pass.stop()
+            self.crop_proposal_pass = None
+        if hasattr(self, 'crop_detect_btn'):
+            self.crop_detect_btn.config(text="人物检测")
+    
+    def crop_proposal_results(self, results, done, total):
+        """Turn a batch of detections into pending proposals, keeping earlier decisions"""
+        if not self.crop_proposal_pass:
+            return
+        
+        for filename, result in results.items():
+            if filename in self.crop_proposals:
+                continue
+            self.crop_proposals[filename] = [
+                {'id': n, 'box': box[:4], 'score': round(box[4], 3), 'state': 'pending', 'source': 'auto'}
+                for n, box in enumerate(person_region_proposals(result))]
+        
+        if done >= total:
+            self.crop_proposal_pass = None
+            self.crop_detect_btn.config(text="人物检测")
+            self.save_crop_proposals()
+        else:
+            self.crop_detect_btn.config(text=f"停止检测 {done}/{total}")
+        
+        if os.path.basename(self.crop_images[self.crop_current_index]) in results:
+            self.draw_crop_proposals()
+    
+    def load_crop_proposals(self):
+        """Read proposal decisions saved for this crop output folder"""
+        try:
+            with open(os.path.join(self.crop_output_folder, '.crop_proposals.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save_crop_proposals(self):
+        """Persist proposal decisions so review work survives a restart"""
+        if not self.crop_images or not self.crop_proposals:
+            return
+        path = os.path.join(self.crop_output_folder, '.crop_proposals.json')
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.crop_proposals, f, ensure_ascii=False)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"Error saving crop proposals: {e}")
+    
+    def export_accepted_crops(self):
+        """Save every accepted proposal across the folder in one batch"""
+        folder = os.path.dirname(self.crop_images[0]) if self.crop_images else None
+        jobs = []
+        for filename, proposals in self.crop_proposals.items():
+            stem = Path(filename).stem
+            for proposal in proposals:
+                if proposal['state'] == 'accepted':
+                    jobs.append((os.path.join(folder, filename), tuple(proposal['box']),
+                                 os.path.join(self.crop_output_folder,
+                                              f"{stem}_person_{proposal['id']:02d}.jpg")))
+        
+        if not jobs:
+            messagebox.showinfo("提示", "没有已接受的候选框")
+            return
+        
+        self.save_crop_proposals()
+        self.crop_export_btn.config(state='disabled')
+        self.crop_export_batch = {'total': len(jobs), 'saved': 0, 'failed': []}
+        for source, box, output_path in jobs:
+            self.crop_writer.submit(source, box, output_path, tag='batch')
+    
+    def crop_write_finished(self, job, error):
+        """Writer callback on the Tk thread: record recipes, report failures and progress"""
+        if error is None:
+            self.record_crop_recipe(job)
+        
+        if job['tag'] == 'batch' and self.crop_export_batch:
+            batch = self.crop_export_batch
+            if error is None:
+                batch['saved'] += 1
+            else:
+                batch['failed'].append(f"{os.path.basename(job['source'])}: {error}")
+            finished = batch['saved'] + len(batch['failed'])
+            if finished >= batch['total']:
+                self.crop_export_batch = None
+                self.export_accepted_crops_done(batch['saved'], batch['failed'])
+            elif finished % 10 == 0:
+                self.crop_info.config(text=f"批量导出中: {finished}/{batch['total']}")
+            return
+        
+        if error is not None:
+            self.crop_failed += 1
+            messagebox.showerror("错误", f"保存裁剪失败: {os.path.basename(job['output'])}\n{str(error)}")
+        self.update_crop_info()
+    
+    def record_crop_recipe(self, job):
+        """Keep the rectangle behind a written crop so it can be re-exported later"""
+        try:
+            self.crop_recipes.add(job['output'], job['source'], job['source_hash'], job['box'])
+        except OSError as e:
+            print(f"Error saving crop recipe: {e}")
+        self.catalog_write(self.catalog.add_crop, self.crop_output_folder, job['output'],
+                           job['source'], job['box'])
+    
+    def update_crop_info(self, suffix=""):
+        """Crop count plus the number of crops still being written"""
+        depth = self.crop_writer.depth()
+        text = f"已裁剪: {self.crop_count - self.crop_failed} 张"
+        if depth:
+            text += f" | 写入中: {depth}"
+        if self.crop_failed:
+            text += f" | 失败: {self.crop_failed}"
+        self.crop_info.config(text=text + suffix)
+    
+    def export_accepted_crops_done(self, saved, failed):
+        """Report the batch export result"""
+        self.crop_export_btn.config(state='normal')
+        self.crop_info.config(text=f"批量导出完成: {saved} 张" + (f", 失败 {len(failed)} 张" if failed else ""))
+        if failed:
+            messagebox.showerror("错误", "部分裁剪导出失败:\n" + "\n".join(failed[:10]))
+        else:
+            self.update_workflow_status(step_completed=3)
     
     def save_crop(self):
-        """Save cropped region"""
+        """Queue the cropped region for the writer pool"""
         if not self.crop_rect or not self.current_crop_image:
             messagebox.showwarning("警告", "请先选择裁剪区域")
             return
@@ -1202,20 +7135,20 @@ S 跳过当前"""
         y1, y2 = min(y1, y2), max(y1, y2)
         
         # Convert to original coordinates
-        orig_x1 = int(x1 / self.crop_scale_factor)
-        orig_y1 = int(y1 / self.crop_scale_factor)
-        orig_x2 = int(x2 / self.crop_scale_factor)
-        orig_y2 = int(y2 / self.crop_scale_factor)
+        orig_x1, orig_y1, orig_x2, orig_y2 = self.canvas_box_to_original(x1, y1, x2, y2)
+        
+        if orig_x2 - orig_x1 < 1 or orig_y2 - orig_y1 < 1:
+            return
         
         try:
-            cropped = self.current_crop_image.crop((orig_x1, orig_y1, orig_x2, orig_y2))
-            
             # Generate filename
             original_name = Path(self.crop_images[self.crop_current_index]).stem
             output_path = os.path.join(self.crop_output_folder,
                                       f"{original_name}_crop_{self.crop_count:03d}.jpg")
             
-            cropped.save(output_path, quality=95)
+            # The writer opens its own handle on the source, encoding happens off the Tk thread
+            self.crop_writer.submit(self.crop_images[self.crop_current_index],
+                                    (orig_x1, orig_y1, orig_x2, orig_y2), output_path)
             self.crop_count += 1
             
             # Clear rectangle
@@ -1223,31 +7156,33 @@ S 跳过当前"""
             self.crop_rect = None
             
             # Update info
-            self.crop_info.config(text=f"已裁剪: {self.crop_count} 张 - 保存成功!")
+            self.update_crop_info(" - 已加入保存队列")
             
         except Exception as e:
             messagebox.showerror("错误", f"保存裁剪失败: {str(e)}")
     
     def prev_crop_image(self):
         """Go to previous image"""
+        self.save_crop_proposals()
         if self.crop_current_index > 0:
             self.crop_current_index -= 1
             self.display_crop_image()
     
     def next_crop_image(self):
         """Go to next image"""
+        self.save_crop_proposals()
         if self.crop_current_index < len(self.crop_images) - 1:
             self.crop_current_index += 1
             self.display_crop_image()
-        else:
+        elif not self.crop_indexer:
             messagebox.showinfo("完成", 
-                f"所有图像已浏览完成！\n共裁剪: {self.crop_count} 张\n输出文件夹: {self.crop_output_folder}")
+                f"所有图像已浏览完成！\n共裁剪: {self.crop_count - self.crop_failed} 张\n输出文件夹: {self.crop_output_folder}")
             self.update_workflow_status(step_completed=3)
     
     # Global keyboard shortcuts
     def on_global_key_press(self, event):
         """Handle global keyboard shortcuts"""
-        # Only process if we're in sorting tab
+        # Sorting and cropping tabs have their own keys
         if self.notebook.index("current") == 1:  # Sorting tab
             key = event.keysym.lower()
             
@@ -1263,13 +7198,479 @@ S 跳过当前"""
                 self.save_sorted_image('both')
             elif key == 'u':
                 self.undo_sort_action()
+            elif key == 'r':
+                self.redo_sort_action()
             elif key == 's':
                 self.skip_sort_image()
+            elif key == 'g':
+                self.open_cluster_view()
+        elif self.notebook.index("current") == 2 and self.crop_images:  # Cropping tab
+            key = event.keysym.lower()
+            
+            if key == 'left':
+                self.prev_crop_image()
+            elif key == 'right':
+                self.next_crop_image()
+            elif key == 'a':
+                self.accept_crop_proposals()
+            elif key == 'x':
+                self.reject_crop_proposals()
+            elif key in ('plus', 'equal', 'kp_add'):
+                self.zoom_crop_view(1.25)
+            elif key in ('minus', 'kp_subtract'):
+                self.zoom_crop_view(1 / 1.25)
+            elif key == '0':
+                self.reset_crop_zoom()
 
 
-def main():
+def parse_aspect(value):
+    """'4:5' or '0.8' as width / height"""
+    if ':' in value:
+        width, height = value.split(':', 1)
+        return float(width) / float(height)
+    return float(value)
+
+
+def export_crops_command(args):
+    """Headless re-export of a crop folder's recipes"""
+    def progress(done, total):
+        if done % 50 == 0 or done == total:
+            print(f"  {done}/{total}")
+    
+    start = time.perf_counter()
+    summary = export_crop_recipes(args.crop_folder, args.output, args.format, args.size, args.quality,
+                                  args.padding, args.aspect, args.workers, args.force, progress)
+    print(f"Exported {summary['exported']}, up to date {summary['skipped']} "
+          f"({time.perf_counter() - start:.1f} s)")
+    for label in ('stale', 'missing', 'failed'):
+        if summary[label]:
+            print(f"{label.capitalize()} ({len(summary[label])}):")
+            for name in summary[label][:20]:
+                print(f"  {name}")
+    return 1 if summary['failed'] else 0
+
+
+def export_dataset_command(args):
+    """Headless sharded dataset export of a sorted folder"""
+    classes = tuple(c.strip() for c in args.classes.split(',') if c.strip())
+    unknown = [c for c in classes if c not in DATASET_CLASSES]
+    if unknown:
+        print(f"Unknown classes: {', '.join(unknown)} (choose from {', '.join(DATASET_CLASSES)})")
+        return 2
+    
+    start = time.perf_counter()
+    index = export_dataset_shards(args.sorted_folder, args.output or os.path.join(args.sorted_folder, 'Dataset'),
+                                  args.shard_size, int(args.max_shard_mb * 1024 * 1024) or None, classes,
+                                  args.prefix, args.workers,
+                                  lambda done, total: print(f"  shard {done}/{total}"))
+    total_mb = sum(shard['bytes'] for shard in index['shards']) / 1024 / 1024
+    print(f"{index['samples']} samples in {len(index['shards'])} shards, {total_mb:.1f} MB "
+          f"({time.perf_counter() - start:.1f} s)")
+    for entry in index['skipped']:
+        print(f"  skipped {entry['file']}: {entry['error']}")
+    return 0
+
+
+def pack_command(args):
+    count = pack_keyframe_folder(args.folder, args.remove_files)
+    print(f"Packed {count} images into {os.path.join(args.folder, KEYFRAME_PACK_INDEX_FILENAME)}")
+    return 0
+
+
+def unpack_command(args):
+    count = unpack_keyframe_folder(args.folder, args.remove_pack)
+    print(f"Wrote {count} images to {args.folder}")
+    return 0
+
+
+def profile_startup_command(args):
+    root = tk.Tk()
+    mark_startup('Tk root')
+    app = HistoricalSceneApp(root)
+    root.update()
+    mark_startup('first paint')
+    first_paint = STARTUP_MARKS[-1][1]
+    
+    # What a user pays on the first visit of the other tabs
+    for index in range(len(app.tab_builders)):
+        app.ensure_tab(index)
+    deferred = preload_heavy_modules()
+    root.destroy()
+    
+    origin = STARTUP_MARKS[0][1]
+    steps = [(label, end - start) for (_, start), (label, end) in zip(STARTUP_MARKS, STARTUP_MARKS[1:])]
+    if args.json:
+        print(json.dumps({'steps': [{'label': label, 'ms': round(seconds * 1000, 2)} for label, seconds in steps],
+                          'first_paint_ms': round((first_paint - origin) * 1000, 2),
+                          'deferred_imports': [{'module': name, 'ms': round(seconds * 1000, 2)}
+                                               for name, seconds in deferred]}, indent=2))
+        return 0
+    print(f"{'step':<32} {'ms':>9} {'total ms':>10}")
+    for (label, seconds), (_, end) in zip(steps, STARTUP_MARKS[1:]):
+        print(f"{label:<32} {seconds * 1000:>9.1f} {(end - origin) * 1000:>10.1f}")
+    print("\nDeferred imports (background thread or first use):")
+    for name, seconds in deferred:
+        print(f"  {name:<30} {seconds * 1000:>9.1f}")
+    return 0
+
+
+def watch_command(args):
+    settings = dict(DEFAULT_EXTRACTION_SETTINGS)
+    settings['scene_threshold'] = args.threshold
+    settings['keyframe_storage'] = args.storage
+    settings['jpeg_quality'] = args.quality
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            print(f"Not a folder: {folder}", file=sys.stderr)
+            return 1
+    state_path = args.state or os.path.join(args.folders[0], '.watch_state.json')
+    
+    def log(message):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+    
+    daemon = WatchFolderDaemon(args.folders, settings, state_path, args.workers, args.settle,
+                               args.poll, args.retry_failed, log)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run(once=args.once)
+    return 0
+
+
+def pipeline_command(args):
+    settings = {'scene_threshold': args.threshold, 'jpeg_quality': args.quality,
+                'autoclass_max_side': args.max_side, 'autoclass_human_threshold': args.human_threshold,
+                'autoclass_background_threshold': args.background_threshold, 'unsure': args.unsure,
+                'crop_people': not args.no_crops, 'crop_min_score': args.min_crop_score}
+    if not human_detection_available():
+        print("This OpenCV build has no HOG/Haar detectors", file=sys.stderr)
+        return 1
+    
+    failed = 0
+    for video_path in args.videos:
+        def progress(done, total):
+            print(f"\r{os.path.basename(video_path)}: {done}/{total} frames", end='', file=sys.stderr, flush=True)
+        
+        try:
+            report = run_streaming_pipeline(video_path, settings, args.output if len(args.videos) == 1 else None,
+                                            args.workers, on_progress=None if args.quiet else progress)
+        except (OSError, RuntimeError) as e:
+            failed += 1
+            print(f"\n{video_path}: {e}", file=sys.stderr)
+            continue
+        if not args.quiet:
+            print(file=sys.stderr)
+        labels = report['labels']
+        print(f"{report['video_name']}: {report['keyframes_detected']} keyframes, "
+              f"{labels['background']} background, {labels['human']} human, {labels['both']} both, "
+              f"{labels['skip']} unsure skipped, {report['crops']} crops in {report['seconds']:.1f}s "
+              f"-> {report['output_folder']}")
+    return 1 if failed else 0
+
+
+def serve_command(args):
+    from http.server import ThreadingHTTPServer
+    
+    def log(message):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+    
+    def terminate(*_):
+        raise KeyboardInterrupt
+    
+    service = JobService(args.state_dir, args.workers, log)
+    # Loopback only: the service accepts file paths and runs work on this machine
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), job_request_handler_class())
+    server.daemon_threads = True
+    server.service = service
+    server.token = job_service_token(args.state_dir, create=True)
+    service.start()
+    signal.signal(signal.SIGTERM, terminate)
+    log(f"Job service on http://127.0.0.1:{server.server_address[1]}, {service.workers} worker(s), "
+        f"state in {args.state_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("Stopping, running jobs are re-queued on the next start")
+    finally:
+        server.server_close()
+        service.stop()
+    return 0
+
+
+def job_api_request(url, token, payload=None, timeout=60):
+    """JSON request to the job service, ignoring any HTTP proxy settings"""
+    import urllib.request
+    import urllib.error
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json',
+                                                              'Authorization': f"Bearer {token}"})
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise SystemExit(f"{e.code}: {json.load(e).get('error')}")
+    except urllib.error.URLError as e:
+        raise SystemExit(f"Job service not reachable at {url}: {e.reason}")
+
+
+def format_job(job):
+    progress = job.get('progress')
+    line = f"{job['id']}  {job['kind']:<15} {job['status']:<10}"
+    if job['status'] == 'running' and progress and progress['total']:
+        line += f" {progress['done'] / progress['total']:.0%}"
+    if job.get('error'):
+        line += f" {job['error']}"
+    return line
+
+
+def jobs_command(args):
+    """Small client for the job service, mostly for testing it"""
+    base = f"http://127.0.0.1:{args.port}/jobs"
+    token = job_service_token(args.state_dir)
+    if token is None:
+        raise SystemExit(f"No job service token in {args.state_dir}, start the service with serve first")
+    if args.action == 'list':
+        for job in job_api_request(base, token)['jobs']:
+            print(format_job(job))
+        return 0
+    
+    if args.action == 'submit':
+        if args.kind == 'extract':
+            settings = {}
+            if args.threshold is not None:
+                settings['scene_threshold'] = args.threshold
+            if args.storage:
+                settings['keyframe_storage'] = args.storage
+            params = {'video_path': os.path.abspath(args.path), 'settings': settings}
+        elif args.kind == 'export-crops':
+            params = {'crop_folder': os.path.abspath(args.path), 'format': args.format}
+        else:
+            params = {'sorted_folder': os.path.abspath(args.path)}
+        if args.output and args.kind != 'extract':
+            params['output'] = os.path.abspath(args.output)
+        job = job_api_request(base, token, {'kind': args.kind, 'params': params})
+        print(format_job(job))
+        if not args.follow:
+            return 0
+        args.job_id = job['id']
+    
+    if args.action == 'cancel':
+        print(format_job(job_api_request(f"{base}/{args.job_id}/cancel", token, {})))
+        return 0
+    if args.action == 'outputs':
+        outputs = job_api_request(f"{base}/{args.job_id}/outputs", token)
+        print(outputs['output_folder'])
+        for entry in outputs['files']:
+            print(f"  {entry['name']}  {entry['size']:,}")
+        return 0
+    
+    # status, or follow with long-polling until the job finishes
+    job = job_api_request(f"{base}/{args.job_id}", token)
+    shown = format_job(job)
+    print(shown)
+    while (args.action != 'status') and job['status'] not in JOB_FINISHED_STATES:
+        job = job_api_request(f"{base}/{args.job_id}?since={job['version']}&wait=30", token, timeout=60)
+        if format_job(job) != shown:
+            shown = format_job(job)
+            print(shown)
+    if job['status'] == 'done' and args.action != 'status':
+        print(json.dumps(job['result'], ensure_ascii=False, indent=2)[:2000])
+    return 1 if job['status'] == 'failed' else 0
+
+
+def catalog_command(args):
+    catalog = ProjectCatalog(args.catalog)
+    if args.action == 'scan':
+        for folder in args.folders:
+            folder = os.path.abspath(folder)
+            candidates = [folder] if folder.endswith('_keyframes') else sorted(
+                entry.path for entry in os.scandir(folder) if entry.is_dir() and entry.name.endswith('_keyframes'))
+            for keyframes_folder in candidates:
+                keyframes, labelled, crops = catalog.scan_project(keyframes_folder)
+                print(f"{keyframes_folder}: {keyframes} keyframes, {labelled} sorted, {crops} crops")
+        return 0
+    
+    if args.action == 'projects':
+        print(f"{'video':<32} {'keyframes':>9} {'sorted':>7} {'human':>6} {'crops':>6}  folder")
+        for project in catalog.projects():
+            print(f"{project['video_name'][:32]:<32} {project['keyframes']:>9} {project['labelled']:>7} "
+                  f"{project['human']:>6} {project['crops']:>6}  {project['keyframes_folder']}")
+        return 0
+    
+    rows = catalog.query(args.video, args.label, args.from_minute, args.to_minute, args.has_crops, args.limit)
+    if args.copy_to:
+        os.makedirs(args.copy_to, exist_ok=True)
+        failed = 0
+        for row in rows:
+            try:
+                materialise_file(catalog_keyframe_path(row), os.path.join(args.copy_to, row['name']), args.strategy)
+            except OSError as e:
+                failed += 1
+                print(f"  {row['name']}: {e}")
+        print(f"Placed {len(rows) - failed} of {len(rows)} keyframes in {args.copy_to}")
+        return 1 if failed else 0
+    if args.json:
+        print(json.dumps([dict(row, path=catalog_keyframe_path(row)) for row in rows], ensure_ascii=False, indent=1))
+    elif args.paths:
+        for row in rows:
+            print(catalog_keyframe_path(row))
+    else:
+        for row in rows:
+            timestamp = row['timestamp'] or 0
+            score = f"{row['scene_score']:.2f}" if row['scene_score'] is not None else '-'
+            print(f"{row['video_name'][:24]:<24} {int(timestamp // 60):>3}:{int(timestamp % 60):02d} "
+                  f"{row['label'] or '-':<10} {score:>5} {row['crops']:>3}  {row['name']}")
+        print(f"{len(rows)} keyframes")
+    return 0
+
+
+def build_cli_parser():
+    parser = argparse.ArgumentParser(description="Historical scene processor, no arguments starts the GUI")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    export = commands.add_parser('export-crops', help="re-render saved crops with new output settings")
+    export.add_argument('crop_folder', help="Cropped_Figures folder holding .crop_recipes.jsonl")
+    export.add_argument('--output', help="output folder (default: <crop_folder>/Export)")
+    export.add_argument('--format', default='jpeg', choices=sorted(CROP_EXPORT_FORMATS))
+    export.add_argument('--size', type=int, help="longest side in pixels, crops are never upscaled")
+    export.add_argument('--quality', type=int, default=95, help="JPEG/WebP quality")
+    export.add_argument('--padding', type=float, default=0.0, help="extra margin as a fraction of the crop size")
+    export.add_argument('--aspect', type=parse_aspect, help="width:height, e.g. 1:1 or 4:5")
+    export.add_argument('--workers', type=int, help="worker processes")
+    export.add_argument('--force', action='store_true', help="re-render even if up to date")
+    export.set_defaults(handler=export_crops_command)
+    
+    dataset = commands.add_parser('export-dataset', help="pack a sorted folder into WebDataset tar shards")
+    dataset.add_argument('sorted_folder', help="folder containing Background/, Human/ and Cropped_Figures/")
+    dataset.add_argument('--output', help="output folder (default: <sorted_folder>/Dataset)")
+    dataset.add_argument('--shard-size', type=int, default=1000, help="samples per shard")
+    dataset.add_argument('--max-shard-mb', type=float, default=0, help="also cap shard payload size")
+    dataset.add_argument('--classes', default=','.join(DATASET_CLASSES), help="comma-separated subset")
+    dataset.add_argument('--prefix', default='shard', help="shard filename prefix")
+    dataset.add_argument('--workers', type=int, help="worker processes")
+    dataset.set_defaults(handler=export_dataset_command)
+    
+    pack = commands.add_parser('pack', help="pack a keyframe folder into a single data file")
+    pack.add_argument('folder')
+    pack.add_argument('--remove-files', action='store_true', help="delete the loose images once packed")
+    pack.set_defaults(handler=pack_command)
+    
+    unpack = commands.add_parser('unpack', help="write a packed keyframe folder back as image files")
+    unpack.add_argument('folder')
+    unpack.add_argument('--remove-pack', action='store_true', help="delete the pack once unpacked")
+    unpack.set_defaults(handler=unpack_command)
+    
+    watch = commands.add_parser('watch', help="extract keyframes from videos dropped into folders")
+    watch.add_argument('folders', nargs='+', help="folders to watch (not recursive)")
+    watch.add_argument('--workers', type=int, default=max(1, min(4, (os.cpu_count() or 2) // 2)),
+                       help="videos extracted in parallel")
+    watch.add_argument('--settle', type=float, default=10.0,
+                       help="seconds a file must stay unchanged before it is picked up")
+    watch.add_argument('--poll', type=float, default=10.0, help="seconds between folder rescans")
+    watch.add_argument('--state', help="state file (default: <first folder>/.watch_state.json)")
+    watch.add_argument('--threshold', type=float, default=DEFAULT_EXTRACTION_SETTINGS['scene_threshold'],
+                       help="scene change threshold")
+    watch.add_argument('--storage', default='files', choices=sorted(KEYFRAME_STORAGE_LABELS))
+    watch.add_argument('--quality', type=int, default=DEFAULT_EXTRACTION_SETTINGS['jpeg_quality'],
+                       help="JPEG quality")
+    watch.add_argument('--retry-failed', action='store_true', help="retry videos that failed before")
+    watch.add_argument('--once', action='store_true', help="process what is there now and exit")
+    watch.set_defaults(handler=watch_command)
+    
+    pipeline = commands.add_parser('pipeline', help="video to sorted keyframes and person crops in one pass")
+    pipeline.add_argument('videos', nargs='+')
+    pipeline.add_argument('--output', help="sorted folder, single video only (default: <video_name>_sorted)")
+    pipeline.add_argument('--threshold', type=float, default=DEFAULT_PIPELINE_SETTINGS['scene_threshold'],
+                          help="scene change threshold")
+    pipeline.add_argument('--quality', type=int, default=DEFAULT_PIPELINE_SETTINGS['jpeg_quality'],
+                          help="JPEG quality")
+    pipeline.add_argument('--max-side', type=int, default=DEFAULT_PIPELINE_SETTINGS['autoclass_max_side'],
+                          help="detection input size")
+    pipeline.add_argument('--human-threshold', type=float,
+                          default=DEFAULT_PIPELINE_SETTINGS['autoclass_human_threshold'])
+    pipeline.add_argument('--background-threshold', type=float,
+                          default=DEFAULT_PIPELINE_SETTINGS['autoclass_background_threshold'])
+    pipeline.add_argument('--unsure', default='skip', choices=PIPELINE_UNSURE_CHOICES,
+                          help="where keyframes between the thresholds go")
+    pipeline.add_argument('--min-crop-score', type=float, default=DEFAULT_PIPELINE_SETTINGS['crop_min_score'],
+                          help="person proposals at or above are cropped")
+    pipeline.add_argument('--no-crops', action='store_true', help="classify only")
+    pipeline.add_argument('--workers', type=int, help="detection and encoding threads")
+    pipeline.add_argument('--quiet', action='store_true', help="no progress output")
+    pipeline.set_defaults(handler=pipeline_command)
+    
+    serve = commands.add_parser('serve', help="run the local HTTP job service (127.0.0.1 only)")
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--workers', type=int, default=2, help="jobs run at the same time")
+    serve.add_argument('--state-dir', default=DEFAULT_JOB_SERVICE_DIR,
+                       help="where the job queue and the client token are kept")
+    serve.set_defaults(handler=serve_command)
+    
+    jobs = commands.add_parser('jobs', help="talk to a running job service")
+    jobs.add_argument('--port', type=int, default=8765)
+    jobs.add_argument('--state-dir', default=DEFAULT_JOB_SERVICE_DIR, help="the service's --state-dir, holds the token")
+    job_actions = jobs.add_subparsers(dest='action', required=True)
+    job_actions.add_parser('list')
+    submit = job_actions.add_parser('submit')
+    submit.add_argument('kind', choices=JOB_KINDS)
+    submit.add_argument('path', help="video, crop folder or sorted folder")
+    submit.add_argument('--threshold', type=float, help="scene change threshold (extract)")
+    submit.add_argument('--storage', choices=sorted(KEYFRAME_STORAGE_LABELS), help="keyframe storage (extract)")
+    submit.add_argument('--format', default='jpeg', choices=sorted(CROP_EXPORT_FORMATS), help="(export-crops)")
+    submit.add_argument('--output', help="output folder (exports)")
+    submit.add_argument('--follow', action='store_true', help="wait and show progress until it finishes")
+    for action in ('status', 'follow', 'cancel', 'outputs'):
+        job_actions.add_parser(action).add_argument('job_id')
+    jobs.set_defaults(handler=jobs_command)
+    
+    catalog = commands.add_parser('catalog', help="query the project catalog")
+    catalog.add_argument('--catalog', help="catalog file (default: HISTORICAL_SCENE_CATALOG or ~/.historical_scene_catalog.sqlite3)")
+    catalog_actions = catalog.add_subparsers(dest='action', required=True)
+    catalog_actions.add_parser('projects', help="list projects")
+    scan = catalog_actions.add_parser('scan', help="index existing project folders")
+    scan.add_argument('folders', nargs='+', help="*_keyframes folders or folders containing them")
+    query = catalog_actions.add_parser('query', help="find keyframes")
+    query.add_argument('--video', action='append', help="video name pattern, e.g. 'reel_0[3-7]*' (repeatable)")
+    query.add_argument('--label', action='append', choices=('background', 'human', 'both', 'skip'),
+                       help="sort label (repeatable), human and background include both")
+    query.add_argument('--from-minute', type=float)
+    query.add_argument('--to-minute', type=float)
+    query.add_argument('--has-crops', action='store_true', default=None)
+    query.add_argument('--no-crops', action='store_false', dest='has_crops')
+    query.add_argument('--limit', type=int)
+    query.add_argument('--paths', action='store_true', help="print image paths only")
+    query.add_argument('--json', action='store_true')
+    query.add_argument('--copy-to', help="place every match in this folder")
+    query.add_argument('--strategy', default='auto', choices=[s for s in SORT_STRATEGY_LABELS if s != 'move'],
+                       help="how --copy-to places files")
+    catalog.set_defaults(handler=catalog_command)
+    
+    profile = commands.add_parser('profile-startup', help="open the GUI once and print where startup time goes")
+    profile.add_argument('--json', action='store_true', help="machine-readable output")
+    profile.set_defaults(handler=profile_startup_command)
+    
+    # Recorded here so callers need not dig through argparse internals
+    parser.command_names = frozenset(commands.choices)
+    return parser
+
+
+def cli_command_names():
+    """Subcommands registered on the CLI parser"""
+    return build_cli_parser().command_names
+
+
+def main(argv=None):
+    multiprocessing.freeze_support()  # Detection workers in the frozen app
+    argv = sys.argv[1:] if argv is None else argv
+    # Anything else, e.g. a document path or -psn_* from the macOS app launcher, starts the GUI
+    if argv and (argv[0] in ('-h', '--help') or argv[0] in cli_command_names()):
+        args = build_cli_parser().parse_args(argv)
+        sys.exit(args.handler(args))
+    
     root = tk.Tk()
     app = HistoricalSceneApp(root)
+    # Jobs left queued or running at the last close carry on
+    app.extract_queue.start()
     
     # Center window
     root.update_idletasks()
@@ -1282,5 +7683,7 @@ def main():
     root.mainloop()
 
 
+mark_startup('module definitions')
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,95 @@
+"""Keyframe packs: write/read round trip, generations and pack/unpack of a folder"""
+
+import os
+
+import pytest
+
+import main_app
+from main_app import (KEYFRAME_PACK_INDEX_FILENAME, KeyframePack, KeyframePackWriter,
+                      pack_keyframe_folder, unpack_keyframe_folder)
+
+
+IMAGES = {'a.jpg': b'\xff\xd8first\xff\xd9', 'b.jpg': b'', 'c.png': b'\x89PNG' + bytes(range(256)) * 4}
+
+
+def write_pack(folder, images):
+    writer = KeyframePackWriter(str(folder))
+    for name, data in images.items():
+        writer.add(name, data)
+    writer.close()
+
+
+def data_files(folder):
+    return sorted(name for name in os.listdir(folder) if main_app.KEYFRAME_PACK_DATA_PATTERN.match(name))
+
+
+def test_pack_round_trip(tmp_path):
+    write_pack(tmp_path, IMAGES)
+
+    pack = KeyframePack(str(tmp_path))
+    try:
+        assert len(pack) == len(IMAGES)
+        assert pack.names == list(IMAGES)
+        for i, (name, data) in enumerate(IMAGES.items()):
+            assert pack.read(i) == data
+            assert pack.read_name(name) == data
+        assert pack.generation == 1
+    finally:
+        pack.close()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(('.part', '.tmp'))]
+
+
+def test_rewrite_switches_generation(tmp_path):
+    write_pack(tmp_path, IMAGES)
+    old = KeyframePack(str(tmp_path))
+    try:
+        write_pack(tmp_path, {'d.jpg': b'second'})
+        # A reader holding the old map keeps a consistent view
+        assert old.read_name('a.jpg') == IMAGES['a.jpg']
+    finally:
+        old.close()
+
+    pack = KeyframePack(str(tmp_path))
+    try:
+        assert pack.generation == 2
+        assert pack.names == ['d.jpg']
+        assert pack.read_name('d.jpg') == b'second'
+    finally:
+        pack.close()
+    assert data_files(tmp_path) == ['keyframes.2.pack']
+
+
+def test_aborted_write_keeps_old_pack(tmp_path):
+    write_pack(tmp_path, IMAGES)
+    writer = KeyframePackWriter(str(tmp_path))
+    writer.add('d.jpg', b'unfinished')
+    writer.abort()
+
+    pack = KeyframePack(str(tmp_path))
+    try:
+        assert pack.names == list(IMAGES)
+        assert pack.read_name('c.png') == IMAGES['c.png']
+    finally:
+        pack.close()
+    assert data_files(tmp_path) == ['keyframes.1.pack']
+
+
+def test_pack_and_unpack_folder(tmp_path):
+    for name, data in IMAGES.items():
+        (tmp_path / name).write_bytes(data)
+
+    assert pack_keyframe_folder(str(tmp_path), remove_files=True) == len(IMAGES)
+    assert not [name for name in IMAGES if (tmp_path / name).exists()]
+    assert main_app.list_keyframe_names(str(tmp_path), ('.jpg', '.png')) == sorted(IMAGES)
+
+    assert unpack_keyframe_folder(str(tmp_path), remove_pack=True) == len(IMAGES)
+    for name, data in IMAGES.items():
+        assert (tmp_path / name).read_bytes() == data
+    assert not (tmp_path / KEYFRAME_PACK_INDEX_FILENAME).exists()
+    assert data_files(tmp_path) == []
+
+
+def test_missing_pack(tmp_path):
+    assert main_app.load_keyframe_pack(str(tmp_path)) is None
+    with pytest.raises(OSError):
+        KeyframePack(str(tmp_path))
@@ -0,0 +1,146 @@
+"""Crash recovery of the sort file queue and the sort session log"""
+
+import json
+import os
+import threading
+
+import main_app
+from main_app import SortFileQueue, SortSession
+
+
+def write_file(path, data=b'image'):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def read_records(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_queue_replays_half_written_journal(tmp_path):
+    human = tmp_path / 'Human'
+    human.mkdir()
+    for name in ('a.jpg', 'b.jpg'):
+        write_file(tmp_path / name)
+    journal = tmp_path / '.sort_journal.jsonl'
+
+    # a.jpg finished before the crash, b.jpg was journaled but never applied,
+    # and the crash tore the record written after it
+    done = {'kind': 'apply', 'folder': 'human', 'src': str(tmp_path / 'a.jpg'),
+            'dst': str(human / 'a.jpg'), 'strategy': 'copy', 'id': 1}
+    pending = dict(done, src=str(tmp_path / 'b.jpg'), dst=str(human / 'b.jpg'), id=2)
+    with open(journal, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'event': 'intent', 'id': 1, 'op': done}) + '\n')
+        f.write(json.dumps({'event': 'done', 'id': 1, 'used': 'copy'}) + '\n')
+        f.write(json.dumps({'event': 'intent', 'id': 2, 'op': pending}) + '\n')
+        f.write('{"event": "do')
+
+    sort_queue = SortFileQueue(str(journal))
+    try:
+        assert sort_queue.wait_idle(10)
+        assert (human / 'b.jpg').read_bytes() == b'image'
+        assert not (human / 'a.jpg').exists()  # Completed ops are not run again
+        assert sort_queue.results[1] == 'copy'
+        assert sort_queue.next_id == 3
+    finally:
+        sort_queue.close(10)
+
+    # Nothing pending, so the journal was compacted away
+    assert read_records(journal) == []
+
+
+def test_revert_cancels_queued_apply(tmp_path, monkeypatch):
+    human = tmp_path / 'Human'
+    human.mkdir()
+    for name in ('a.jpg', 'b.jpg'):
+        write_file(tmp_path / name)
+
+    # Hold the worker inside the first op so the second one stays queued
+    started, release = threading.Event(), threading.Event()
+    materialise_file = main_app.materialise_file
+
+    def blocking_materialise(src, dst, strategy):
+        started.set()
+        release.wait(10)
+        return materialise_file(src, dst, strategy)
+
+    monkeypatch.setattr(main_app, 'materialise_file', blocking_materialise)
+    journal = tmp_path / '.sort_journal.jsonl'
+    sort_queue = SortFileQueue(str(journal))
+    try:
+        first = sort_queue.apply('human', str(tmp_path / 'a.jpg'), str(human / 'a.jpg'), 'copy')
+        assert started.wait(10)
+        second = sort_queue.apply('human', str(tmp_path / 'b.jpg'), str(human / 'b.jpg'), 'copy')
+
+        assert sort_queue.revert(second, str(human / 'b.jpg'), 'copy', str(tmp_path / 'b.jpg')) is None
+        events = [(record['event'], record['id']) for record in read_records(journal)]
+        assert events == [('intent', first), ('intent', second), ('cancel', second)]
+
+        release.set()
+        assert sort_queue.wait_idle(10)
+        assert (human / 'a.jpg').exists()
+        assert not (human / 'b.jpg').exists()
+        assert (tmp_path / 'b.jpg').exists()
+
+        # An op that already ran is undone by a queued revert instead
+        assert sort_queue.revert(first, str(human / 'a.jpg'), 'copy', str(tmp_path / 'a.jpg')) is not None
+        assert sort_queue.wait_idle(10)
+        assert not (human / 'a.jpg').exists()
+        assert (tmp_path / 'a.jpg').exists()
+    finally:
+        release.set()
+        sort_queue.close(10)
+
+    # A cancelled op is not replayed when the folder is opened again
+    reopened = SortFileQueue(str(journal))
+    try:
+        assert reopened.depth() == 0
+    finally:
+        reopened.close(10)
+
+
+def test_session_compaction_keeps_history(tmp_path):
+    path = str(tmp_path / '.sort_session.jsonl')
+    session = SortSession(path)
+    undo_stack, redo_stack, cursor = session.load()
+    assert (undo_stack, redo_stack, cursor) == ([], [], None)
+
+    def item(n):
+        return [{'file': f'{n}.jpg', 'type': 'human', 'strategy': 'copy'}]
+
+    for n in range(5):
+        undo_stack.append(item(n))
+        session.append({'op': 'action', 'items': item(n)})
+    for _ in range(200):
+        session.append({'op': 'undo'})
+        session.append({'op': 'redo'})
+    for _ in range(2):
+        redo_stack.append(undo_stack.pop())
+        session.append({'op': 'undo'})
+    session.append({'op': 'cursor', 'file': '2.jpg'})
+
+    session.compact_if_needed(undo_stack, redo_stack, '2.jpg')
+    with open(path, 'r', encoding='utf-8') as f:
+        assert len(f.readlines()) == 8  # 5 actions, 2 undos and the cursor
+
+    # Records appended after compaction land in the rewritten log
+    session.append({'op': 'cursor', 'file': '3.jpg'})
+    session.close()
+
+    reloaded = SortSession(path)
+    try:
+        assert reloaded.load() == (undo_stack, redo_stack, '3.jpg')
+    finally:
+        reloaded.close()
+
+
+def test_session_small_log_is_not_compacted(tmp_path):
+    path = str(tmp_path / '.sort_session.jsonl')
+    session = SortSession(path)
+    session.load()
+    session.append({'op': 'action', 'items': []})
+    session.append({'op': 'undo'})
+    session.compact_if_needed([], [[]], None)
+    session.close()
+    assert [record['op'] for record in read_records(path)] == ['action', 'undo']